@@ -0,0 +1,66 @@
+# bench_metadata_scan.py
+#
+# Licensed under the Apache 2.0 license.
+#
+# Compares loading full IOC objects against reading only their metadata with scan.read_ioc_metadata() for a
+# directory of generated IOCs.
+#
+# Stdlib
+from __future__ import print_function
+import argparse
+import shutil
+import tempfile
+import timeit
+# Custom Code
+from ioc_writer import ioc_api
+from ioc_writer.managers import iter_ioc_files
+from ioc_writer.managers import scan
+
+
+def make_iocs(dirname, num_iocs, num_items):
+    for i in range(num_iocs):
+        ioc_obj = ioc_api.IOC(name='Benchmark IOC {}'.format(i), keywords='benchmark')
+        ioc_obj.add_link('grade', 'test')
+        for j in range(num_items):
+            ioc_obj.top_level_indicator.append(ioc_api.make_indicatoritem_node(ioc_api.IS, 'FileItem',
+                                                                               'FileItem/Md5sum', 'md5',
+                                                                               '{:032x}'.format(j)))
+        ioc_obj.write_ioc_to_file(dirname)
+
+
+def full_parse(fns, workers):
+    return [ioc_api.IOC(fn) for fn in fns]
+
+
+def metadata_scan(fns, workers):
+    return list(scan.scan_iocs(fns, workers=workers))
+
+
+def main(options):
+    dirname = tempfile.mkdtemp()
+    try:
+        make_iocs(dirname, options.num_iocs, options.num_items)
+        fns = list(iter_ioc_files(dirname))
+        print('{} IOCs with {} IndicatorItems each'.format(len(fns), options.num_items))
+        for func in (full_parse, metadata_scan):
+            t = min(timeit.repeat(lambda: func(fns, options.workers), number=1, repeat=options.repeat))
+            print('  {:<14} {:10.2f} ms'.format(func.__name__, t * 1000))
+    finally:
+        shutil.rmtree(dirname)
+
+
+def makeargpaser():
+    parser = argparse.ArgumentParser(description='Benchmark reading IOC metadata')
+    parser.add_argument('-i', '--iocs', dest='num_iocs', type=int, default=1000,
+                        help='Number of IOCs to generate')
+    parser.add_argument('-s', '--size', dest='num_items', type=int, default=200,
+                        help='Number of IndicatorItems in each generated IOC')
+    parser.add_argument('-w', '--workers', dest='workers', type=int, default=None,
+                        help='Number of worker processes used by the metadata scan')
+    parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=3,
+                        help='Number of timings to take the best of')
+    return parser
+
+
+if __name__ == '__main__':
+    main(makeargpaser().parse_args())
@@ -0,0 +1,58 @@
+# bench_namespace_stripping.py
+#
+# Licensed under the Apache 2.0 license.
+#
+# Compares the two-pass namespace removal (parse, then rename every element) against the single-pass
+# removal done by xmlutils.read_xml_no_ns() on large generated IOCs.
+#
+# Stdlib
+from __future__ import print_function
+import argparse
+import timeit
+# Custom Code
+from ioc_writer import ioc_api
+from ioc_writer.utils import xmlutils
+
+
+def make_ioc_data(num_items):
+    ioc_obj = ioc_api.IOC(name='Benchmark IOC')
+    for i in range(num_items // 2):
+        i_node = ioc_api.make_indicator_node(ioc_api.AND)
+        i_node.append(ioc_api.make_indicatoritem_node(ioc_api.IS, 'FileItem', 'FileItem/Md5sum', 'md5',
+                                                      '{:032x}'.format(i)))
+        i_node.append(ioc_api.make_indicatoritem_node(ioc_api.CONTAINS, 'FileItem', 'FileItem/FullPath', 'string',
+                                                      'C:\\Windows\\{}.exe'.format(i)))
+        ioc_obj.top_level_indicator.append(i_node)
+    return ioc_obj.write_ioc_to_string()
+
+
+def two_pass(data):
+    return xmlutils.delete_namespace(xmlutils.read_xml(data))
+
+
+def single_pass(data):
+    return xmlutils.read_xml_no_ns(data)
+
+
+def main(options):
+    for num_items in options.sizes:
+        data = make_ioc_data(num_items)
+        print('{} IndicatorItems, {} bytes'.format(num_items, len(data)))
+        for func in (two_pass, single_pass):
+            t = min(timeit.repeat(lambda: func(data), number=options.number, repeat=options.repeat))
+            print('  {:<12} {:10.2f} ms'.format(func.__name__, t * 1000 / options.number))
+
+
+def makeargpaser():
+    parser = argparse.ArgumentParser(description='Benchmark namespace removal while reading IOCs')
+    parser.add_argument('-s', '--sizes', dest='sizes', type=int, nargs='+', default=[100, 10000, 100000],
+                        help='Number of IndicatorItems in the generated IOCs')
+    parser.add_argument('-n', '--number', dest='number', type=int, default=3,
+                        help='Number of parses per timing')
+    parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=3,
+                        help='Number of timings to take the best of')
+    return parser
+
+
+if __name__ == '__main__':
+    main(makeargpaser().parse_args())
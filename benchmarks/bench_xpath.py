@@ -0,0 +1,80 @@
+# bench_xpath.py
+#
+# Licensed under the Apache 2.0 license.
+#
+# Compares formatting values into an XPath string and evaluating it with node.xpath(), which compiles the
+# expression on every call, against the precompiled expressions in ioc_writer.utils.xpaths.
+#
+# Stdlib
+from __future__ import print_function
+import argparse
+import timeit
+# Custom Code
+from ioc_writer import ioc_api
+from ioc_writer.utils import xpaths
+
+
+def make_ioc(num_items):
+    ioc_obj = ioc_api.IOC(name='Benchmark IOC')
+    for i in range(num_items // 2):
+        i_node = ioc_api.make_indicator_node(ioc_api.AND)
+        i_node.append(ioc_api.make_indicatoritem_node(ioc_api.IS, 'FileItem', 'FileItem/Md5sum', 'md5',
+                                                      '{:032x}'.format(i)))
+        i_node.append(ioc_api.make_indicatoritem_node(ioc_api.CONTAINS, 'FileItem', 'FileItem/FullPath', 'string',
+                                                      'C:\\Windows\\{}.exe'.format(i)))
+        ioc_obj.top_level_indicator.append(i_node)
+    return ioc_obj
+
+
+def attributes_formatted(ioc_obj):
+    for node in ioc_obj.top_level_indicator.iter('IndicatorItem'):
+        node.xpath('Context/@document')
+        node.xpath('Context/@search')
+        node.xpath('Content/@type')
+
+
+def attributes_compiled(ioc_obj):
+    for node in ioc_obj.top_level_indicator.iter('IndicatorItem'):
+        xpaths.CONTEXT_DOCUMENT(node)
+        xpaths.CONTEXT_SEARCH(node)
+        xpaths.CONTENT_TYPE(node)
+
+
+def conditions_formatted(ioc_obj):
+    for condition in ioc_api.VALID_INDICATORITEM_CONDITIONS:
+        ioc_obj.root.xpath('.//IndicatorItem[@condition="{}"]'.format(condition))
+
+
+def conditions_compiled(ioc_obj):
+    for condition in ioc_api.VALID_INDICATORITEM_CONDITIONS:
+        xpaths.ITEMS_BY_CONDITION(ioc_obj.root, condition=condition)
+
+
+BENCHMARKS = (('IndicatorItem attributes', attributes_formatted, attributes_compiled),
+              ('IndicatorItems by condition', conditions_formatted, conditions_compiled))
+
+
+def main(options):
+    for num_items in options.sizes:
+        ioc_obj = make_ioc(num_items)
+        print('{} IndicatorItems'.format(num_items))
+        for name, formatted, compiled in BENCHMARKS:
+            print('  {}'.format(name))
+            for func in (formatted, compiled):
+                t = min(timeit.repeat(lambda: func(ioc_obj), number=options.number, repeat=options.repeat))
+                print('    {:<24} {:10.2f} ms'.format(func.__name__, t * 1000 / options.number))
+
+
+def makeargpaser():
+    parser = argparse.ArgumentParser(description='Benchmark precompiled XPath expressions')
+    parser.add_argument('-s', '--sizes', dest='sizes', type=int, nargs='+', default=[100, 10000],
+                        help='Number of IndicatorItems in the generated IOCs')
+    parser.add_argument('-n', '--number', dest='number', type=int, default=3,
+                        help='Number of runs per timing')
+    parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=3,
+                        help='Number of timings to take the best of')
+    return parser
+
+
+if __name__ == '__main__':
+    main(makeargpaser().parse_args())
@@ -23,11 +23,18 @@ import argparse
 import logging
 import os
 import sys
+from lxml import etree as et
 import ioc_writer.managers as managers
 import ioc_writer.utils as utils
+from ioc_writer.utils import xpaths
 
 log = logging.getLogger(__name__)
 
+YARA_CONDITION_ITEMS = et.XPath('.//IndicatorItem[Context/@document = "Yara" and Context/@search != "Yara/Yara"]')
+YARA_STRING_ITEMS = et.XPath('.//IndicatorItem[Context/@search = "Yara/HexString" or '
+                             'Context/@search = "Yara/TextString" or '
+                             'Context/@search = "Yara/RegexString"]')
+
 
 class YaraConversionError(Exception):
     """
@@ -127,7 +134,7 @@ class YaraIOCManager(managers.IOCManager):
         ioc_obj = self.iocs[iocid]
         ids_to_process = set([])
         signatures = ''
-        for elem in ioc_obj.top_level_indicator.xpath('.//IndicatorItem[Context/@search = "Yara/Yara"]'):
+        for elem in xpaths.ITEMS_BY_SEARCH(ioc_obj.top_level_indicator, search='Yara/Yara'):
             signature = elem.findtext('Content')
             signatures = signatures + '\n' + signature
         if signatures:
@@ -138,8 +145,7 @@ class YaraIOCManager(managers.IOCManager):
         ioc_obj = self.iocs[iocid]
         ids_to_process = set([])
         tlo_id = ioc_obj.top_level_indicator.get('id')
-        for elem in ioc_obj.top_level_indicator.xpath(
-                './/IndicatorItem[Context/@document = "Yara" and Context/@search != "Yara/Yara"]'):
+        for elem in YARA_CONDITION_ITEMS(ioc_obj.top_level_indicator):
             current = elem
             elem_id = current.get('id')
             if elem_id in ids_to_process:
@@ -160,26 +166,26 @@ class YaraIOCManager(managers.IOCManager):
                     else:
                         current = parent
                 if current_id not in ids_to_process:
-                    current_ids_set = set(current.xpath('.//@id'))
+                    current_ids_set = set(xpaths.DESCENDANT_IDS(current))
                     ids_to_process = ids_to_process.union(current_ids_set)
         # add the tlo_id to the set of ids to process.  It is possible for it
         # to have parameters attached to it which may affect yara processing
         if len(ids_to_process) == 0:
             return None
         ids_to_process.add(tlo_id)
-        condition_string = self.get_yara_condition_string(ioc_obj.top_level_indicator, ioc_obj.parameters,
+        condition_string = self.get_yara_condition_string(ioc_obj.top_level_indicator, ioc_obj,
                                                           ids_to_process)
         return condition_string
 
-    def get_yara_condition_string(self, indicator_node, parameters_node, ids_to_process, condition_string='',
+    def get_yara_condition_string(self, indicator_node, ioc_obj, ids_to_process, condition_string='',
                                   joining_value='or'):
         """
         get_yara_condition_string
 
         input
             indicator_node: this is the node we walk down
-            parameters_node: this contains all the parameters in the ioc, so we
-                can look up parameters nodes as we walk them.
+            ioc_obj: the IOC being converted, so we can look up parameters
+                nodes as we walk them.
             ids_to_process: set of ids to upgrade
             condition_string: This represnts the yara condition string.  This
                 string grows as we walk nodes.
@@ -197,7 +203,7 @@ class YaraIOCManager(managers.IOCManager):
             raise YaraConversionError('indicator_node expected tag is [%s]' % expected_tag)
         is_set = None
         # print 'indicator node id [%s]' % str(indicator_node_id)
-        for param in parameters_node.xpath('.//param[@ref-id="{}"]'.format(indicator_node_id)):
+        for param in ioc_obj.get_params_by_ref_id(indicator_node_id):
             if param.attrib['name'] == 'yara/set':
                 is_set = True
                 set_count = param.findtext('value', None)
@@ -231,7 +237,7 @@ class YaraIOCManager(managers.IOCManager):
                     use_condition_template = False
                     negation = node.get('negate')
                     condition = node.get('condition')
-                    search = node.xpath('Context/@search')[0]
+                    search = xpaths.CONTEXT_SEARCH(node)[0]
                     content = node.findtext('Content')
 
                     yara_condition = self.condition_to_yara_map[condition]
@@ -267,9 +273,8 @@ class YaraIOCManager(managers.IOCManager):
                         mapping['identifier'] = content
                     # handle parameters
                     else:
-                        xp = './/param[@ref-id="{}" and (@name="yara/count" or @name="yara/offset/at" or' \
-                             ' @name="yara/offset/in")]'.format(node_id)
-                        params = parameters_node.xpath(xp)
+                        params = [param for param in ioc_obj.get_params_by_ref_id(node_id)
+                                  if param.get('name') in ('yara/count', 'yara/offset/at', 'yara/offset/in')]
                         if len(params) > 1:
                             msg = 'More than one condition parameters assigned to IndicatorItem [{}]'.format(node_id)
                             raise YaraConversionError(msg)
@@ -314,9 +319,9 @@ class YaraIOCManager(managers.IOCManager):
                     raise YaraConversionError('Indicator@operator is not and/or. [%s] has [%s]' % (id, operator))
                 # handle parameters
                 # XXX Temp POC
-                recursed_condition = self.get_yara_condition_string(node, parameters_node, ids_to_process, '', operator)
-                xp = './/param[@ref-id="{}" and @name="yara/set"]'.format(node_id)
-                if (not parameters_node.xpath(xp)) and has_siblings(node):
+                recursed_condition = self.get_yara_condition_string(node, ioc_obj, ids_to_process, '', operator)
+                is_child_set = any(param.get('name') == 'yara/set' for param in ioc_obj.get_params_by_ref_id(node_id))
+                if (not is_child_set) and has_siblings(node):
                     recursed_condition = '(%s)' % recursed_condition
 
                 if condition_string == '':
@@ -352,9 +357,7 @@ class YaraIOCManager(managers.IOCManager):
         stringlist = []
 
         ioc_obj = self.iocs[iocid]
-        xp = './/IndicatorItem[Context/@search = "Yara/HexString" or Context/@search = "Yara/TextString"' \
-             ' or Context/@search = "Yara/RegexString"]'
-        for node in ioc_obj.top_level_indicator.xpath(xp):
+        for node in YARA_STRING_ITEMS(ioc_obj.top_level_indicator):
             modifiers = []
 
             node_id = node.get('id')
@@ -364,9 +367,8 @@ class YaraIOCManager(managers.IOCManager):
             content_node = node.find('Content')
             context = context_node.get('search')
 
-            params = ioc_obj.parameters.xpath(
-                './/param[@ref-id="%s" and (@name="yara/wide" or @name="yara/ascii" or @name="yara/fullword")]' % str(
-                    node_id))
+            params = [param for param in ioc_obj.get_params_by_ref_id(str(node_id))
+                      if param.get('name') in ('yara/wide', 'yara/ascii', 'yara/fullword')]
             pc = node.get('preserve-case', None)
 
             if context != 'Yara/HexString':
@@ -403,7 +405,7 @@ class YaraIOCManager(managers.IOCManager):
                 value = value.replace('\n', ' ').replace('\r', ' ')
                 temp_string = '%s = "%s"' % (str(key), str(value))
                 metadata.append(temp_string)
-        for link in ioc_obj.metadata.xpath('.//link'):
+        for link in xpaths.LINKS(ioc_obj.metadata):
             rel = link.get('rel', None)
             if not rel:
                 raise YaraConversionError('link node without rel attribute [%s] is not schema compliant' % (str(iocid)))
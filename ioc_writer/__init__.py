@@ -1,6 +1,7 @@
 from ioc_writer import ioc_api
+from ioc_writer import ioc_compact
 from ioc_writer import ioc_et
 from ioc_writer import ioc_common
 from ioc_writer import utils
 from ioc_writer import managers
-__all__ = ['ioc_api', 'ioc_common', 'ioc_et', 'utils', 'managers']
\ No newline at end of file
+__all__ = ['ioc_api', 'ioc_compact', 'ioc_common', 'ioc_et', 'utils', 'managers']
\ No newline at end of file
@@ -18,13 +18,17 @@
 #
 # Provides an API for creating OpenIOC 1.1 IOC objects.
 #
+import binascii
+import hashlib
 import os
 import re
 import logging
 import textwrap
 from lxml import etree as et
+from ioc_writer import ioc_compact
 from ioc_writer import ioc_et
 from ioc_writer.utils import xmlutils
+from ioc_writer.utils import xpaths
 
 log = logging.getLogger(__name__)
 
@@ -51,6 +55,14 @@ VALID_INDICATORITEM_CONDITIONS = [IS,
 AND = 'AND'
 OR = 'OR'
 VALID_INDICATOR_OPERATORS = [AND, OR]
+# param attributes which are indexed by IOC.get_params_by_id(), get_params_by_ref_id() and get_params_by_name()
+PARAM_INDEX_ATTRIBUTES = ('id', 'ref-id', 'name')
+# Root elements of OpenIOC 1.1 and 1.0 documents, used to find the IOCs in a bundle
+IOC_ROOT_TAGS = ('OpenIOC', 'ioc')
+# Used by write_ioc_canonical() to parse serialized IOCs again.  Blank text is removed after parsing, and the
+# documents come from trees already held in memory, so the size limits are not needed.
+CANONICAL_PARSER_CONFIG = xmlutils.ParserConfig(remove_blank_text=False, huge_tree=True)
+
 
 class IOCParseError(Exception):
     pass
@@ -66,14 +78,21 @@ Useful class attributes:
 * parameters - The parameters node
 * top_level_indicator - The Top Level Indicator node, typically a OR node for a valid MIR IOC.
 * root - The root node of the lxml.ElementTree
+* source - The serialized document the IOC was parsed from, as bytes, if keep_source was set.  Otherwise None.
+* dirty - Set once the IOC has been modified through the methods of this class
 
-:param fn: This is a path to a file to open, or a string containing XML representing an IOC.
+:param fn: This is a path to a file to open, or a string containing XML representing an IOC.  When the type of input is
+ known, IOC.from_file() or IOC.from_bytes() avoid having to check if fn exists on disk.  Files containing many IOCs
+ may be read with IOC.iter_bundle().
 :param name: string, Name of the ioc
 :param description: string, description of the ioc
 :param author: string, author name/email address
 :param links: ist of tuples.  Each tuple should be in the form (rel, href, value).
 :param keywords: string.  This is normally a space delimited string of values that may be used as keywords
-:param iocid: GUID for the IOC.  This should not be specified under normal circumstances."""
+:param iocid: GUID for the IOC.  This should not be specified under normal circumstances.
+:param parser_config: xmlutils.ParserConfig object used when parsing fn.  Defaults to xmlutils.DEFAULT_PARSER_CONFIG.
+:param keep_source: If set, the document read from fn is kept in self.source, so it can be written out with
+ passthrough until the IOC is modified."""
 
     def __init__(self,
                  fn=None,
@@ -82,38 +101,276 @@ Useful class attributes:
                  author='IOC_api',
                  links=None,
                  keywords=None,
-                 iocid=None):
-        self.root = None
-        self.top_level_indicator = None
-        self.parameters = None
-        self.metadata = None
+                 iocid=None,
+                 parser_config=None,
+                 keep_source=False):
+        source = None
         if fn:
-            ioc_parts = self.open_ioc(fn)
-            self.root, self.metadata, self.top_level_indicator, self.parameters = ioc_parts
+            source, base_url = xmlutils.read_data(fn)
+            parsed_xml = None
+            if source is not None:
+                parsed_xml = xmlutils.read_xml_bytes_no_ns(source, parser_config, base_url)
+            ioc_parts = self.get_ioc_parts(parsed_xml)
         else:
             ioc_parts = self.make_ioc(name, description, author, links, keywords, iocid)
-            self.root, self.metadata, self.top_level_indicator, self.parameters = ioc_parts
+        self._init_parts(ioc_parts)
+        if keep_source:
+            self._set_source(source)
+
+    def _init_parts(self, ioc_parts):
+        """
+        Set the IOC elements and default display options on a new IOC object.
+
+        :param ioc_parts: tuple of root, metadata, top level indicator and parameters nodes.
+        :return:
+        """
+        self.root, self.metadata, self.top_level_indicator, self.parameters = ioc_parts
         self.iocid = self.root.get('id', 'NoID')
+        # Element indexes, built on first use by get_node_by_id() and the get_params_by_* methods
+        self._node_index = None
+        self._param_index = None
+        self._param_last = None
+        # The IOCBatch currently open on this IOC, if any
+        self._batch = None
+        # Functions called by _changed() when the IOC is modified through this class
+        self._change_callbacks = []
+        # The serialized document the IOC was parsed from, which write_ioc_to_file() and write_ioc_to_string() may
+        # write out in place of the IOC until it is modified
+        self.source = None
+        self.dirty = False
+        # Cached values of structural_hash() and content_hash(), cleared by _changed()
+        self._structural_hash = None
+        self._content_hash = None
         # Control whether or not parameters are displayed by __str__
         self.display_params = True
         self.display_desc_width = 120
         self.display_criteria_sep = '  '
 
+    @classmethod
+    def from_tree(cls, parsed_xml):
+        """
+        Create an IOC from a parsed document, which already has its namespaces removed.
+
+        :param parsed_xml: lxml._elementTree object, such as one returned by xmlutils.read_xml_no_ns().
+        :return: IOC object.
+        :raises: IOCParseError if the document is not a valid IOC.
+        """
+        ioc_obj = cls.__new__(cls)
+        ioc_obj._init_parts(cls.get_ioc_parts(parsed_xml))
+        return ioc_obj
+
+    @classmethod
+    def from_bytes(cls, data, parser_config=None, keep_source=False):
+        """
+        Create an IOC from a serialized document held in memory.
+
+        Unlike IOC(fn), the data is never checked against the filesystem.  Buffer objects, such as a bytearray or
+        memoryview, are parsed without being copied where possible.
+
+        :param data: bytes or a buffer object containing XML representing an IOC.
+        :param parser_config: xmlutils.ParserConfig object used when parsing data.
+        :param keep_source: If set, a copy of data is kept in self.source, as described in IOC().
+        :return: IOC object.
+        :raises: IOCParseError if the data fails to parse.
+        """
+        ioc_obj = cls.from_tree(xmlutils.read_xml_bytes_no_ns(data, parser_config))
+        if keep_source:
+            ioc_obj._set_source(data)
+        return ioc_obj
+
+    @classmethod
+    def from_file(cls, f, parser_config=None, keep_source=False):
+        """
+        Create an IOC from a file.
+
+        :param f: Path to a file, or a file object opened in binary mode.
+        :param parser_config: xmlutils.ParserConfig object used when parsing the file.
+        :param keep_source: If set, the contents of the file are kept in self.source, as described in IOC().
+        :return: IOC object.
+        :raises: IOCParseError if the file fails to parse.
+        """
+        data, base_url = xmlutils.read_file_data(f)
+        if data is None:
+            raise IOCParseError('Error occured parsing XML')
+        ioc_obj = cls.from_tree(xmlutils.read_xml_bytes_no_ns(data, parser_config, base_url))
+        if keep_source:
+            ioc_obj._set_source(data)
+        return ioc_obj
+
+    def _set_source(self, data):
+        """
+        Remember the serialized document the IOC was parsed from.  Unicode strings are not kept, since they are not
+        what a file would hold.
+
+        :param data: bytes or a buffer object, or None.
+        :return:
+        """
+        if isinstance(data, (bytearray, memoryview)):
+            data = bytes(data)
+        elif not isinstance(data, bytes):
+            data = None
+        self.source = data
+        self.dirty = False
+
+    @classmethod
+    def iter_bundle(cls, f, parser_config=None):
+        """
+        Create IOCs from a file which contains many IOCs, such as a feed which wraps OpenIOC documents in a single
+        root element.  The file is parsed incrementally, so memory use does not depend on the size of the file.
+
+        :param f: Path to a file, or a file object opened in binary mode.
+        :param parser_config: xmlutils.ParserConfig object used when parsing the file.
+        :return: A generator of IOC objects, one for each OpenIOC or ioc element in the file.
+        :raises: IOCParseError if the file fails to parse.
+        """
+        try:
+            for parsed_xml in xmlutils.iter_elements_no_ns(f, IOC_ROOT_TAGS, parser_config):
+                yield cls.from_tree(parsed_xml)
+        except (IOError, OSError, et.XMLSyntaxError):
+            log.exception('unable to parse bundle [{}]'.format(getattr(f, 'name', f)))
+            raise IOCParseError('Error occured parsing XML')
+
+    @classmethod
+    def from_compact(cls,
+                     indicator,
+                     name=None,
+                     description='Automatically generated IOC',
+                     author='IOC_api',
+                     links=None,
+                     keywords=None,
+                     iocid=None):
+        """
+        Create an IOC from a compact criteria tree, such as one returned by IOC.to_compact().  The ids of the
+        Indicator, IndicatorItem and param nodes are kept.
+
+        The remaining parameters describe the metadata of the new IOC, as in IOC().
+
+        :param indicator: ioc_compact.CompactIndicator object used as the top level Indicator.
+        :return: IOC object.
+        """
+        ioc_obj = cls(name=name, description=description, author=author, links=links, keywords=keywords, iocid=iocid)
+        top_level_indicator = make_node_from_compact(indicator, ioc_obj.parameters)
+        ioc_obj.top_level_indicator.getparent().replace(ioc_obj.top_level_indicator, top_level_indicator)
+        ioc_obj.top_level_indicator = top_level_indicator
+        return ioc_obj
+
+    def to_compact(self, terms=None):
+        """
+        Convert the criteria of the IOC, and the params attached to them, to the read only model in
+        ioc_writer.ioc_compact.  The compact tree does not change when the IOC is modified.
+
+        :param terms: ioc_compact.TermTable used to intern repeated values.  Defaults to ioc_compact.TERMS.
+        :return: ioc_compact.CompactIndicator object for the top level Indicator, or None if the IOC does not have a
+         top level Indicator.
+        """
+        if self.top_level_indicator is None:
+            return None
+        get_params = self.get_params_by_ref_id if len(self.parameters) else None
+        return make_compact_node(self.top_level_indicator, get_params, terms)
+
+    def structural_hash(self):
+        """
+        Get a hash of the criteria of the IOC, and the params attached to them, which does not depend on node ids or
+        on the order of the children of each Indicator.  IOCs with equivalent criteria have the same hash, regardless
+        of their metadata.  See ioc_compact.get_structural_digest() for the normalization applied.
+
+        The hash is cached until the IOC is modified through the methods of this class.
+
+        :return: Hex string, or None if the IOC does not have a top level Indicator.
+        """
+        if self._structural_hash is None:
+            tree = self.to_compact()
+            if tree is None:
+                return None
+            self._structural_hash = binascii.hexlify(ioc_compact.get_structural_digest(tree)).decode('ascii')
+        return self._structural_hash
+
+    def batch(self, set_lastmodified=True):
+        """
+        Group a set of edits to the criteria, so the schema ordering of Indicator children is restored once per
+        touched Indicator, and the last-modified date is set once, when the batch ends.
+
+        Usage example:
+        ::
+            with ioc_obj.batch() as batch:
+                for item in items:
+                    batch.add(make_indicatoritem_node(IS, 'FileItem', 'FileItem/Md5sum', 'md5', item))
+                batch.remove(old_id)
+
+        Batches may be nested; the work is done when the outermost batch ends.  Edits are applied as they are made,
+        and are not rolled back if an exception is raised.  In that case the ordering is still restored, but the
+        last-modified date is not changed.
+
+        :param set_lastmodified: If set, the last-modified date is set to the current date when the batch ends.
+        :return: IOCBatch object.
+        """
+        if self._batch is not None:
+            return self._batch
+        return IOCBatch(self, set_lastmodified)
+
+    def register_change_callback(self, func):
+        """
+        Register a function to be called whenever the IOC is modified through the methods of this class.  This is used
+        by IOCManager to keep its indexes up to date.  Changes made directly to the IOC elements are not reported,
+        unless mark_changed() is called afterwards.
+
+        :param func: A callable function.  This should accept a single input, which will be this IOC object.
+        :return:
+        """
+        if not hasattr(func, '__call__'):
+            raise TypeError('Provided function is not callable: {}'.format(func))
+        if func not in self._change_callbacks:
+            self._change_callbacks.append(func)
+
+    def unregister_change_callback(self, func):
+        """
+        Remove a function registered with register_change_callback().
+
+        :param func: The registered function.
+        :return: True if the function was registered.
+        """
+        if func in self._change_callbacks:
+            self._change_callbacks.remove(func)
+            return True
+        return False
+
+    def mark_changed(self):
+        """
+        Report changes made directly to the IOC elements.  This marks the IOC as dirty, so it is serialized by a
+        passthrough write instead of its source being copied, and calls the registered change callbacks.
+
+        :return:
+        """
+        self._changed()
+
+    def _changed(self):
+        """
+        Mark the IOC as dirty, clear the cached hashes, and report the modification to the registered change callbacks.
+
+        :return:
+        """
+        self.dirty = True
+        self._structural_hash = None
+        self._content_hash = None
+        for func in list(self._change_callbacks):
+            func(self)
+
     def __str__(self):
         return self.display_ioc(width=self.display_desc_width,
                                 sep=self.display_criteria_sep,
                                 params=self.display_params)
 
     @staticmethod
-    def open_ioc(fn):
+    def open_ioc(fn, parser_config=None):
         """
         Opens an IOC file, or XML string.  Returns the root element, top level
         indicator element, and parameters element.  If the IOC or string fails
         to parse, an IOCParseError is raised.
 
-        This is a helper function used by __init__.
+        IOC() reads the document itself, so the source bytes can be kept.
 
         :param fn: This is a path to a file to open, or a string containing XML representing an IOC.
+        :param parser_config: xmlutils.ParserConfig object used when parsing fn.
         :return: a tuple containing three elementTree Element objects
          The first element, the root, contains the entire IOC itself.
          The second element, the top level OR indicator, allows the user to add
@@ -121,7 +378,21 @@ Useful class attributes:
          The third element, the parameters node, allows the user to quickly
           parse the parameters.
         """
-        parsed_xml = xmlutils.read_xml_no_ns(fn)
+        parsed_xml = xmlutils.read_xml_no_ns(fn, parser_config)
+        return IOC.get_ioc_parts(parsed_xml)
+
+    @staticmethod
+    def get_ioc_parts(parsed_xml):
+        """
+        Get the root element, metadata element, top level indicator element, and parameters element from a parsed
+        IOC.  If the parameters element is missing, it is added to the IOC.
+
+        This is a helper function used by __init__, open_ioc and the from_* constructors.
+
+        :param parsed_xml: lxml._elementTree object with namespaces removed, or None if parsing failed.
+        :return: a tuple containing the root, metadata, top level indicator and parameters elements.
+        :raises: IOCParseError if parsed_xml is None.
+        """
         if not parsed_xml:
             raise IOCParseError('Error occured parsing XML')
         root = parsed_xml.getroot()
@@ -185,6 +456,7 @@ Useful class attributes:
             if not match:
                 raise IOCParseError('last-modified date is not valid.  Must be in the form YYYY-MM-DDTHH:MM:SS')
         ioc_et.set_root_lastmodified(self.root, date)
+        self._changed()
         return True
 
     def set_published_date(self, date=None):
@@ -203,6 +475,7 @@ Useful class attributes:
             if not match:
                 raise IOCParseError('Published date is not valid.  Must be in the form YYYY-MM-DDTHH:MM:SS')
         ioc_et.set_root_published_date(self.root, date)
+        self._changed()
         return True
 
     def set_created_date(self, date=None):
@@ -222,6 +495,7 @@ Useful class attributes:
                 raise IOCParseError('Created date is not valid.  Must be in the form YYYY-MM-DDTHH:MM:SS')
         # XXX can this use self.metadata?
         ioc_et.set_root_created_date(self.root, date)
+        self._changed()
         return True
 
     def add_parameter(self, indicator_id, content, name='comment', ptype='string'):
@@ -236,20 +510,249 @@ Useful class attributes:
         :raises: IOCParseError if the indicator_id is not associated with a Indicator or IndicatorItem in the IOC.
         """
         parameters_node = self.parameters
-        criteria_node = self.top_level_indicator.getparent()
         # first check for duplicate id,name pairs    
-        elems = parameters_node.xpath('.//param[@ref-id="{}" and @name="{}"]'.format(indicator_id, name))
+        elems = [param for param in self.get_params_by_ref_id(indicator_id) if param.get('name') == name]
         if len(elems) > 0:
             # there is no actual restriction on duplicate parameters
             log.info('Duplicate (id,name) parameter pair will be inserted [{}][{}].'.format(indicator_id, name))
         # now check to make sure the id is present in the IOC logic
-        elems = criteria_node.xpath(
-            './/IndicatorItem[@id="{}"]|.//Indicator[@id="{}"]'.format(indicator_id, indicator_id))
-        if len(elems) == 0:
+        if self.get_node_by_id(indicator_id) is None:
             raise IOCParseError('ID does not exist in the IOC [{}][{}].'.format(str(indicator_id), str(content)))
-        parameters_node.append(ioc_et.make_param_node(indicator_id, content, name, ptype))
+        param_node = ioc_et.make_param_node(indicator_id, content, name, ptype)
+        parameters_node.append(param_node)
+        self._index_param(param_node)
+        self._param_last = param_node
+        self._changed()
         return True
 
+    def add_item(self,
+                 parent_id,
+                 condition,
+                 document,
+                 search,
+                 content_type,
+                 content,
+                 preserve_case=False,
+                 negate=False,
+                 context_type='mir',
+                 nid=None):
+        """
+        Add an IndicatorItem to an Indicator.  The IndicatorItem is inserted after the existing IndicatorItem children
+        of the Indicator and before its Indicator children, so the criteria stay in schema order.
+
+        See make_indicatoritem_node() for a description of the parameters.
+
+        :param parent_id: id of the Indicator to add the IndicatorItem to.  If None, the top level Indicator is used.
+        :return: The new IndicatorItem node.
+        :raises: IOCParseError if the parent is not an Indicator in the IOC.
+        """
+        parent = self._get_parent_indicator(parent_id)
+        node = make_indicatoritem_node(condition, document, search, content_type, content,
+                                       preserve_case=preserve_case, negate=negate, context_type=context_type, nid=nid)
+        insert_indicatoritem_node(parent, node)
+        self._index_node(node)
+        self._changed()
+        return node
+
+    def add_indicator(self, parent_id, operator, nid=None):
+        """
+        Add an Indicator to an Indicator.  The Indicator is added after the existing children of the parent, so the
+        criteria stay in schema order.
+
+        :param parent_id: id of the Indicator to add the Indicator to.  If None, the top level Indicator is used.
+        :param operator: AND or OR.
+        :param nid: This is used to provide a GUID for the Indicator.  The ID should NOT be specified under normal
+         circumstances.
+        :return: The new Indicator node.
+        :raises: IOCParseError if the parent is not an Indicator in the IOC.
+        """
+        parent = self._get_parent_indicator(parent_id)
+        node = make_indicator_node(operator, nid=nid)
+        parent.append(node)
+        self._index_node(node)
+        self._changed()
+        return node
+
+    def _get_parent_indicator(self, parent_id):
+        """
+        :param parent_id: id of an Indicator.  If None, the top level Indicator is used.
+        :return: The Indicator node.
+        :raises: IOCParseError if the id is not an Indicator in the IOC.
+        """
+        if parent_id is None:
+            return self.top_level_indicator
+        parent = self.get_node_by_id(parent_id)
+        if parent is None or parent.tag != 'Indicator':
+            raise IOCParseError('Indicator does not exist in the IOC [{}]'.format(parent_id))
+        return parent
+
+    def _index_node(self, node):
+        """
+        Add a node, and any Indicator or IndicatorItem nodes underneath it, to the id index.
+
+        :param node: Indicator or IndicatorItem node which was added to the criteria.
+        :return:
+        """
+        if self._node_index is None:
+            return
+        for child in node.iter('Indicator', 'IndicatorItem'):
+            self._node_index.setdefault(child.get('id'), child)
+
+    def get_node_by_id(self, nid):
+        """
+        Get the Indicator or IndicatorItem node with a given id.  If the id has been reused within the IOC, the first
+        node in document order is returned.
+
+        Lookups use an index of the criteria, which is built on first use and kept up to date by the methods of this
+        class.  If the index does not hold a valid node for the id, which happens when the criteria are modified
+        directly, the id is looked up in the criteria and its index entry is updated.
+
+        :param nid: The Indicator/@id or IndicatorItem/@id value.
+        :return: The Indicator or IndicatorItem node, or None if the id is not present in the IOC.
+        """
+        if self._node_index is None:
+            self._build_node_index()
+            return self._node_index.get(nid)
+        node = self._node_index.get(nid)
+        if node is not None and self._is_criteria_node(node, nid):
+            return node
+        nodes = xpaths.CRITERIA_NODES_BY_ID(self.top_level_indicator.getparent(), nid=nid)
+        if not nodes:
+            self._node_index.pop(nid, None)
+            return None
+        self._node_index[nid] = nodes[0]
+        return nodes[0]
+
+    def _build_node_index(self):
+        """
+        Build the index of Indicator and IndicatorItem ids used by get_node_by_id().
+
+        :return:
+        """
+        index = {}
+        criteria_node = self.top_level_indicator.getparent()
+        for node in criteria_node.iter('Indicator', 'IndicatorItem'):
+            index.setdefault(node.get('id'), node)
+        self._node_index = index
+
+    def _is_criteria_node(self, node, nid):
+        """
+        Check that an indexed node still has its id and is still part of the criteria.
+
+        :param node: Indicator or IndicatorItem node.
+        :param nid: The id the node was indexed under.
+        :return: True if the node is valid.
+        """
+        if node.get('id') != nid:
+            return False
+        criteria_node = self.top_level_indicator.getparent()
+        for ancestor in node.iterancestors():
+            if ancestor is criteria_node:
+                return True
+        return False
+
+    def get_params_by_id(self, param_id):
+        """
+        Get the param nodes with a given id.  Parameter ids should be unique, but this is not enforced.
+
+        :param param_id: The param/@id value.
+        :return: A list of param nodes, in document order.
+        """
+        return self._get_params('id', param_id)
+
+    def get_params_by_ref_id(self, ref_id):
+        """
+        Get the param nodes attached to an Indicator or IndicatorItem.
+
+        :param ref_id: The param/@ref-id value.
+        :return: A list of param nodes, in document order.
+        """
+        return self._get_params('ref-id', ref_id)
+
+    def get_params_by_name(self, name):
+        """
+        Get the param nodes with a given name.
+
+        :param name: The param/@name value.
+        :return: A list of param nodes, in document order.
+        """
+        return self._get_params('name', name)
+
+    def _get_params(self, attribute, value):
+        """
+        Get the param nodes with a given attribute value.
+
+        Lookups use an index of the parameters, which is built on first use and kept up to date by the methods of
+        this class.  Removed param nodes are dropped from the index as they are found by lookups.  If params are
+        added to the parameters node directly, this is detected by checking the last param node, and the index is
+        rebuilt.
+
+        :param attribute: One of PARAM_INDEX_ATTRIBUTES.
+        :param value: The attribute value.
+        :return: A list of param nodes, in document order.
+        """
+        last = next(self.parameters.iterchildren(reversed=True), None)
+        if self._param_index is None or last is not self._param_last:
+            self._build_param_index()
+        params = self._param_index[attribute].get(value)
+        if not params:
+            return []
+        valid = [param for param in params if param.getparent() is self.parameters and param.get(attribute) == value]
+        if len(valid) != len(params):
+            self._param_index[attribute][value] = valid
+        return valid
+
+    def _build_param_index(self):
+        """
+        Build the index of param attributes used by _get_params().
+
+        :return:
+        """
+        self._param_index = dict((attribute, {}) for attribute in PARAM_INDEX_ATTRIBUTES)
+        for param in self.parameters.iterchildren('param'):
+            self._index_param(param)
+        self._param_last = next(self.parameters.iterchildren(reversed=True), None)
+
+    def _index_param(self, param):
+        """
+        Add a param node to the end of the param index.
+
+        :param param: param node.
+        :return:
+        """
+        if self._param_index is None:
+            return
+        for attribute in PARAM_INDEX_ATTRIBUTES:
+            self._param_index[attribute].setdefault(param.get(attribute), []).append(param)
+
+    def _move_param(self, param, attribute, old_value):
+        """
+        Move a param node between entries of the param index, after one of its indexed attributes was changed.  The
+        param is placed in document order among the params already indexed under the new value.
+
+        :param param: param node, which must be a child of the parameters node.
+        :param attribute: One of PARAM_INDEX_ATTRIBUTES.
+        :param old_value: The previous value of the attribute.
+        :return:
+        """
+        if self._param_index is None:
+            return
+        index = self._param_index[attribute]
+        value = param.get(attribute)
+        if old_value in index:
+            index[old_value] = [p for p in index[old_value] if p is not param]
+        params = [p for p in index.get(value, []) if p.getparent() is self.parameters and p.get(attribute) == value]
+        position = self.parameters.index(param)
+        lo, hi = 0, len(params)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.parameters.index(params[mid]) < position:
+                lo = mid + 1
+            else:
+                hi = mid
+        params.insert(lo, param)
+        index[value] = params
+
     def add_link(self, rel, value, href=None):
         """
         Add a Link metadata element to the IOC.
@@ -265,6 +768,7 @@ Useful class attributes:
             self.metadata.append(links_node)
         link_node = ioc_et.make_link_node(rel, value, href)
         links_node.append(link_node)
+        self._changed()
         return True
 
     def update_name(self, name):
@@ -284,6 +788,7 @@ Useful class attributes:
             self.metadata.insert(0, short_desc_node)
         else:
             short_desc_node.text = name
+        self._changed()
         return True
 
     def update_description(self, description):
@@ -308,6 +813,7 @@ Useful class attributes:
             self.metadata.insert(insert_index, desc_node)
         else:
             desc_node.text = description
+        self._changed()
         return True
 
     def update_link_rel_based(self, old_rel, new_rel=None, new_text=None, single_link=False):
@@ -325,7 +831,7 @@ Useful class attributes:
         :param single_link: Determine if only the first, or multiple, linkes are modified.
         :return: True, unless there are no links with link[@rel='old_rel']
         """
-        links = self.metadata.xpath('./links/link[@rel="{}"]'.format(old_rel))
+        links = xpaths.LINKS_BY_REL(self.metadata, rel=old_rel)
         if len(links) < 1:
             log.warning('No links with link/[@rel="{}"]'.format(str(old_rel)))
             return False
@@ -347,6 +853,7 @@ Useful class attributes:
         else:
             log.warning('Must specify either new_rel or new_text arguments')
             return False
+        self._changed()
         return True
 
     def update_link_rewrite(self, old_rel, old_text, new_text, single_link=False):
@@ -362,7 +869,7 @@ Useful class attributes:
         :param single_link: Determine if only the first, or multiple, linkes are modified.
         :return: True, unless there are no links with link/[@rel='old_rel' and text()='old_text']
         """
-        links = self.metadata.xpath('./links/link[@rel="{}" and text()="{}"]'.format(old_rel, old_text))
+        links = xpaths.LINKS_BY_REL_AND_TEXT(self.metadata, rel=old_rel, text=old_text)
         if len(links) < 1:
             log.warning('No links with link/[@rel="{}"and text()="{}"]'.format(str(old_rel), str(old_text)))
             return False
@@ -370,6 +877,7 @@ Useful class attributes:
             link.text = new_text
             if single_link:
                 break
+        self._changed()
         return True
 
     def update_parameter(self, parameter_id, content=None, name=None, param_type=None):
@@ -388,8 +896,7 @@ Useful class attributes:
         if not (content or name or param_type):
             log.warning('Must specify at least the value/text(), param/@name or the value/@type values to update.')
             return False
-        parameters_node = self.parameters
-        elems = parameters_node.xpath('.//param[@id="{}"]'.format(parameter_id))
+        elems = self.get_params_by_id(parameter_id)
         if len(elems) != 1:
             msg = 'Did not find a single parameter with the supplied ID[{}]. Found [{}] parameters'.format(parameter_id,
                                                                                                            len(elems))
@@ -399,7 +906,9 @@ Useful class attributes:
         value_node = param_node.find('value')
 
         if name:
+            old_name = param_node.get('name')
             param_node.attrib['name'] = name
+            self._move_param(param_node, 'name', old_name)
 
         if value_node is None:
             msg = 'No value node is associated with param [{}].  Not updating value node with content or tuple.' \
@@ -410,6 +919,7 @@ Useful class attributes:
                 value_node.text = content
             if param_type:
                 value_node.attrib['type'] = param_type
+        self._changed()
         return True
 
     def remove_link(self, rel, value=None, href=None):
@@ -432,7 +942,7 @@ Useful class attributes:
             log.warning('No links node present')
             return False
         counter = 0
-        links = links_node.xpath('.//link[@rel="{}"]'.format(rel))
+        links = xpaths.LINKS_BY_REL(links_node, rel=rel)
         for link in links:
             if value and href:
                 if link.text == value and link.attrib['href'] == href:
@@ -449,6 +959,8 @@ Useful class attributes:
             else:
                 links_node.remove(link)
                 counter += 1
+        if counter:
+            self._changed()
         return counter
 
     def remove_indicator(self, nid, prune=False):
@@ -471,34 +983,55 @@ Useful class attributes:
          False, the children nodes will be promoted to be children of the removed nodes' parent.
         :return: True if nodes are removed, False otherwise.
         """
-        try:
-            node_to_remove = self.top_level_indicator.xpath(
-                '//IndicatorItem[@id="{}"]|//Indicator[@id="{}"]'.format(str(nid), str(nid)))[0]
-        except IndexError:
-            log.exception('Node [{}] not present'.format(nid))
+        nid = str(nid)
+        node_to_remove = self.get_node_by_id(nid)
+        if node_to_remove is None:
+            log.error('Node [{}] not present'.format(nid))
             return False
         if node_to_remove.tag == 'IndicatorItem':
             node_to_remove.getparent().remove(node_to_remove)
+            self._unindex_node(node_to_remove)
             self.remove_parameter(ref_id=nid)
+            self._changed()
             return True
         elif node_to_remove.tag == 'Indicator':
             if node_to_remove == self.top_level_indicator:
                 raise IOCParseError('Cannot remove the top level indicator')
             if prune:
-                pruned_ids = node_to_remove.xpath('.//@id')
+                pruned_ids = xpaths.DESCENDANT_IDS(node_to_remove)
                 node_to_remove.getparent().remove(node_to_remove)
+                for pruned_node in node_to_remove.iter('Indicator', 'IndicatorItem'):
+                    self._unindex_node(pruned_node)
                 for pruned_id in pruned_ids:
                     self.remove_parameter(ref_id=pruned_id)
             else:
+                parent = node_to_remove.getparent()
                 for child_node in node_to_remove.getchildren():
-                    node_to_remove.getparent().append(child_node)
-                node_to_remove.getparent().remove(node_to_remove)
+                    parent.append(child_node)
+                parent.remove(node_to_remove)
+                if self._batch is not None:
+                    self._batch.touched[id(parent)] = parent
+                else:
+                    fix_indicator_child_ordering(parent)
+                self._unindex_node(node_to_remove)
                 self.remove_parameter(ref_id=nid)
+            self._changed()
             return True
         else:
             raise IOCParseError(
                 'Bad tag found.  Expected "IndicatorItem" or "Indicator", got [[}]'.format(node_to_remove.tag))
 
+    def _unindex_node(self, node):
+        """
+        Remove an Indicator or IndicatorItem node from the id index.  If another node shares the id, it is found by
+        rebuilding the index on the next lookup.
+
+        :param node: Indicator or IndicatorItem node which was removed from the IOC.
+        :return:
+        """
+        if self._node_index is not None and self._node_index.get(node.get('id')) is node:
+            del self._node_index[node.get('id')]
+
     def remove_parameter(self, param_id=None, name=None, ref_id=None, ):
         """
         Removes parameters based on function arguments.
@@ -532,20 +1065,23 @@ Useful class attributes:
         parameters_node = self.parameters
 
         if param_id:
-            params = parameters_node.xpath('//param[@id="{}"]'.format(param_id))
+            params = self.get_params_by_id(param_id)
             for param in params:
                 parameters_node.remove(param)
                 counter += 1
         elif name:
-            params = parameters_node.xpath('//param[@name="{}"]'.format(name))
+            params = self.get_params_by_name(name)
             for param in params:
                 parameters_node.remove(param)
                 counter += 1
         elif ref_id:
-            params = parameters_node.xpath('//param[@ref-id="{}"]'.format(ref_id))
+            params = self.get_params_by_ref_id(ref_id)
             for param in params:
                 parameters_node.remove(param)
                 counter += 1
+        self._param_last = next(parameters_node.iterchildren(reversed=True), None)
+        if counter:
+            self._changed()
         return counter
 
     def remove_name(self):
@@ -557,6 +1093,7 @@ Useful class attributes:
         short_description_node = self.metadata.find('short_description')
         if short_description_node is not None:
             self.metadata.remove(short_description_node)
+            self._changed()
             return True
         return False
 
@@ -569,27 +1106,65 @@ Useful class attributes:
         description_node = self.metadata.find('description')
         if description_node is not None:
             self.metadata.remove(description_node)
+            self._changed()
             return True
         return False
 
-    def write_ioc_to_file(self, output_dir=None, force=False):
+    def _get_clean_source(self, passthrough):
+        """
+        :param passthrough: If not set, None is returned.
+        :return: The source of the IOC, if it has not been modified since it was parsed, or None.
+        """
+        if not passthrough or self.dirty:
+            return None
+        return self.source
+
+    def write_ioc_to_file(self, output_dir=None, force=False, passthrough=False):
         """
         Serialize the IOC to a .ioc file.
 
         :param output_dir: Directory to write the ioc out to.  default is the current working directory.
         :param force: If specified, will not validate the root node of the IOC is 'OpenIOC'.
+        :param passthrough: If set, and the IOC was parsed with keep_source and has not been modified through the
+         methods of this class since, its source is written instead, and the file is not rewritten if it already
+         holds the source.  Only use this if the IOC elements have not been changed directly, or mark_changed() was
+         called afterwards.
         :return:
         """
-        return write_ioc(self.root, output_dir, force=force)
+        return write_ioc(self.root, output_dir, force=force, source=self._get_clean_source(passthrough))
 
-    def write_ioc_to_string(self, force=False):
+    def write_ioc_to_string(self, force=False, passthrough=False):
         """
         Serialize the IOC to a string.
 
         :param force: If specified, will not validate the root node of the IOC is 'OpenIOC'.
+        :param passthrough: If set, and the IOC has not been modified through the methods of this class since it was
+         parsed, its source is returned.  The same caveat applies as for write_ioc_to_file().
         :return: XML String.
         """
-        return write_ioc_string(self.root, force=force)
+        return write_ioc_string(self.root, force=force, source=self._get_clean_source(passthrough))
+
+    def write_ioc_to_canonical(self, force=False):
+        """
+        Serialize the IOC to its canonical form.  See write_ioc_canonical().
+
+        :param force: If specified, will not validate the root node of the IOC is 'OpenIOC'.
+        :return: Canonical XML, as bytes.
+        """
+        return write_ioc_canonical(self.root, force=force)
+
+    def content_hash(self):
+        """
+        Get a SHA256 hash of the canonical form of the IOC.  IOCs with the same content have the same hash, regardless
+        of how they were formatted or encoded.
+
+        The hash is cached until the IOC is modified through the methods of this class.
+
+        :return: Hex string.
+        """
+        if self._content_hash is None:
+            self._content_hash = hashlib.sha256(self.write_ioc_to_canonical(force=True)).hexdigest()
+        return self._content_hash
 
     def display_ioc(self, width=120, sep='  ', params=False):
         """
@@ -741,41 +1316,174 @@ Useful class attributes:
         :return:
         """
         r = []
-        params = self.parameters.xpath('.//param[@ref-id="{}"]'.format(nid))
+        params = self.get_params_by_ref_id(nid)
         if not params:
             return r
         for param in params:
             vnode = param.find('value')
             s = 'Parameter: {}, type:{}, value: {}'.format(param.attrib.get('name'),
-                                                           vnode.attrib.get('type'),
+                                                           None if vnode is None else vnode.attrib.get('type'),
                                                            param.findtext('value', default='No Value'))
             r.append(s)
         return r
 
 
-def fix_schema_node_ordering(parent):
+class IOCBatch(object):
+    """
+    Context manager returned by IOC.batch(), which collects edits to the criteria of an IOC.
+
+    :param ioc_obj: The IOC being edited.
+    :param set_lastmodified: If set, the last-modified date is set to the current date when the batch ends.
+    """
+    def __init__(self, ioc_obj, set_lastmodified=True):
+        self.ioc_obj = ioc_obj
+        self.set_lastmodified = set_lastmodified
+        self.touched = {}  # id(node) -> Indicator node whose children may be out of schema order
+        self.added = []  # Indicator nodes added with their own children
+        self.depth = 0
+
+    def __enter__(self):
+        if self.depth == 0:
+            self.ioc_obj._batch = self
+        self.depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.depth -= 1
+        if self.depth:
+            return False
+        self.ioc_obj._batch = None
+        self.commit(set_lastmodified=self.set_lastmodified and exc_type is None)
+        return False
+
+    def add(self, node, parent_id=None):
+        """
+        Append an Indicator or IndicatorItem node to an Indicator.
+
+        :param node: Indicator or IndicatorItem node, such as one made by make_indicator_node() or
+         make_indicatoritem_node().  An Indicator node may already have children.
+        :param parent_id: id of the Indicator to add the node to.  Defaults to the top level Indicator.
+        :return: The node.
+        :raises: IOCParseError if the parent is not an Indicator in the IOC.
+        """
+        parent = self.ioc_obj._get_parent_indicator(parent_id)
+        parent.append(node)
+        # Only an IndicatorItem after an Indicator is out of order
+        if node.tag == 'IndicatorItem':
+            self.touched[id(parent)] = parent
+        elif len(node):
+            self.added.append(node)
+        self.ioc_obj._index_node(node)
+        self.ioc_obj._changed()
+        return node
+
+    def remove(self, nid, prune=False):
         """
-        Fix the ordering of children under the criteria node to ensure that IndicatorItem/Indicator order
-         is preserved, as per XML Schema.
+        Remove an Indicator or IndicatorItem node.  See IOC.remove_indicator().
+
+        :param nid: The Indicator/@id or IndicatorItem/@id value indicating a specific node to remove.
+        :param prune: Remove all children of the deleted node.
+        :return: True if nodes are removed, False otherwise.
+        """
+        return self.ioc_obj.remove_indicator(nid, prune=prune)
+
+    def commit(self, set_lastmodified=True):
+        """
+        Restore the schema ordering of the Indicators touched by the batch, and set the last-modified date.
+        This is called when the batch ends.
+
+        :param set_lastmodified: If set, the last-modified date is set to the current date.
         :return:
         """
-        children = parent.getchildren()
-        i_nodes = [node for node in children if node.tag == 'IndicatorItem']
-        ii_nodes = [node for node in children if node.tag == 'Indicator']
-        if not ii_nodes:
-            return
-        # Remove all the children
-        for node in children:
-            parent.remove(node)
-        # Add the Indicator nodes back
-        for node in i_nodes:
-            parent.append(node)
-        # Now add the IndicatorItem nodes back
-        for node in ii_nodes:
-            parent.append(node)
-        # Now recurse
-        for node in ii_nodes:
-            fix_schema_node_ordering(node)
+        criteria_node = self.ioc_obj.top_level_indicator.getparent()
+        for node in self.added:
+            if criteria_node in node.iterancestors():
+                fix_schema_node_ordering(node)
+        for node in self.touched.values():
+            if node is self.ioc_obj.top_level_indicator or criteria_node in node.iterancestors():
+                fix_indicator_child_ordering(node)
+        self.touched = {}
+        self.added = []
+        if set_lastmodified:
+            self.ioc_obj.set_lastmodified_date()
+        else:
+            self.ioc_obj._changed()
+
+
+def fix_indicator_child_ordering(parent):
+    """
+    Move the Indicator children of a node after its IndicatorItem children, as required by the XML Schema.  Unlike
+    fix_schema_node_ordering(), this does not recurse, and children are only moved if they are out of order.
+
+    :param parent: Indicator node.
+    :return: True if any children were moved.
+    """
+    seen_indicator = False
+    for node in parent.iterchildren('Indicator', 'IndicatorItem'):
+        if node.tag == 'Indicator':
+            seen_indicator = True
+        elif seen_indicator:
+            break
+    else:
+        return False
+    for node in [node for node in parent.iterchildren('Indicator')]:
+        parent.append(node)
+    return True
+
+
+def fix_schema_node_ordering(parent):
+    """
+    Fix the ordering of children under the criteria node to ensure that IndicatorItem/Indicator order
+     is preserved, as per XML Schema.
+
+    Only Indicators whose children are out of order are changed, so this is cheap for trees which are already
+    in schema order.
+
+    :param parent: Indicator node, or the criteria node.
+    :return:
+    """
+    for node in list(parent.iter('Indicator')):
+        fix_indicator_child_ordering(node)
+
+
+def is_schema_ordered(parent):
+    """
+    Check that IndicatorItem children come before Indicator children, as per XML Schema, everywhere underneath
+    a node.
+
+    :param parent: Indicator node, or the criteria node.
+    :return: True if the nodes are in schema order.
+    """
+    for node in parent.iter('Indicator'):
+        seen_indicator = False
+        for child in node.iterchildren('Indicator', 'IndicatorItem'):
+            if child.tag == 'Indicator':
+                seen_indicator = True
+            elif seen_indicator:
+                return False
+    return True
+
+
+def insert_indicatoritem_node(parent, node):
+    """
+    Insert an IndicatorItem node after the IndicatorItem children of an Indicator and before its Indicator children,
+    so the children stay in schema order.
+
+    :param parent: Indicator node.
+    :param node: IndicatorItem node.
+    :return:
+    """
+    previous = None
+    for child in parent.iterchildren(reversed=True):
+        if child.tag != 'Indicator':
+            previous = child
+            break
+    if previous is not None:
+        previous.addnext(node)
+    elif len(parent):
+        parent.insert(0, node)
+    else:
+        parent.append(node)
 
 
 def make_indicator_node(operator, nid=None):
@@ -859,6 +1567,107 @@ ioc_api.LESS_THAN    Integer match indicator a less than (<) operation.
     return ii_node
 
 
+def make_compact_node(node, get_params=None, terms=None):
+    """
+    Convert an Indicator or IndicatorItem node, and the nodes underneath it, to the model in ioc_writer.ioc_compact.
+
+    :param node: Indicator or IndicatorItem node.
+    :param get_params: Callable returning the param nodes for a node id, such as IOC.get_params_by_ref_id.  If not
+     provided, the compact nodes have no params.
+    :param terms: ioc_compact.TermTable used to intern the operator, condition, Context, Content/@type and param
+     name and type values.  Defaults to ioc_compact.TERMS.
+    :return: ioc_compact.CompactIndicator or ioc_compact.CompactItem object.
+    """
+    if terms is None:
+        terms = ioc_compact.TERMS
+    intern = terms.intern
+    nid = node.get('id')
+    params = ()
+    if get_params is not None:
+        params = tuple(make_compact_param(param, terms) for param in get_params(nid))
+    if node.tag == 'Indicator':
+        children = tuple(make_compact_node(child, get_params, terms) for child in node
+                         if child.tag == 'Indicator' or child.tag == 'IndicatorItem')
+        return ioc_compact.CompactIndicator(nid, intern(node.get('operator')), children, params)
+    if node.tag != 'IndicatorItem':
+        raise IOCParseError('Invalid tag: {}'.format(node.tag))
+    document = search = context_type = content_type = content = None
+    for child in node:
+        if child.tag == 'Context':
+            document = intern(child.get('document'))
+            search = intern(child.get('search'))
+            context_type = intern(child.get('type'))
+        elif child.tag == 'Content':
+            content_type = intern(child.get('type'))
+            content = child.text
+    return ioc_compact.CompactItem(nid,
+                                   intern(node.get('condition')),
+                                   document,
+                                   search,
+                                   context_type,
+                                   content_type,
+                                   content,
+                                   node.get('negate', '').lower() == 'true',
+                                   node.get('preserve-case', '').lower() == 'true',
+                                   params)
+
+
+def make_compact_param(param, terms=None):
+    """
+    Convert a param node to an ioc_compact.CompactParam object.
+
+    :param param: param node.
+    :param terms: ioc_compact.TermTable used to intern the param name and type.  Defaults to ioc_compact.TERMS.
+    :return: ioc_compact.CompactParam object.
+    """
+    if terms is None:
+        terms = ioc_compact.TERMS
+    name = terms.intern(param.get('name'))
+    value = param.find('value')
+    if value is None:
+        return ioc_compact.CompactParam(param.get('id'), name, None, None)
+    return ioc_compact.CompactParam(param.get('id'), name, terms.intern(value.get('type')), value.text)
+
+
+def make_node_from_compact(cnode, parameters_node=None):
+    """
+    Build an Indicator or IndicatorItem node, and the nodes underneath it, from the model in ioc_writer.ioc_compact.
+
+    :param cnode: ioc_compact.CompactIndicator or ioc_compact.CompactItem object.
+    :param parameters_node: If provided, param nodes are built for the params of the compact nodes and appended to
+     this node.
+    :return: elementTree Element item.
+    """
+    if isinstance(cnode, ioc_compact.CompactIndicator):
+        node = make_indicator_node(cnode.operator, nid=cnode.nid)
+        for child in cnode.children:
+            node.append(make_node_from_compact(child, parameters_node))
+    else:
+        node = make_indicatoritem_node(cnode.condition,
+                                       cnode.document,
+                                       cnode.search,
+                                       cnode.content_type,
+                                       cnode.content,
+                                       preserve_case=cnode.preserve_case,
+                                       negate=cnode.negate,
+                                       context_type=cnode.context_type,
+                                       nid=cnode.nid)
+    if parameters_node is not None:
+        for param in cnode.params:
+            param_node = ioc_et.make_param_node(node.get('id'), param.content, param.name, param.ptype or 'string')
+            if param.ptype is None:
+                # The value element, and its type, are optional
+                value_node = param_node.find('value')
+                if param.content is None:
+                    param_node.remove(value_node)
+                else:
+                    del value_node.attrib['type']
+            if param.nid:
+                param_node.attrib['id'] = param.nid
+            parameters_node.append(param_node)
+    return node
+
+
 def get_top_level_indicator_node(root_node):
     """
     This returns the first top level Indicator node under the criteria node.
@@ -868,7 +1677,7 @@ def get_top_level_indicator_node(root_node):
     """
     if root_node.tag != 'OpenIOC':
         raise IOCParseError('Root tag is not "OpenIOC" [{}].'.format(root_node.tag))
-    elems = root_node.xpath('criteria/Indicator')
+    elems = xpaths.TOP_LEVEL_INDICATORS(root_node)
     if len(elems) == 0:
         log.warning('No top level Indicator node found.')
         return None
@@ -882,18 +1691,22 @@ def get_top_level_indicator_node(root_node):
     return top_level_indicator_node
 
 
-def write_ioc(root, output_dir=None, force=False):
+def write_ioc(root, output_dir=None, force=False, source=None):
     """
     Serialize an IOC, as defined by a set of etree Elements, to a .IOC file.
 
     :param root: etree Element to write out.  Should have the tag 'OpenIOC'
     :param output_dir: Directory to write the ioc out to.  default is current working directory.
     :param force: If set, skip the root node tag check.
+    :param source: If provided, the serialized IOC, as bytes, which is written instead of serializing root.  The file
+     is left alone if it already holds these bytes.
     :return: True, unless an error occurs while writing the IOC.
     """
     root_tag = 'OpenIOC'
     if not force and root.tag != root_tag:
         raise ValueError('Root tag is not "{}".'.format(root_tag))
+    if source is not None:
+        return _write_source(_get_ioc_path(root, output_dir), source)
     default_encoding = 'utf-8'
     tree = root.getroottree()
     # noinspection PyBroadException
@@ -902,12 +1715,7 @@ def write_ioc(root, output_dir=None, force=False):
     except:
         log.debug('Failed to get encoding from docinfo')
         encoding = default_encoding
-    ioc_id = root.attrib['id']
-    fn = ioc_id + '.ioc'
-    if output_dir:
-        fn = os.path.join(output_dir, fn)
-    else:
-        fn = os.path.join(os.getcwd(), fn)
+    fn = _get_ioc_path(root, output_dir)
     try:
         with open(fn, 'wb') as fout:
             fout.write(et.tostring(tree, encoding=encoding, xml_declaration=True, pretty_print=True))
@@ -919,16 +1727,56 @@ def write_ioc(root, output_dir=None, force=False):
     return True
 
 
-def write_ioc_string(root, force=False):
+def _get_ioc_path(root, output_dir=None):
+    """
+    :param root: etree Element of the IOC.
+    :param output_dir: Directory the IOC is written to.  default is current working directory.
+    :return: Path of the .ioc file for the IOC.
+    """
+    fn = root.attrib['id'] + '.ioc'
+    if output_dir:
+        return os.path.join(output_dir, fn)
+    return os.path.join(os.getcwd(), fn)
+
+
+def _write_source(fn, source):
+    """
+    Write a serialized IOC to a file, unless the file already holds the same bytes.
+
+    :param fn: Path of the .ioc file.
+    :param source: Serialized IOC, as bytes.
+    :return: True, unless an error occurs while writing the IOC.
+    """
+    try:
+        if os.path.getsize(fn) == len(source):
+            with open(fn, 'rb') as fin:
+                if fin.read() == source:
+                    log.debug('IOC is unchanged [{}]'.format(fn))
+                    return True
+    except (IOError, OSError):
+        pass
+    try:
+        with open(fn, 'wb') as fout:
+            fout.write(source)
+    except (IOError, OSError):
+        log.exception('Failed to write out IOC')
+        return False
+    return True
+
+
+def write_ioc_string(root, force=False, source=None):
     """
     Serialize an IOC, as defined by a set of etree Elements, to a String.
     :param root: etree Element to serialize.  Should have the tag 'OpenIOC'
     :param force: Skip the root node tag check.
+    :param source: If provided, the serialized IOC, as bytes, which is returned instead of serializing root.
     :return:
     """
     root_tag = 'OpenIOC'
     if not force and root.tag != root_tag:
         raise ValueError('Root tag is not "{}".'.format(root_tag))
+    if source is not None:
+        return source
     default_encoding = 'utf-8'
     tree = root.getroottree()
     # noinspection PyBroadException
@@ -938,3 +1786,43 @@ def write_ioc_string(root, force=False):
         log.debug('Failed to get encoding from docinfo')
         encoding = default_encoding
     return et.tostring(tree, encoding=encoding, xml_declaration=True, pretty_print=True)
+
+
+def _is_blank(text, elem=None):
+    """
+    :param text: Text or tail of an element.
+    :param elem: If provided, the element the text belongs to.  The text of an element without children is content,
+     and is never blank.
+    :return: True if the text is whitespace used to format the document.
+    """
+    if text is None or text.strip():
+        return False
+    return elem is None or len(elem) > 0
+
+
+def write_ioc_canonical(root, force=False):
+    """
+    Serialize an IOC, as defined by a set of etree Elements, to Canonical XML 1.0.
+
+    The output does not depend on how the IOC was formatted or encoded: it is always UTF-8, attributes are in sorted
+    order, comments are dropped, and whitespace between elements is removed.  The text of elements without children
+    is kept as is.  The elements passed in are not modified.
+
+    The IOC is serialized and parsed again before it is canonicalized, so the xmlns attribute of the root element
+    becomes a namespace declaration.  The output is the canonical form of the document as it would be written by
+    write_ioc_string().
+
+    :param root: etree Element to serialize.  Should have the tag 'OpenIOC'
+    :param force: Skip the root node tag check.
+    :return: Canonical XML, as bytes.
+    """
+    root_tag = 'OpenIOC'
+    if not force and root.tag != root_tag:
+        raise ValueError('Root tag is not "{}".'.format(root_tag))
+    root = et.fromstring(et.tostring(root, encoding='utf-8'), xmlutils.get_parser(CANONICAL_PARSER_CONFIG))
+    for elem in root.iter():
+        if _is_blank(elem.text, elem):
+            elem.text = None
+        if _is_blank(elem.tail):
+            elem.tail = None
+    return et.tostring(root, method='c14n', with_comments=False)
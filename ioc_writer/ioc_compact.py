@@ -0,0 +1,203 @@
+# ioc_compact.py
+#
+# Licensed under the Apache 2.0 license.
+#
+# Provides a compact, read only model of the criteria of an IOC.
+#
+# Each Indicator, IndicatorItem and param is a tuple subclass with no instance dictionary, which takes a fraction
+# of the memory of the equivalent lxml elements, and may be hashed and compared.  Use IOC.to_compact() to convert
+# the criteria of an IOC, and IOC.from_compact() to build an IOC from a compact tree.
+#
+#     tree = ioc_obj.to_compact()
+#     for item in tree.iter_items():
+#         print(item.search, item.condition, item.content)
+#
+# The Context, Content, condition and param name values used across a corpus of IOCs come from a small vocabulary,
+# so compact nodes share a single copy of each through a TermTable, which also assigns each value a small integer
+# code.  IndicatorItem content and ids are not interned.
+#
+# get_structural_digest() hashes a compact tree in a way which ignores node ids and the order of the children of an
+# Indicator, so IOCs with equivalent criteria may be grouped by IOC.structural_hash().
+#
+import collections
+import hashlib
+import threading
+
+
+class TermTable(object):
+    """
+    Table of interned strings.  Each string added to the table is assigned a small integer code, starting at 0, which
+    does not change for the life of the table.
+
+    Strings returned by intern() for equal values are the same object, so they may be compared by identity.
+    """
+    def __init__(self):
+        self._codes = {}
+        self._terms = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._terms)
+
+    def __contains__(self, term):
+        return term in self._codes
+
+    def intern(self, term):
+        """
+        Get the copy of a string held by the table, adding it if it is not present.
+
+        :param term: String, or None.
+        :return: The interned string, or None.
+        """
+        if term is None:
+            return None
+        code = self._codes.get(term)
+        if code is None:
+            code = self.code(term)
+        return self._terms[code]
+
+    def code(self, term):
+        """
+        Get the code of a string, adding it to the table if it is not present.
+
+        :param term: String.
+        :return: Integer code.
+        """
+        code = self._codes.get(term)
+        if code is not None:
+            return code
+        with self._lock:
+            code = self._codes.get(term)
+            if code is None:
+                code = len(self._terms)
+                self._terms.append(term)
+                self._codes[term] = code
+            return code
+
+    def get_code(self, term):
+        """
+        Get the code of a string without adding it to the table.
+
+        :param term: String.
+        :return: Integer code, or None if the string is not in the table.
+        """
+        return self._codes.get(term)
+
+    def term(self, code):
+        """
+        :param code: Integer code returned by code().
+        :return: The string assigned that code.
+        """
+        return self._terms[code]
+
+
+# Table shared by the compact nodes made by ioc_api.make_compact_node()
+TERMS = TermTable()
+
+
+class CompactParam(collections.namedtuple('CompactParam', ['nid',
+                                                           'name',
+                                                           'ptype',
+                                                           'content'])):
+    """
+    A param attached to an Indicator or IndicatorItem.
+
+    :param nid: param/@id
+    :param name: param/@name
+    :param ptype: param/value/@type
+    :param content: param/value/text()
+    """
+    __slots__ = ()
+
+
+class CompactItem(collections.namedtuple('CompactItem', ['nid',
+                                                         'condition',
+                                                         'document',
+                                                         'search',
+                                                         'context_type',
+                                                         'content_type',
+                                                         'content',
+                                                         'negate',
+                                                         'preserve_case',
+                                                         'params'])):
+    """
+    An IndicatorItem.  negate and preserve_case are booleans, and params is a tuple of CompactParam objects.
+    """
+    __slots__ = ()
+
+
+class CompactIndicator(collections.namedtuple('CompactIndicator', ['nid',
+                                                                   'operator',
+                                                                   'children',
+                                                                   'params'])):
+    """
+    An Indicator.  children is a tuple of CompactIndicator and CompactItem objects, in document order, and params is
+    a tuple of CompactParam objects.
+    """
+    __slots__ = ()
+
+    def iter_items(self):
+        """
+        :return: A generator of the CompactItem objects underneath this Indicator, in document order.
+        """
+        stack = [iter(self.children)]
+        while stack:
+            for child in stack[-1]:
+                if isinstance(child, CompactIndicator):
+                    stack.append(iter(child.children))
+                    break
+                yield child
+            else:
+                stack.pop()
+
+    def iter_indicators(self):
+        """
+        :return: A generator of this Indicator and the CompactIndicator objects underneath it, in document order.
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(child for child in reversed(node.children) if isinstance(child, CompactIndicator))
+
+
+def _encode(value):
+    if value is None:
+        return b''
+    return value.encode('utf-8')
+
+
+def get_structural_digest(cnode):
+    """
+    Compute a digest of a compact Indicator or IndicatorItem, and everything underneath it, in a single bottom up pass.
+
+    Node ids are ignored.  The children and params of each node are hashed in sorted order, and duplicate children
+    are counted once, since the AND and OR operators do not depend on the order or repetition of their operands.
+    IndicatorItem content is stripped of surrounding whitespace, and lower cased unless preserve-case is set, so
+    content which would match the same values hashes the same.
+
+    :param cnode: ioc_compact.CompactIndicator or CompactItem object.
+    :return: SHA1 digest, as bytes.
+    """
+    if isinstance(cnode, CompactIndicator):
+        parts = [b'Indicator', _encode(cnode.operator.upper() if cnode.operator else None)]
+        parts.extend(sorted(set(get_structural_digest(child) for child in cnode.children)))
+    else:
+        content = (cnode.content or '').strip()
+        if not cnode.preserve_case:
+            content = content.lower()
+        parts = [b'IndicatorItem',
+                 _encode(cnode.condition),
+                 _encode(cnode.document),
+                 _encode(cnode.search),
+                 _encode(cnode.context_type),
+                 _encode(cnode.content_type),
+                 _encode(content),
+                 b'1' if cnode.negate else b'0',
+                 b'1' if cnode.preserve_case else b'0']
+    param_digests = [hashlib.sha1(b'\x00'.join((_encode(param.name), _encode(param.ptype),
+                                                _encode(param.content)))).digest()
+                     for param in cnode.params]
+    parts.append(b'params')
+    parts.extend(sorted(param_digests))
+    return hashlib.sha1(b'\x00'.join(parts)).digest()
@@ -6,16 +6,91 @@ Purpose: Provide a generic IOC management class for parsing a large set of IOCs
 """
 # Stdlib
 from __future__ import print_function
-import glob
+import functools
 import logging
+import multiprocessing
 import os
+# Third Party code
+from lxml import etree as et
 # Custom Code
 from ioc_writer import ioc_api
+from ioc_writer.managers import archive
+from ioc_writer.managers.cache import get_fingerprint, get_summary
+from ioc_writer.managers.index import FingerprintIndex
+from ioc_writer.managers.lazy import IOCHandle, LazyIOCStore, read_ioc_header
+from ioc_writer.utils import xmlutils
+from ioc_writer.utils import xpaths
 
 log = logging.getLogger(__name__)
 
 __author__ = 'will.gibb'
 
+try:
+    # noinspection PyUnresolvedReferences
+    from os import scandir
+except ImportError:
+    # Python < 3.5
+    scandir = None
+
+
+def iter_ioc_files(dirname, recursive=True):
+    """
+    Yield the paths of .ioc files underneath a directory.
+
+    Files are yielded as the directory tree is walked, so callers can start parsing before the whole tree
+    has been listed.  Entries starting with a '.' are skipped, and symlinked directories are not followed.
+
+    :param dirname: Directory to search.
+    :param recursive: If set, descend into subdirectories.
+    :return: generator of file paths.
+    """
+    if scandir is None:
+        for dirpath, dirnames, filenames in os.walk(dirname):
+            dirnames[:] = sorted(d for d in dirnames if recursive and not d.startswith('.'))
+            for fn in filenames:
+                if fn.endswith('.ioc') and not fn.startswith('.'):
+                    yield os.path.join(dirpath, fn)
+        return
+    pending = [dirname]
+    while pending:
+        subdirs = []
+        for entry in scandir(pending.pop()):
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                if recursive:
+                    subdirs.append(entry.path)
+            elif entry.name.endswith('.ioc') and entry.is_file():
+                yield entry.path
+        pending.extend(reversed(subdirs))
+
+
+def _cache_ioc_file(fn, cache, parser_config=None):
+    """
+    Worker function used by IOCManager.insert() to parse a file in a child process and write its cache entry.
+
+    Only the summary of the IOC is sent back to the parent process, which builds the IOC from the cache entry when
+    it is first accessed.
+
+    :param fn: File to parse.
+    :param cache: cache.ParseCache object the entry is written to.
+    :param parser_config: xmlutils.ParserConfig object used when parsing the file.
+    :return: A tuple of (filename, os.stat_result or None, summary dictionary or None).  The summary is None if the
+     file could not be parsed.  The stat result is collected before the file is read.
+    """
+    try:
+        st = os.stat(fn)
+    except OSError:
+        log.exception('unable to stat file [{}]'.format(fn))
+        return fn, None, None
+    try:
+        ioc_obj = ioc_api.IOC.from_file(fn, parser_config)
+    except ioc_api.IOCParseError:
+        log.exception('Parse Error [{}]'.format(fn))
+        return fn, st, None
+    cache.store(fn, ioc_obj, st, parser_config)
+    return fn, st, get_summary(ioc_obj)
+
 
 class IOCManager(object):
     """
@@ -35,12 +110,65 @@ class IOCManager(object):
             def parse_callback(self, ioc_obj):
                 c = ioc_obj.top_level_indicator.getchildren()
                 self.child_count[ioc_obj.iocid] = len(c)
+
+    :param parser_config: xmlutils.ParserConfig object used when parsing .ioc files.
+     Defaults to xmlutils.DEFAULT_PARSER_CONFIG.
+    :param cache: cache.ParseCache object.  If provided, unchanged files are loaded from the cache instead of being
+     parsed, and newly parsed files are added to it.  Unless a parser callback or an index is set, a file with a
+     valid cache entry is registered from the summary held in the entry, and the IOC is only built from the entry
+     when it is first accessed, so a warm start does not parse any XML.  For this, self.iocs is a
+     lazy.LazyIOCStore without a residency limit, which keeps every IOC once it has been built.
+    :param lazy: If set, self.iocs is a lazy.LazyIOCStore.  insert() only reads the iocid and name of each file, and
+     IOCs are parsed when they are first accessed.  If a parser callback is registered, files are still parsed by
+     insert() so the callback can be called, but the parsed IOCs may be dropped from memory afterwards.
+    :param max_resident: In lazy mode, the maximum number of parsed IOCs kept in memory.
+    :param max_resident_bytes: In lazy mode, the maximum size of the parsed IOCs kept in memory, measured by the size
+     of their files.
+    :param item_index: index.ItemIndex object.  If provided, the IndicatorItems of each IOC are added to it by
+     self.parse() and removed by self.remove().  As with a parser callback, files are still parsed by insert() in
+     lazy mode.
+    :param text_index: index.TrigramIndex object.  If provided, it is maintained in the same way as item_index.
+    :param metadata_index: index.MetadataIndex object.  If provided, it is maintained in the same way as item_index.
+    :param fingerprint_index: index.FingerprintIndex object.  If provided, it is maintained in the same way as
+     item_index.
+    :param collapse_duplicates: If set, IOCs are grouped by the structural hash of their criteria as they are parsed,
+     and the parser callback is only called for the first IOC of each group.  The other IOCs are still held in
+     self.iocs, and self.fingerprint_index.get_duplicates() maps each of them to the IOC it duplicates.  If the first
+     IOC of a group is removed, or is parsed again with different criteria, the parser callback is called for the
+     next IOC of the group.  A FingerprintIndex is created if fingerprint_index is not provided.
+    :param keep_source: If set, IOCs parsed from files and archive members keep their source, as described in
+     ioc_api.IOC(), so unmodified IOCs can be written out with passthrough.  IOCs built from the parse cache do not
+     keep their source.  The source is not counted by max_resident_bytes.
+
+    When an index is set, changes made to the IOCs in self.iocs through the ioc_api.IOC methods are picked up by the
+    indexes.  After changing the elements of an IOC directly, call self.reindex().
     """
 
-    def __init__(self):
-        self.iocs = {}  # iocid -> ioc_api.IOC object
+    def __init__(self, parser_config=None, cache=None, lazy=False, max_resident=None, max_resident_bytes=None,
+                 item_index=None, text_index=None, metadata_index=None, fingerprint_index=None,
+                 collapse_duplicates=False, keep_source=False):
+        if lazy:
+            self.iocs = LazyIOCStore(self._load_handle, max_resident, max_resident_bytes)
+        elif cache is not None:
+            self.iocs = LazyIOCStore(self._load_handle)
+        else:
+            self.iocs = {}  # iocid -> ioc_api.IOC object
+        self.lazy = lazy
         self.ioc_name = {}  # guid -> name mapping
         self.parser_callback = None  #
+        self.parser_config = parser_config
+        self.cache = cache
+        self.keep_source = keep_source
+        self.ioc_sources = {}  # path passed to insert -> recursive flag, used by refresh
+        self.ioc_files = {}  # absolute path -> (file fingerprint, iocid) for each file loaded
+        self.ioc_members = {}  # archive member path -> (archive path, member name) for IOCs loaded from archives
+        self.item_index = item_index
+        self.text_index = text_index
+        self.metadata_index = metadata_index
+        if collapse_duplicates and fingerprint_index is None:
+            fingerprint_index = FingerprintIndex()
+        self.fingerprint_index = fingerprint_index
+        self.collapse_duplicates = collapse_duplicates
 
     def __len__(self):
         """
@@ -48,62 +176,724 @@ class IOCManager(object):
         """
         return len(self.iocs)
 
-    def insert(self, filename):
+    def insert(self, filename, workers=None):
         """
         Parses files to load them into memory and insert them into the class.
 
-        :param filename: File or directory pointing to .ioc files.
+        If workers is set and a cache is used without a parser callback or index, files without a valid cache entry
+        are parsed by a pool of worker processes, which write the cache entries.  This process only registers each
+        IOC from the summary sent back by its worker, and the IOC is built from the cache entry when it is first
+        accessed.  Building an IOC object costs as much as parsing its file, so when IOC objects are needed by
+        insert() itself, workers would not make it faster, and files are parsed serially instead.
+
+        If filename is a zip, tar or gzip archive, the .ioc files it contains are read without extracting them.  Each
+        IOC is identified by its member path, which is the member name joined onto the archive path.  IOCs loaded from
+        archives are not cached, and are always kept in memory in lazy mode.
+
+        :param filename: File or directory pointing to .ioc files, or an archive containing .ioc files.
+        :param workers: Number of worker processes used to parse files into cache entries.  By default files are
+         parsed serially.  This is ignored for archives, when no cache is set, and when a parser callback or index
+         is set.
         :return: A list of .ioc files which could not be parsed.
         """
         errors = []
+        self._add_source(filename, recursive=False)
+        if archive.is_archive(filename):
+            for fn, result in self._iter_parse_archive(filename, store=True):
+                if isinstance(result, ioc_api.IOCParseError):
+                    errors.append(fn)
+            log.info('Parsed [{}] IOCs'.format(len(self)))
+            return errors
+        fns = list(self._iter_files(filename, recursive=False))
+        if workers and len(fns) > 1:
+            if self._defer_cache_hits():
+                errors.extend(self._insert_parallel(fns, workers))
+                log.info('Parsed [{}] IOCs'.format(len(self)))
+                return errors
+            log.info('Ignoring workers [{}], they are only used to write cache entries'.format(workers))
+        if self._load_handles() or self._defer_cache_hits():
+            for fn in fns:
+                try:
+                    self._load_into(fn, os.stat(fn))
+                except (ioc_api.IOCParseError, OSError):
+                    log.exception('Parse Error')
+                    errors.append(fn)
+        else:
+            for fn, result in self._iter_parse(fns, store=True):
+                if isinstance(result, ioc_api.IOCParseError):
+                    errors.append(fn)
+        log.info('Parsed [{}] IOCs'.format(len(self)))
+        return errors
+
+    def ainsert(self, filename, concurrency=4, executor=None):
+        """
+        Asynchronous version of insert(), for use from asyncio code.  Files are read and parsed in an executor, so
+        the event loop is not blocked while the files load.  Requires Python 3.7 or later.
+
+        Usage example:
+        ::
+            errors = await iocm.ainsert(iocs_dir)
+
+        :param filename: File or directory pointing to .ioc files, or an archive containing .ioc files.
+        :param concurrency: Maximum number of files being loaded at once.
+        :param executor: concurrent.futures.Executor used to load the files.  By default, a thread pool with
+         concurrency threads is used.
+        :return: A coroutine returning a list of .ioc files which could not be parsed.
+        """
+        from ioc_writer.managers import aio
+        return aio.ainsert(self, filename, concurrency=concurrency, executor=executor)
+
+    def iter_insert(self, filename, store=True, recursive=True):
+        """
+        Parses files one at a time, yielding each result as soon as the file has been parsed.
+
+        Directories are walked lazily, so this can be used to make a single pass over an arbitrarily large set of
+        IOCs.  If store is False, the IOCs are not passed to self.parse(); they are not kept in self.iocs and the
+        parser callback is not called, so memory use stays constant no matter how many files are processed.
+
+        Archives are read the same way as insert(), and the member path of each IOC is yielded as its filename.
+
+        :param filename: File or directory pointing to .ioc files, or an archive containing .ioc files.
+        :param store: If set, parsed IOCs are added to the class with self.parse().
+        :param recursive: If set, .ioc files in subdirectories are parsed as well.
+        :return: A generator yielding (filename, IOC object) tuples.  If a file could not be parsed, the
+         IOCParseError is yielded in place of the IOC object.
+        """
+        if store:
+            self._add_source(filename, recursive=recursive)
+        if archive.is_archive(filename):
+            return self._iter_parse_archive(filename, store=store)
+        return self._iter_parse(self._iter_files(filename, recursive=recursive), store=store)
+
+    def insert_bundle(self, filename):
+        """
+        Parses a file containing many IOCs, such as a feed which wraps OpenIOC documents in a single root element, and
+        inserts each IOC into the class.
+
+        The file is parsed incrementally, so only one IOC from the file is held as a separate document at a time.
+        IOCs loaded from bundles are not tracked by refresh(), and are always kept in memory in lazy mode.
+
+        :param filename: File containing OpenIOC or ioc elements.
+        :return: A list of the IOCs which could not be parsed, identified as described in iter_insert_bundle().
+        """
+        errors = []
+        for fn, result in self.iter_insert_bundle(filename):
+            if isinstance(result, ioc_api.IOCParseError):
+                errors.append(fn)
+        log.info('Parsed [{}] IOCs'.format(len(self)))
+        return errors
+
+    def iter_insert_bundle(self, filename, store=True):
+        """
+        Parses a file containing many IOCs, yielding each IOC as soon as it has been parsed.
+
+        :param filename: File containing OpenIOC or ioc elements.
+        :param store: If set, parsed IOCs are added to the class with self.parse().
+        :return: A generator yielding (name, IOC object) tuples.  The name is the filename followed by '#' and the
+         position of the IOC in the file.  If an IOC could not be parsed, the IOCParseError is yielded in place of
+         the IOC object.  If the file itself could not be parsed, the filename is yielded with the IOCParseError.
+        """
+        log.info('loading IOCs from bundle: {}'.format(filename))
+        try:
+            trees = xmlutils.iter_elements_no_ns(filename, ioc_api.IOC_ROOT_TAGS, self.parser_config)
+            for i, parsed_xml in enumerate(trees):
+                name = '{}#{}'.format(filename, i)
+                try:
+                    ioc_obj = ioc_api.IOC.from_tree(parsed_xml)
+                    if store:
+                        self.parse(ioc_obj)
+                except ioc_api.IOCParseError as e:
+                    log.exception('Parse Error [{}]'.format(name))
+                    yield name, e
+                    continue
+                yield name, ioc_obj
+        except (IOError, OSError, et.XMLSyntaxError):
+            log.exception('unable to parse bundle [{}]'.format(filename))
+            yield filename, ioc_api.IOCParseError('Error occured parsing XML')
+
+    def refresh(self):
+        """
+        Re-scan the files and directories previously loaded with insert() or iter_insert().
+
+        Only files which were added, or whose size or modification time changed, are parsed.  IOCs loaded from
+        files which no longer exist are removed with self.remove().  If a changed file can no longer be parsed,
+        the previously loaded IOC is kept and the file is tried again on the next refresh.
+
+        :return: A dictionary with 'added', 'modified' and 'removed' lists of iocids, and an 'errors' list of files
+         which could not be parsed.
+        """
+        report = {'added': [], 'modified': [], 'removed': [], 'errors': []}
+        seen = set()
+        for source, recursive in list(self.ioc_sources.items()):
+            if archive.is_archive(source):
+                self._refresh_archive(source, seen, report)
+                continue
+            for fn in self._iter_files(source, recursive):
+                path = os.path.abspath(fn)
+                if path in seen:
+                    continue
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                seen.add(path)
+                fingerprint, old_iocid = self.ioc_files.get(path, (None, None))
+                if fingerprint == get_fingerprint(st):
+                    continue
+                try:
+                    iocid = self._load_into(path, st)
+                except ioc_api.IOCParseError:
+                    log.exception('Parse Error')
+                    report['errors'].append(fn)
+                    continue
+                self._report_reload(report, iocid, old_iocid)
+        deleted_iocids = set()
+        for path in set(self.ioc_files) - seen:
+            fingerprint, iocid = self.ioc_files.pop(path)
+            self.ioc_members.pop(path, None)
+            deleted_iocids.add(iocid)
+        for iocid in deleted_iocids:
+            if self._release_file_iocid(iocid):
+                report['removed'].append(iocid)
+        log.info('Refreshed IOCs: [{}] added, [{}] modified, [{}] removed'.format(len(report['added']),
+                                                                               len(report['modified']),
+                                                                               len(report['removed'])))
+        return report
+
+    def _refresh_archive(self, filename, seen, report):
+        """
+        Re-read an archive for refresh(), if it changed since it was loaded.  If the archive changed, every IOC in it
+        is parsed again.
+
+        :param filename: Archive path.
+        :param seen: Set of member paths found by refresh().  Member paths found in the archive are added to it.
+        :param report: refresh() report, which is updated with the IOCs loaded from the archive.
+        :return:
+        """
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return
+        members = [path for path, (archive_path, name) in self.ioc_members.items() if archive_path == filename]
+        fingerprint = get_fingerprint(st)
+        if members and all(self.ioc_files.get(path, (None, None))[0] == fingerprint for path in members):
+            seen.update(members)
+            return
+        old_iocids = dict((path, self.ioc_files[path][1]) for path in members if path in self.ioc_files)
+        for path, result in self._iter_parse_archive(filename, store=True):
+            if isinstance(result, ioc_api.IOCParseError):
+                report['errors'].append(path)
+                if path == filename:
+                    # The archive could not be read, so keep the IOCs previously loaded from it
+                    seen.update(members)
+                elif path in old_iocids:
+                    seen.add(path)
+                continue
+            seen.add(path)
+            self._report_reload(report, result.iocid, old_iocids.get(path))
+
+    def _report_reload(self, report, iocid, old_iocid):
+        """
+        Record a file loaded by refresh() in its report.  If the file used to provide a different IOC, the old IOC is
+        released.
+
+        :param report: refresh() report.
+        :param iocid: iocid loaded from the file.
+        :param old_iocid: iocid previously loaded from the file, or None if the file is new.
+        :return:
+        """
+        if old_iocid is None:
+            report['added'].append(iocid)
+        elif old_iocid == iocid:
+            report['modified'].append(iocid)
+        else:
+            report['added'].append(iocid)
+            if self._release_file_iocid(old_iocid):
+                report['removed'].append(old_iocid)
+
+    def _add_source(self, filename, recursive):
+        """
+        Record a file or directory that IOCs are loaded from, so it can be re-scanned by refresh().
+
+        :param filename: File or directory pointing to .ioc files.
+        :param recursive: If set, subdirectories are scanned as well.
+        :return:
+        """
+        path = os.path.abspath(filename)
+        self.ioc_sources[path] = recursive or self.ioc_sources.get(path, False)
+
+    def _track_file(self, fn, st, ioc_obj):
+        """
+        Record the file an IOC was loaded from.  In lazy mode, the IOC object may be dropped from memory after this.
+
+        :param fn: File the IOC was loaded from.
+        :param st: os.stat_result for the file, collected before it was read.
+        :param ioc_obj: The IOC object loaded from the file.
+        :return:
+        """
+        path = os.path.abspath(fn)
+        self.ioc_files[path] = (get_fingerprint(st), ioc_obj.iocid)
+        if self.lazy:
+            handle = IOCHandle(ioc_obj.iocid, self.ioc_name.get(ioc_obj.iocid), path, st.st_size)
+            self.iocs.attach(handle, ioc_obj)
+
+    def _load_handles(self):
+        """
+        :return: True if files should be registered as IOCHandles instead of being parsed.
+        """
+        return self.lazy and self.parser_callback is None and not self._get_indexes()
+
+    def _defer_cache_hits(self):
+        """
+        :return: True if files with a valid cache entry should be registered as IOCHandles instead of being loaded.
+        """
+        return self.cache is not None and self.parser_callback is None and not self._get_indexes()
+
+    def _get_indexes(self):
+        """
+        :return: A list of the indexes maintained by self.parse() and self.remove().
+        """
+        return [i for i in (self.item_index, self.text_index, self.metadata_index, self.fingerprint_index)
+                if i is not None]
+
+    def _get_group(self, iocid):
+        """
+        :param iocid: iocid of an IOC.
+        :return: The iocids grouped with the IOC by self.fingerprint_index, if duplicates are being collapsed.
+        """
+        if not self.collapse_duplicates:
+            return []
+        return self.fingerprint_index.get_group(iocid)
+
+    def _promote(self, iocid, group):
+        """
+        Call the parser callback for the next IOC of a group whose canonical IOC has been removed from it.
+
+        :param iocid: iocid of the IOC which was removed from the group, or parsed again.
+        :param group: The group of the IOC before it was removed or parsed again, as returned by self._get_group().
+        :return:
+        """
+        if len(group) < 2 or group[0] != iocid:
+            return
+        canonical = group[1]
+        if self.fingerprint_index.get_canonical(canonical) != canonical:
+            return
+        log.debug('IOC [{}] replaces [{}] as the canonical IOC of its group'.format(canonical, iocid))
+        if self.parser_callback:
+            self.parser_callback(self.iocs[canonical])
+
+    def _watch(self, ioc_obj):
+        """
+        Register for changes to an IOC held by the class, so the indexes can be updated.
+
+        :param ioc_obj: ioc_api.IOC object.
+        :return:
+        """
+        if self._get_indexes():
+            ioc_obj.register_change_callback(self._ioc_changed)
+
+    def _ioc_changed(self, ioc_obj):
+        """
+        Change callback registered on the IOCs held by the class.  The IOC is indexed again before the next query.
+        IOCs which are no longer held by the class are ignored.
+
+        :param ioc_obj: The modified ioc_api.IOC object.
+        :return:
+        """
+        iocid = ioc_obj.iocid
+        if isinstance(self.iocs, LazyIOCStore):
+            # Check the IOCs held in memory, without loading the IOC or changing its position in the LRU order
+            current = self.iocs.pinned.get(iocid)
+            if current is None:
+                current = self.iocs.resident.get(iocid)
+        else:
+            current = self.iocs.get(iocid)
+        if current is not ioc_obj:
+            ioc_obj.unregister_change_callback(self._ioc_changed)
+            return
+        self.ioc_name[iocid] = self._get_name(ioc_obj)
+        for ioc_index in self._get_indexes():
+            ioc_index.invalidate(ioc_obj)
+
+    def reindex(self, iocid):
+        """
+        Update the indexes and self.ioc_name for an IOC after its elements were changed directly.
+
+        :param iocid: iocid of the IOC.
+        :return:
+        :raises: KeyError if the iocid is not present.
+        """
+        ioc_obj = self.iocs[iocid]
+        self.ioc_name[iocid] = self._get_name(ioc_obj)
+        for ioc_index in self._get_indexes():
+            ioc_index.add_ioc(ioc_obj)
+
+    def _load_into(self, fn, st):
+        """
+        Load a file into the class and record it for refresh().  In lazy mode, only the file header is read.
+
+        :param fn: File to load.
+        :param st: os.stat_result for the file, collected before it is read.
+        :return: iocid of the loaded IOC.
+        :raises: IOCParseError if the file could not be parsed.
+        """
+        if self._load_handles():
+            return self._load_handle_into(self._read_handle(fn, st), st)
+        if self._defer_cache_hits():
+            handle = self._read_cached_handle(fn, st)
+            if handle is not None:
+                return self._load_handle_into(handle, st)
+        ioc_obj = self._load_file(fn, st)
+        self.parse(ioc_obj, self._get_file_iocid(fn))
+        self._track_file(fn, st, ioc_obj)
+        return ioc_obj.iocid
+
+    def _load_handle_into(self, handle, st):
+        """
+        Register an IOCHandle for a file and record the file for refresh().
+
+        :param handle: IOCHandle object.
+        :param st: os.stat_result for the file, collected before it was read.
+        :return: iocid of the handle.
+        """
+        self.parse_handle(handle, self._get_file_iocid(handle.path))
+        self.ioc_files[handle.path] = (get_fingerprint(st), handle.iocid)
+        return handle.iocid
+
+    def _get_file_iocid(self, fn):
+        """
+        :param fn: File or archive member path.
+        :return: iocid last loaded from the file, or None if the file is not tracked.
+        """
+        return self.ioc_files.get(os.path.abspath(fn), (None, None))[1]
+
+    def _read_handle(self, fn, st):
+        """
+        Build an IOCHandle for a file, using the cache entry if available, or by reading the file header.
+
+        :param fn: File containing an IOC.
+        :param st: os.stat_result for the file.
+        :return: IOCHandle object.
+        :raises: IOCParseError if the file could not be parsed.
+        """
+        handle = self._read_cached_handle(fn, st)
+        if handle is not None:
+            return handle
+        iocid, name = read_ioc_header(fn)
+        return IOCHandle(iocid, name or 'NoName', os.path.abspath(fn), st.st_size)
+
+    def _read_cached_handle(self, fn, st):
+        """
+        Build an IOCHandle for a file from the summary held in its cache entry.
+
+        :param fn: File containing an IOC.
+        :param st: os.stat_result for the file.
+        :return: IOCHandle object, or None if there is no cache or no valid entry for the file.
+        """
+        if self.cache is None:
+            return None
+        entry = self.cache.get(fn, st, self.parser_config)
+        if entry is None:
+            return None
+        return self._get_summary_handle(fn, st, entry[0]['summary'])
+
+    @staticmethod
+    def _get_summary_handle(fn, st, summary):
+        """
+        :param fn: File containing an IOC.
+        :param st: os.stat_result for the file.
+        :param summary: Summary of the IOC, from cache.get_summary().
+        :return: IOCHandle object.
+        """
+        return IOCHandle(summary['iocid'], summary['short_description'] or 'NoName', os.path.abspath(fn), st.st_size)
+
+    def _load_handle(self, handle):
+        """
+        Parse the IOC referenced by a handle.  This is the loader used by the LazyIOCStore in lazy mode.
+
+        :param handle: IOCHandle object.
+        :return: ioc_api.IOC object.
+        :raises: IOCParseError if the IOC could not be parsed.
+        """
+        ioc_obj = self._load_file(handle.path)
+        self._watch(ioc_obj)
+        return ioc_obj
+
+    def _release_file_iocid(self, iocid):
+        """
+        Remove an IOC whose file was deleted or now contains a different IOC, unless another tracked file still
+        provides the same iocid.  In that case, the IOC from that file is loaded again.
+
+        :param iocid: iocid of the IOC.
+        :return: True if the IOC was removed.
+        """
+        for path, (fingerprint, other_iocid) in list(self.ioc_files.items()):
+            if other_iocid == iocid:
+                try:
+                    if path in self.ioc_members:
+                        self._load_member(*self.ioc_members[path])
+                    else:
+                        self._load_into(path, os.stat(path))
+                    return False
+                except (ioc_api.IOCParseError, OSError):
+                    log.exception('Failed to reload [{}]'.format(path))
+                    del self.ioc_files[path]
+                    self.ioc_members.pop(path, None)
+        return self.remove(iocid) is not None
+
+    def remove(self, iocid):
+        """
+        Removes an IOC from self.iocs and self.ioc_name, and from the indexes which are set.
+
+        Subclasses which keep additional state for each IOC should extend this.
+
+        :param iocid: iocid of the IOC to remove.
+        :return: The removed IOC object, or None if the iocid is not present.  In lazy mode, the IOCHandle is returned
+         if the IOC was not loaded.
+        """
+        group = self._get_group(iocid)
+        self.ioc_name.pop(iocid, None)
+        for ioc_index in self._get_indexes():
+            ioc_index.remove(iocid)
+        ioc_obj = self.iocs.pop(iocid, None)
+        self._promote(iocid, group)
+        return ioc_obj
+
+    @staticmethod
+    def _iter_files(filename, recursive):
+        """
+        Get the .ioc files referenced by a path.
+
+        :param filename: File or directory pointing to .ioc files.
+        :param recursive: If set, .ioc files in subdirectories are returned as well.
+        :return: An iterable of file paths.
+        """
         if os.path.isfile(filename):
             log.info('loading IOC from: {}'.format(filename))
-            try:
-                self.parse(ioc_api.IOC(filename))
-            except ioc_api.IOCParseError:
-                log.exception('Parse Error')
-                errors.append(filename)
+            return [filename]
         elif os.path.isdir(filename):
             log.info('loading IOCs from: {}'.format(filename))
-            for fn in glob.glob(filename + os.path.sep + '*.ioc'):
-                if not os.path.isfile(fn):
-                    continue
+            return iter_ioc_files(filename, recursive=recursive)
+        return []
+
+    def _iter_parse(self, fns, store):
+        """
+        Parse files into IOC objects.
+
+        :param fns: Iterable of files to parse.
+        :param store: If set, parsed IOCs are passed to self.parse().
+        :return: A generator yielding (filename, IOC object or IOCParseError) tuples.
+        """
+        for fn in fns:
+            try:
+                if store:
+                    st = os.stat(fn)
+                    ioc_obj = self._load_file(fn, st)
+                    self.parse(ioc_obj)
+                    self._track_file(fn, st, ioc_obj)
                 else:
-                    try:
-                        self.parse(ioc_api.IOC(fn))
-                    except ioc_api.IOCParseError:
-                        log.exception('Parse Error')
-                        errors.append(fn)
-        else:
-            pass
-        log.info('Parsed [{}] IOCs'.format(len(self)))
+                    ioc_obj = self._load_file(fn)
+            except OSError:
+                log.exception('Unable to stat file [{}]'.format(fn))
+                yield fn, ioc_api.IOCParseError('Unable to stat file [{}]'.format(fn))
+                continue
+            except ioc_api.IOCParseError as e:
+                log.exception('Parse Error')
+                yield fn, e
+                continue
+            yield fn, ioc_obj
+
+    def _iter_parse_archive(self, filename, store):
+        """
+        Parse the .ioc files contained in an archive into IOC objects.
+
+        :param filename: Path to a zip, tar or gzip archive.
+        :param store: If set, parsed IOCs are passed to self.parse().
+        :return: A generator yielding (member path, IOC object or IOCParseError) tuples.  If the archive itself could
+         not be read, the archive path is yielded with the IOCParseError.
+        """
+        path = os.path.abspath(filename)
+        log.info('loading IOCs from archive: {}'.format(filename))
+        try:
+            st = os.stat(path)
+            for name, data in archive.iter_archive(path):
+                member_path = archive.get_member_path(path, name)
+                try:
+                    ioc_obj = ioc_api.IOC.from_bytes(data, self.parser_config, self.keep_source)
+                    if store:
+                        self.parse(ioc_obj, self._get_file_iocid(member_path))
+                        self._track_member(path, name, st, ioc_obj)
+                except ioc_api.IOCParseError as e:
+                    log.exception('Parse Error [{}]'.format(member_path))
+                    yield member_path, e
+                    continue
+                yield member_path, ioc_obj
+        except OSError:
+            log.exception('Unable to stat file [{}]'.format(filename))
+            yield filename, ioc_api.IOCParseError('Unable to stat file [{}]'.format(filename))
+        except ioc_api.IOCParseError as e:
+            yield filename, e
+
+    def _load_member(self, filename, name):
+        """
+        Load a single archive member into the class.
+
+        :param filename: Archive path.
+        :param name: Name of the member within the archive.
+        :return: iocid of the loaded IOC.
+        :raises: IOCParseError if the member could not be parsed, or OSError if the archive does not exist.
+        """
+        st = os.stat(filename)
+        ioc_obj = ioc_api.IOC.from_bytes(archive.read_archive_member(filename, name), self.parser_config,
+                                         self.keep_source)
+        self.parse(ioc_obj, self._get_file_iocid(archive.get_member_path(filename, name)))
+        self._track_member(filename, name, st, ioc_obj)
+        return ioc_obj.iocid
+
+    def _track_member(self, filename, name, st, ioc_obj):
+        """
+        Record the archive member an IOC was loaded from.
+
+        :param filename: Archive path.
+        :param name: Name of the member within the archive.
+        :param st: os.stat_result for the archive, collected before it was read.
+        :param ioc_obj: The IOC object loaded from the member.
+        :return:
+        """
+        member_path = archive.get_member_path(filename, name)
+        self.ioc_files[member_path] = (get_fingerprint(st), ioc_obj.iocid)
+        self.ioc_members[member_path] = (filename, name)
+
+    def _load_file(self, fn, st=None):
+        """
+        Get an IOC object for a file, from the cache if possible.
+
+        :param fn: File to load.
+        :param st: os.stat_result for the file, collected before it is read.
+        :return: ioc_api.IOC object.
+        :raises: IOCParseError if the file could not be parsed.
+        """
+        if self.cache is None:
+            return ioc_api.IOC.from_file(fn, self.parser_config, self.keep_source)
+        if st is None:
+            try:
+                st = os.stat(fn)
+            except OSError:
+                raise ioc_api.IOCParseError('Unable to stat file [{}]'.format(fn))
+        ioc_obj = self.cache.load(fn, self.parser_config, st)
+        if ioc_obj is None:
+            ioc_obj = ioc_api.IOC.from_file(fn, self.parser_config, self.keep_source)
+            self.cache.store(fn, ioc_obj, st, self.parser_config)
+        return ioc_obj
+
+    def _insert_parallel(self, fns, workers):
+        """
+        Parse a list of files into cache entries with a pool of worker processes, and register their IOCs as
+        IOCHandles.  Files with a valid cache entry are registered in this process, and only the remaining files are
+        sent to the workers.
+
+        :param fns: List of .ioc files to parse.
+        :param workers: Number of worker processes to use.
+        :return: A list of .ioc files which could not be parsed.
+        """
+        errors = []
+        misses = []
+        for fn in fns:
+            try:
+                st = os.stat(fn)
+            except OSError:
+                log.exception('Unable to stat file [{}]'.format(fn))
+                errors.append(fn)
+                continue
+            handle = self._read_cached_handle(fn, st)
+            if handle is None:
+                misses.append(fn)
+            else:
+                self._load_handle_into(handle, st)
+        if not misses:
+            return errors
+        chunksize = max(1, len(misses) // (workers * 4))
+        pool = multiprocessing.Pool(processes=workers)
+        try:
+            func = functools.partial(_cache_ioc_file, cache=self.cache, parser_config=self.parser_config)
+            for fn, st, summary in pool.imap(func, misses, chunksize):
+                if summary is None:
+                    errors.append(fn)
+                    continue
+                self._load_handle_into(self._get_summary_handle(fn, st, summary), st)
+            pool.close()
+        except:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
         return errors
 
-    def parse(self, ioc_obj):
+    def parse_handle(self, handle, replaces=None):
+        """
+        Registers an IOCHandle to populate self.iocs and self.ioc_name, without parsing the IOC.
+        This is used by insert() in lazy mode.
+
+        :param handle: lazy.IOCHandle object.
+        :param replaces: As for self.parse().
+        :return: True
+        """
+        iocid = handle.iocid
+        if iocid in self.iocs and iocid != replaces:
+            msg = 'duplicate IOC UUID [{}] [orig_shortName: {}][new_shortName: {}]'.format(iocid,
+                                                                                           self.ioc_name[iocid],
+                                                                                           handle.name)
+            log.warning(msg)
+        self.iocs.add_handle(handle)
+        self.ioc_name[iocid] = handle.name
+        return True
+
+    def parse(self, ioc_obj, replaces=None):
         """
         parses an ioc to populate self.iocs and self.ioc_name
 
         :param ioc_obj:
+        :param replaces: iocid of the IOC previously loaded from the same file, when a file is loaded again by
+         refresh().  If ioc_obj has this iocid, it is expected to replace the existing IOC, so this is not logged as
+         a duplicate IOC UUID.
         :return:
         """
         if ioc_obj is None:
             return
         iocid = ioc_obj.iocid
-        try:
-            sd = ioc_obj.metadata.xpath('.//short_description/text()')[0]
-        except IndexError:
-            sd = 'NoName'
-        if iocid in self.iocs:
+        sd = self._get_name(ioc_obj)
+        if iocid in self.iocs and iocid != replaces:
             msg = 'duplicate IOC UUID [{}] [orig_shortName: {}][new_shortName: {}]'.format(iocid,
                                                                                            self.ioc_name[iocid],
                                                                                            sd)
             log.warning(msg)
+        group = self._get_group(iocid)
         self.iocs[iocid] = ioc_obj
         self.ioc_name[iocid] = sd
+        for ioc_index in self._get_indexes():
+            ioc_index.add_ioc(ioc_obj)
+        self._watch(ioc_obj)
+        if self.collapse_duplicates:
+            self._promote(iocid, group)
+            canonical = self.fingerprint_index.get_canonical(iocid)
+            if canonical != iocid:
+                log.debug('IOC [{}] has the same criteria as [{}]'.format(iocid, canonical))
+                return True
         if self.parser_callback:
             self.parser_callback(ioc_obj)
         return True
 
+    @staticmethod
+    def _get_name(ioc_obj):
+        """
+        :param ioc_obj: ioc_api.IOC object.
+        :return: The short description of the IOC, or 'NoName'.
+        """
+        try:
+            return xpaths.SHORT_DESCRIPTION_TEXT(ioc_obj.metadata)[0]
+        except IndexError:
+            return 'NoName'
+
     def register_parser_callback(self, func):
         """
         Register a callback function that is called after self.iocs and self.ioc_name is populated.
@@ -0,0 +1,296 @@
+"""
+aio.py from ioc_writer
+Created: 10/17/26
+
+Purpose: Load IOCs from asyncio code without blocking the event loop.
+
+Files are read and parsed in an executor, with a bounded number of files in flight at once, while results are
+handed back to the event loop in the order the files were found.  lxml releases the GIL while parsing, so the
+default thread pool parses several files at the same time.  If the calling task is cancelled, files which have
+not started loading are cancelled as well.
+
+Archives are read one member at a time in the executor, and their members are parsed in the same way as files.  In
+every case, the IOCs are passed to IOCManager.parse() on the event loop.
+
+This module requires Python 3.7 or later, and is not imported by ioc_writer.managers.
+
+Usage example:
+::
+    async for fn, ioc_obj in aiter_iocs(iocs_dir):
+        print(fn, ioc_obj.iocid)
+
+    iocm = IOCManager()
+    errors = await iocm.ainsert(iocs_dir)
+
+"""
+# Stdlib
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import logging
+import os
+# Custom Code
+import ioc_writer.ioc_api as ioc_api
+import ioc_writer.managers as managers
+from ioc_writer.managers import archive
+from ioc_writer.managers.cache import get_fingerprint
+from ioc_writer.managers.lazy import IOCHandle
+
+log = logging.getLogger(__name__)
+
+__author__ = 'will.gibb'
+
+DEFAULT_CONCURRENCY = 4
+
+
+def _list_files(paths, recursive):
+    """
+    Get the .ioc files referenced by one or more paths.
+
+    :param paths: File or directory, or a list of files and directories.
+    :param recursive: If set, .ioc files in subdirectories are returned as well.
+    :return: A list of file paths.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    fns = []
+    for path in paths:
+        fns.extend(managers.IOCManager._iter_files(path, recursive))
+    return fns
+
+
+async def _amap(func, items, concurrency, executor):
+    """
+    Run a function over items in an executor, with at most concurrency calls submitted at once.
+
+    :param func: Callable run on each item.
+    :param items: Iterable or async iterable of items.
+    :param concurrency: Maximum number of calls submitted to the executor at once.
+    :param executor: concurrent.futures.Executor to run the calls in.
+    :return: An async generator yielding the results of func, in the order of items.
+    """
+    loop = asyncio.get_running_loop()
+    pending = collections.deque()
+    try:
+        async for item in _aiter(items):
+            pending.append(loop.run_in_executor(executor, func, item))
+            if len(pending) >= concurrency:
+                yield await pending.popleft()
+        while pending:
+            yield await pending.popleft()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+async def _aiter(items):
+    """
+    :param items: Iterable or async iterable.
+    :return: An async generator yielding the items.
+    """
+    if hasattr(items, '__aiter__'):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+async def _aiter_blocking(iterable, executor):
+    """
+    Iterate over an iterable which blocks while producing items, such as archive.iter_archive(), in an executor.
+    Items are produced one at a time, so the iterable is never used by two threads at once.
+
+    :param iterable: Iterable of items.
+    :param executor: concurrent.futures.Executor to run the iteration in.
+    :return: An async generator yielding the items.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = iter(iterable)
+    done = object()
+    while True:
+        item = await loop.run_in_executor(executor, next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+class _Executor(object):
+    """
+    Context manager providing the executor given by the caller, or a thread pool which is shut down on exit.
+
+    :param executor: concurrent.futures.Executor object, or None.
+    :param concurrency: Number of threads used if an executor is not given.
+    """
+    def __init__(self, executor, concurrency):
+        self.executor = executor
+        self.concurrency = concurrency
+        self.owned = None
+
+    def __enter__(self):
+        if self.executor is not None:
+            return self.executor
+        self.owned = concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency)
+        return self.owned
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.owned is not None:
+            self.owned.shutdown(wait=False)
+
+
+def _read_ioc(fn, parser_config=None):
+    """
+    Worker function for aiter_iocs().
+
+    :param fn: File to parse.
+    :param parser_config: xmlutils.ParserConfig object used when parsing the file.
+    :return: A tuple of (filename, IOC object or IOCParseError).
+    """
+    try:
+        return fn, ioc_api.IOC.from_file(fn, parser_config)
+    except ioc_api.IOCParseError as e:
+        return fn, e
+
+
+async def aiter_iocs(paths, parser_config=None, concurrency=DEFAULT_CONCURRENCY, executor=None, recursive=True):
+    """
+    Parse .ioc files in an executor, yielding each IOC once it has been parsed.
+
+    :param paths: File or directory pointing to .ioc files, or a list of files and directories.
+    :param parser_config: xmlutils.ParserConfig object used when parsing the files.
+    :param concurrency: Maximum number of files being loaded at once.
+    :param executor: concurrent.futures.Executor used to parse the files.  By default, a thread pool with
+     concurrency threads is used.
+    :param recursive: If set, .ioc files in subdirectories are parsed as well.
+    :return: An async generator yielding (filename, IOC object) tuples, in the order the files were found.  If a
+     file could not be parsed, the IOCParseError is yielded in place of the IOC object.
+    """
+    loop = asyncio.get_running_loop()
+    with _Executor(executor, concurrency) as executor:
+        fns = await loop.run_in_executor(executor, _list_files, paths, recursive)
+        func = functools.partial(_read_ioc, parser_config=parser_config)
+        async for result in _amap(func, fns, concurrency, executor):
+            yield result
+
+
+def _load_ioc(iocm, fn):
+    """
+    Worker function for ainsert().  This does the blocking part of IOCManager._load_into().
+
+    :param iocm: IOCManager object.
+    :param fn: File to load.
+    :return: A tuple of (filename, os.stat_result, IOCHandle or IOC object), or (filename, None, IOCParseError) if
+     the file could not be loaded.
+    """
+    try:
+        st = os.stat(fn)
+        if iocm._load_handles():
+            return fn, st, iocm._read_handle(fn, st)
+        if iocm._defer_cache_hits():
+            handle = iocm._read_cached_handle(fn, st)
+            if handle is not None:
+                return fn, st, handle
+        return fn, st, iocm._load_file(fn, st)
+    except OSError:
+        log.exception('Unable to stat file [{}]'.format(fn))
+        return fn, None, ioc_api.IOCParseError('Unable to stat file [{}]'.format(fn))
+    except ioc_api.IOCParseError as e:
+        log.exception('Parse Error')
+        return fn, None, e
+
+
+def _read_member(member, parser_config=None, keep_source=False):
+    """
+    Worker function for _ainsert_archive().
+
+    :param member: A (member name, data) tuple yielded by archive.iter_archive().
+    :param parser_config: xmlutils.ParserConfig object used when parsing the member.
+    :param keep_source: If set, the IOC keeps the member data as its source.
+    :return: A tuple of (member name, IOC object or IOCParseError).
+    """
+    name, data = member
+    try:
+        return name, ioc_api.IOC.from_bytes(data, parser_config, keep_source)
+    except ioc_api.IOCParseError as e:
+        return name, e
+
+
+async def _ainsert_archive(iocm, filename, concurrency, executor):
+    """
+    Load the .ioc files contained in an archive into an IOCManager, as IOCManager.insert() does, without blocking
+    the event loop.
+
+    :param iocm: IOCManager object.
+    :param filename: Path to a zip, tar or gzip archive.
+    :param concurrency: Maximum number of members being parsed at once.
+    :param executor: concurrent.futures.Executor used to read and parse the members.
+    :return: A list of member paths which could not be parsed.  If the archive itself could not be read, its path
+     is included.
+    """
+    loop = asyncio.get_running_loop()
+    path = os.path.abspath(filename)
+    log.info('loading IOCs from archive: {}'.format(filename))
+    try:
+        st = await loop.run_in_executor(executor, os.stat, path)
+    except OSError:
+        log.exception('Unable to stat file [{}]'.format(filename))
+        return [filename]
+    errors = []
+    members = _aiter_blocking(archive.iter_archive(path), executor)
+    func = functools.partial(_read_member, parser_config=iocm.parser_config, keep_source=iocm.keep_source)
+    try:
+        async for name, result in _amap(func, members, concurrency, executor):
+            member_path = archive.get_member_path(path, name)
+            if isinstance(result, ioc_api.IOCParseError):
+                log.error('Parse Error [{}]'.format(member_path))
+                errors.append(member_path)
+                continue
+            iocm.parse(result)
+            iocm._track_member(path, name, st, result)
+    except ioc_api.IOCParseError:
+        errors.append(filename)
+    return errors
+
+
+async def ainsert(iocm, filename, concurrency=DEFAULT_CONCURRENCY, executor=None):
+    """
+    Load files into an IOCManager without blocking the event loop.  This is the implementation of
+    IOCManager.ainsert().
+
+    Files and archive members are read and parsed in the executor; the IOCs are passed to iocm.parse() on the event
+    loop, so parser callbacks and index updates run in the same thread as the caller.
+
+    :param iocm: IOCManager object.
+    :param filename: File or directory pointing to .ioc files, or an archive containing .ioc files.
+    :param concurrency: Maximum number of files being loaded at once.
+    :param executor: concurrent.futures.Executor used to load the files.  By default, a thread pool with
+     concurrency threads is used.
+    :return: A list of .ioc files which could not be parsed.
+    """
+    loop = asyncio.get_running_loop()
+    with _Executor(executor, concurrency) as executor:
+        iocm._add_source(filename, recursive=False)
+        if archive.is_archive(filename):
+            errors = await _ainsert_archive(iocm, filename, concurrency, executor)
+            log.info('Parsed [{}] IOCs'.format(len(iocm)))
+            return errors
+        fns = await loop.run_in_executor(executor, _list_files, filename, False)
+        errors = []
+        func = functools.partial(_load_ioc, iocm)
+        async for fn, st, result in _amap(func, fns, concurrency, executor):
+            if isinstance(result, ioc_api.IOCParseError):
+                errors.append(fn)
+                continue
+            try:
+                if isinstance(result, IOCHandle):
+                    iocm.parse_handle(result)
+                    iocm.ioc_files[result.path] = (get_fingerprint(st), result.iocid)
+                else:
+                    iocm.parse(result)
+                    iocm._track_file(fn, st, result)
+            except ioc_api.IOCParseError:
+                log.exception('Parse Error [{}]'.format(fn))
+                errors.append(fn)
+    log.info('Parsed [{}] IOCs'.format(len(iocm)))
+    return errors
@@ -0,0 +1,147 @@
+"""
+archive.py from ioc_writer
+Created: 10/17/26
+
+Purpose: Read .ioc files directly out of zip, tar and gzip archives, without extracting them to disk.
+
+Supported archives are identified by their extension: .zip, .tar (optionally compressed with gzip, bzip2 or xz)
+and single gzip compressed files.  Members are returned with their path inside the archive, so the source of each
+IOC can be recorded.
+
+Usage example:
+::
+    for name, data in iter_archive('ioc_drop.zip'):
+        ioc_obj = IOC.from_bytes(data)
+
+"""
+# Stdlib
+from __future__ import print_function
+import gzip
+import logging
+import os
+import tarfile
+import zipfile
+import zlib
+# Custom Code
+import ioc_writer.ioc_api as ioc_api
+
+log = logging.getLogger(__name__)
+
+__author__ = 'will.gibb'
+
+ZIP_EXTENSIONS = ('.zip',)
+TAR_EXTENSIONS = ('.tar',
+                  '.tar.gz',
+                  '.tgz',
+                  '.tar.bz2',
+                  '.tbz2',
+                  '.tar.xz',
+                  '.txz')
+GZIP_EXTENSIONS = ('.gz',)
+ARCHIVE_EXTENSIONS = ZIP_EXTENSIONS + TAR_EXTENSIONS + GZIP_EXTENSIONS
+ARCHIVE_ERRORS = (IOError, OSError, EOFError, KeyError, zipfile.BadZipfile, tarfile.TarError, zlib.error)
+
+
+def is_archive(filename):
+    """
+    Check if a path is an archive which IOCs can be read from.
+
+    :param filename: Path to check.
+    :return: True if the path is a file with a supported archive extension.
+    """
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS) and os.path.isfile(filename)
+
+
+def get_member_path(filename, name):
+    """
+    Get the path used to identify an archive member, which is the member name joined onto the archive path.
+
+    :param filename: Archive path.
+    :param name: Name of the member within the archive.
+    :return: Member path.
+    """
+    return os.path.join(filename, name)
+
+
+def _is_ioc_member(name):
+    """
+    Check if an archive member name refers to an .ioc file.  Members in hidden directories are skipped.
+
+    :param name: Name of the member within the archive.
+    :return: True if the member should be read.
+    """
+    parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+    if not parts or not parts[-1].endswith('.ioc'):
+        return False
+    return not any(part.startswith('.') for part in parts)
+
+
+def _gzip_member_name(filename):
+    """
+    :param filename: Path of a gzip compressed file.
+    :return: The name of the file contained in it.
+    """
+    return os.path.basename(filename)[:-len('.gz')]
+
+
+def iter_archive(filename):
+    """
+    Read the .ioc files contained in an archive.
+
+    Members are read one at a time in archive order.  Tar archives are read as a stream, so each member is only
+    decompressed once.
+
+    :param filename: Path to a zip, tar or gzip archive.
+    :return: A generator yielding (member name, data) tuples.
+    :raises: IOCParseError if the archive could not be read.
+    """
+    lower = filename.lower()
+    try:
+        if lower.endswith(ZIP_EXTENSIONS):
+            with zipfile.ZipFile(filename) as zf:
+                for info in zf.infolist():
+                    if not info.filename.endswith('/') and _is_ioc_member(info.filename):
+                        yield info.filename, zf.read(info)
+        elif lower.endswith(TAR_EXTENSIONS):
+            with tarfile.open(filename, 'r|*') as tf:
+                for member in tf:
+                    if member.isfile() and _is_ioc_member(member.name):
+                        yield member.name, tf.extractfile(member).read()
+        elif lower.endswith(GZIP_EXTENSIONS):
+            with gzip.open(filename, 'rb') as f:
+                data = f.read()
+            yield _gzip_member_name(filename), data
+        else:
+            raise ioc_api.IOCParseError('Unsupported archive type [{}]'.format(filename))
+    except ARCHIVE_ERRORS:
+        log.exception('unable to read archive [{}]'.format(filename))
+        raise ioc_api.IOCParseError('Error occured reading archive [{}]'.format(filename))
+
+
+def read_archive_member(filename, name):
+    """
+    Read a single member of an archive.
+
+    :param filename: Path to a zip, tar or gzip archive.
+    :param name: Name of the member within the archive, as returned by iter_archive().
+    :return: The member data.
+    :raises: IOCParseError if the member could not be read.
+    """
+    lower = filename.lower()
+    try:
+        if lower.endswith(ZIP_EXTENSIONS):
+            with zipfile.ZipFile(filename) as zf:
+                return zf.read(name)
+        elif lower.endswith(TAR_EXTENSIONS):
+            with tarfile.open(filename, 'r:*') as tf:
+                f = tf.extractfile(name)
+                if f is None:
+                    raise KeyError(name)
+                return f.read()
+        elif lower.endswith(GZIP_EXTENSIONS) and name == _gzip_member_name(filename):
+            with gzip.open(filename, 'rb') as f:
+                return f.read()
+        raise KeyError(name)
+    except ARCHIVE_ERRORS:
+        log.exception('unable to read [{}] from archive [{}]'.format(name, filename))
+        raise ioc_api.IOCParseError('Error occured reading [{}] from archive [{}]'.format(name, filename))
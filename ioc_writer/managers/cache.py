@@ -0,0 +1,196 @@
+"""
+cache.py from ioc_writer
+Created: 10/17/26
+
+Purpose: Provide an on-disk cache of parsed IOCs, so unchanged files do not have to be re-parsed on every run.
+
+Each cache entry holds a one line JSON header, followed by the IOC serialized without whitespace, without its
+default namespace declaration and in its original encoding.  The header records the size and modification time
+of the source file, which are compared against the file before the entry is used, along with a summary of the
+IOC metadata and criteria.
+
+Usage example:
+::
+    cache = ParseCache('./ioc_cache')
+    iocm = IOCManager(cache=cache)
+    iocm.insert(iocs_dir)
+
+"""
+# Stdlib
+from __future__ import print_function
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+# Third Party code
+from lxml import etree as et
+# Custom Code
+import ioc_writer.ioc_api as ioc_api
+import ioc_writer.utils as utils
+from ioc_writer.utils import xmlutils
+
+log = logging.getLogger(__name__)
+
+__author__ = 'will.gibb'
+
+CACHE_VERSION = 2
+CACHE_EXTENSION = '.iocc'
+
+
+def get_fingerprint(st):
+    """
+    Get the values used to decide if a cache entry is still valid for a file.
+
+    :param st: os.stat_result for the file.
+    :return: A tuple of (size, modification time in nanoseconds).
+    """
+    mtime = getattr(st, 'st_mtime_ns', None)
+    if mtime is None:
+        mtime = int(st.st_mtime * 1000000000)
+    return st.st_size, mtime
+
+
+def get_summary(ioc_obj):
+    """
+    Extract a summary of the IOC metadata and criteria.
+
+    :param ioc_obj: ioc_api.IOC object.
+    :return: dictionary.
+    """
+    metadata = ioc_obj.metadata
+    return {'iocid': ioc_obj.iocid,
+            'short_description': metadata.findtext('short_description'),
+            'authored_by': metadata.findtext('authored_by'),
+            'authored_date': metadata.findtext('authored_date'),
+            'last-modified': ioc_obj.root.get('last-modified'),
+            'indicators': sum(1 for _ in ioc_obj.root.iter('Indicator')),
+            'indicatoritems': sum(1 for _ in ioc_obj.root.iter('IndicatorItem'))}
+
+
+class ParseCache(object):
+    """
+    Directory of pre-parsed IOCs, keyed by the absolute path of the source file and the parser options used to parse
+    it, so managers with different ParserConfig objects do not share entries.
+
+    :param directory: Directory to store cache entries in.  It is created if it does not exist.
+    """
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+        utils.safe_makedirs(self.directory)
+
+    def get_entry_path(self, fn, parser_config=None):
+        """
+        Get the path of the cache entry for a file.
+
+        :param fn: Path to the source file.
+        :param parser_config: xmlutils.ParserConfig object used when parsing the file.  Defaults to
+         xmlutils.DEFAULT_PARSER_CONFIG.
+        :return: Path to the cache entry.
+        """
+        if parser_config is None:
+            parser_config = xmlutils.DEFAULT_PARSER_CONFIG
+        key = json.dumps([os.path.abspath(fn), parser_config.get_options()], sort_keys=True)
+        key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key + CACHE_EXTENSION)
+
+    def get(self, fn, st=None, parser_config=None):
+        """
+        Read the cache entry for a file, if it is present and still matches the file.
+
+        :param fn: Path to the source file.
+        :param st: os.stat_result for the source file.  If not provided, the file is stat'd.
+        :param parser_config: xmlutils.ParserConfig object used when parsing the file.
+        :return: A tuple of (header dictionary, serialized xml), or None if there is no valid entry.
+        """
+        if st is None:
+            st = os.stat(fn)
+        try:
+            with open(self.get_entry_path(fn, parser_config), 'rb') as f:
+                header = json.loads(f.readline().decode('utf-8'))
+                if header.get('version') != CACHE_VERSION or \
+                        header.get('path') != os.path.abspath(fn) or \
+                        tuple(header.get('fingerprint', ())) != get_fingerprint(st):
+                    return None
+                data = f.read()
+        except (IOError, OSError):
+            return None
+        except ValueError:
+            log.warning('Ignoring corrupt cache entry for [{}]'.format(fn))
+            return None
+        return header, data
+
+    def load(self, fn, parser_config=None, st=None):
+        """
+        Rebuild an IOC from the cache entry for a file.
+
+        :param fn: Path to the source file.
+        :param parser_config: xmlutils.ParserConfig object used when parsing the cached data.
+        :param st: os.stat_result for the source file.  If not provided, the file is stat'd.
+        :return: ioc_api.IOC object, or None if there is no valid entry.
+        """
+        entry = self.get(fn, st, parser_config)
+        if entry is None:
+            return None
+        header, data = entry
+        try:
+            ioc_obj = ioc_api.IOC.from_bytes(data, parser_config)
+        except ioc_api.IOCParseError:
+            log.warning('Ignoring corrupt cache entry for [{}]'.format(fn))
+            return None
+        if header.get('namespace'):
+            ioc_obj.root.set('xmlns', header['namespace'])
+        return ioc_obj
+
+    def store(self, fn, ioc_obj, st=None, parser_config=None):
+        """
+        Write a cache entry for a file.
+
+        The stat information should be collected before the file is parsed, so a file modified while it was
+        being parsed does not get a cache entry that appears valid.  Entries are written to a uniquely named
+        temporary file and then renamed into place, so concurrent writers do not interfere with each other.
+
+        :param fn: Path to the source file.
+        :param ioc_obj: ioc_api.IOC object parsed from the file.
+        :param st: os.stat_result for the source file.  If not provided, the file is stat'd.
+        :param parser_config: xmlutils.ParserConfig object the IOC was parsed with.
+        :return: True, unless the entry could not be written.
+        """
+        if st is None:
+            st = os.stat(fn)
+        root = ioc_obj.root
+        tree = root.getroottree()
+        namespace = root.attrib.pop('xmlns', None)
+        try:
+            data = et.tostring(tree, encoding=tree.docinfo.encoding or 'utf-8', xml_declaration=True)
+        finally:
+            if namespace is not None:
+                root.set('xmlns', namespace)
+        header = {'version': CACHE_VERSION,
+                  'path': os.path.abspath(fn),
+                  'fingerprint': get_fingerprint(st),
+                  'namespace': namespace,
+                  'summary': get_summary(ioc_obj)}
+        entry_path = self.get_entry_path(fn, parser_config)
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(suffix='.tmp', prefix=os.path.basename(entry_path) + '.',
+                                            dir=self.directory)
+            with io.open(fd, 'wb') as f:
+                f.write(json.dumps(header, sort_keys=True).encode('utf-8'))
+                f.write(b'\n')
+                f.write(data)
+            if hasattr(os, 'replace'):
+                os.replace(tmp_path, entry_path)
+            else:
+                # Python 2 cannot rename over an existing file on Windows
+                if os.path.exists(entry_path):
+                    os.remove(entry_path)
+                os.rename(tmp_path, entry_path)
+        except (IOError, OSError):
+            log.exception('Failed to write cache entry for [{}]'.format(fn))
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        return True
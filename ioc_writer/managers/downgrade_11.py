@@ -48,6 +48,7 @@ from lxml import etree as et
 # Custom Code
 import ioc_writer.ioc_api as ioc_api
 import ioc_writer.utils as utils
+from ioc_writer.utils import xpaths
 from ioc_writer.managers import IOCManager
 
 log = logging.getLogger(__name__)
@@ -77,9 +78,13 @@ class DowngradeManager(IOCManager):
     Convert the OpenIOC 1.1 documents into a 1.0 format.  The converts IOCs are stored in self.iocs_10.
     IOCs which would have all nodes removed from under their top-level OR would be added to self.null_pruned_iocs
     IOCs which have at least one node, but not all nodes, removed would be added to self.prunded_11_iocs.
+
+    :param parser_config: xmlutils.ParserConfig object used when parsing .ioc files.
+     Defaults to xmlutils.DEFAULT_PARSER_CONFIG.
+    :param cache: cache.ParseCache object used to avoid re-parsing unchanged .ioc files.
     """
-    def __init__(self):
-        IOCManager.__init__(self)
+    def __init__(self, parser_config=None, cache=None):
+        IOCManager.__init__(self, parser_config, cache)
         self.iocs_10 = {}  # elementTree representing the IOC, used by ioc_manager.convert_to_10
         self.pruned_11_iocs = set()  # set representing pruned IOCs, used by ioc_manager.convert_to_10
         self.null_pruned_iocs = set()  # set representing null IOCs, used by ioc_manager.convert_to_10
@@ -109,13 +114,13 @@ class DowngradeManager(IOCManager):
             created_date_11 = metadata.findtext('.//authored_date')
             last_modified_date_11 = ioc_obj_11.root.get('last-modified')
             links_11 = []
-            for link in metadata.xpath('//link'):
+            for link in xpaths.LINKS(metadata):
                 link_rel = link.get('rel')
                 link_text = link.text
                 links_11.append((link_rel, None, link_text))
             # get ioc_logic
             try:
-                ioc_logic = ioc_obj_11.root.xpath('.//criteria')[0]
+                ioc_logic = xpaths.CRITERIA(ioc_obj_11.root)[0]
             except IndexError:
                 log.exception(
                     'Could not find criteria nodes for IOC [{}].  Did you attempt to convert OpenIOC 1.0 iocs?'.format(
@@ -132,7 +137,7 @@ class DowngradeManager(IOCManager):
             tlo_id = tlo_11.get('id')
             # record comment parameters
             comment_dict = {}
-            for param in ioc_obj_11.parameters.xpath('//param[@name="comment"]'):
+            for param in ioc_obj_11.get_params_by_name('comment'):
                 param_id = param.get('ref-id')
                 param_text = param.findtext('value')
                 comment_dict[param_id] = param_text
@@ -177,10 +182,10 @@ class DowngradeManager(IOCManager):
             ids_to_skip = set()
             indicatoritems_to_remove = set()
             for condition_type in self.openioc_11_only_conditions:
-                for elem in ioc_logic.xpath('//IndicatorItem[@condition="%s"]' % condition_type):
+                for elem in xpaths.ITEMS_BY_CONDITION(ioc_logic, condition=condition_type):
                     pruned = True
                     indicatoritems_to_remove.add(elem)
-            for elem in ioc_logic.xpath('//IndicatorItem[@preserve-case="true"]'):
+            for elem in xpaths.ITEMS_BY_PRESERVE_CASE(ioc_logic, preserve_case='true'):
                 pruned = True
                 indicatoritems_to_remove.add(elem)
             # walk up from each indicatoritem
@@ -254,11 +259,11 @@ class DowngradeManager(IOCManager):
                     new_condition = condition + 'not'
                 else:
                     new_condition = condition
-                document = node.xpath('Context/@document')[0]
-                search = node.xpath('Context/@search')[0]
-                content_type = node.xpath('Content/@type')[0]
+                document = xpaths.CONTEXT_DOCUMENT(node)[0]
+                search = xpaths.CONTEXT_SEARCH(node)[0]
+                content_type = xpaths.CONTENT_TYPE(node)[0]
                 content = node.findtext('Content')
-                context_type = node.xpath('Context/@type')[0]
+                context_type = xpaths.CONTEXT_TYPE(node)[0]
                 new_ii_node = ioc_api.make_indicatoritem_node(condition=condition,
                                                               document=document,
                                                               search=search,
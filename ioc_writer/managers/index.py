@@ -0,0 +1,726 @@
+"""
+index.py from ioc_writer
+Created: 10/17/26
+
+Purpose: Provide indexes over a set of IOCs, so questions such as "which IOCs contain FileItem/Md5sum is X" or
+"which IOCs mention svchost" can be answered without walking every IOC.
+
+ItemIndex is an inverted index over IndicatorItems.  Each IndicatorItem is stored as an ioc_compact.CompactItem,
+and is posted under its Context/@search value, its normalized content, and the combination of its search, condition
+and normalized content.  Content is normalized by removing surrounding whitespace and lowercasing it, so content
+queries are case insensitive.
+
+TrigramIndex supports substring queries over IndicatorItem content and metadata text.  Each text is posted under
+the three character substrings of its lowercased value; a query is answered by intersecting the postings of its
+own trigrams, and the candidates are then checked against the query.
+
+MetadataIndex keeps the last-modified dates in sorted order, so date ranges are found with a binary search, along
+with hashed indexes of authors, keywords and links.
+
+FingerprintIndex groups IOCs by IOC.structural_hash(), so IOCs with equivalent criteria can be found, and collapsed
+by IOCManager when it is created with collapse_duplicates set.
+
+Usage example:
+::
+    iocm = IOCManager(item_index=ItemIndex(), text_index=TrigramIndex(), metadata_index=MetadataIndex())
+    iocm.insert(iocs_dir)
+    for iocid, nid in iocm.item_index.find(search='FileItem/Md5sum', condition='is', content=md5):
+        print(iocid, nid)
+    for iocid, ref in iocm.text_index.find('svchost'):
+        print(iocid, ref)
+    for iocid in iocm.metadata_index.modified_since('2015-01-01T00:00:00'):
+        print(iocid)
+
+"""
+# Stdlib
+from __future__ import print_function
+import abc
+import bisect
+import datetime
+import logging
+# Custom Code
+import ioc_writer.ioc_api as ioc_api
+import ioc_writer.ioc_compact as ioc_compact
+
+log = logging.getLogger(__name__)
+
+__author__ = 'will.gibb'
+
+# Metadata elements whose text is indexed by TrigramIndex
+METADATA_TEXT_TAGS = ('short_description',
+                      'description',
+                      'keywords',
+                      'authored_by')
+
+
+def normalize_content(content):
+    """
+    Normalize IndicatorItem content for use as an index key.
+
+    :param content: Content text, or None.
+    :return: The content with surrounding whitespace removed, in lower case.
+    """
+    if content is None:
+        return ''
+    return content.strip().lower()
+
+
+class IOCIndex(abc.ABCMeta('_IOCIndexBase', (object,), {})):
+    """
+    Abstract base class for the indexes maintained by IOCManager.
+
+    The index is updated with add_ioc() and remove(), which IOCManager calls as IOCs are parsed and removed.  If an
+    IOC is added again, its previous entries are replaced.  When an IOC held by the manager is modified,
+    invalidate() is called; the IOC is indexed again before the next query, so a series of edits is only indexed
+    once.
+
+    Subclasses must implement _add_ioc() and _remove(), and call _flush() before answering a query.  IOCIndex
+    itself cannot be instantiated.
+    """
+    def __init__(self):
+        self._pending = {}  # iocid -> IOC object modified since it was indexed
+
+    def add_ioc(self, ioc_obj):
+        """
+        Add an IOC to the index, replacing any previous entries for its iocid.
+
+        :param ioc_obj: ioc_api.IOC object.
+        :return:
+        """
+        self._pending.pop(ioc_obj.iocid, None)
+        self._add_ioc(ioc_obj)
+
+    def remove(self, iocid):
+        """
+        Remove an IOC from the index.
+
+        :param iocid: iocid of the IOC.
+        :return: True if the IOC was in the index.
+        """
+        self._pending.pop(iocid, None)
+        return self._remove(iocid)
+
+    def invalidate(self, ioc_obj):
+        """
+        Mark an IOC as modified, so it is indexed again before the next query.
+
+        :param ioc_obj: ioc_api.IOC object.
+        :return:
+        """
+        self._pending[ioc_obj.iocid] = ioc_obj
+
+    def _flush(self):
+        """
+        Index the IOCs modified since the last query.
+
+        :return:
+        """
+        while self._pending:
+            iocid, ioc_obj = self._pending.popitem()
+            self._add_ioc(ioc_obj)
+
+    @abc.abstractmethod
+    def _add_ioc(self, ioc_obj):
+        """
+        Add an IOC to the index.  If the iocid is already indexed, its previous entries must be replaced.
+
+        :param ioc_obj: ioc_api.IOC object.
+        :return:
+        """
+
+    @abc.abstractmethod
+    def _remove(self, iocid):
+        """
+        Remove the entries for an IOC from the index.
+
+        :param iocid: iocid of the IOC.
+        :return: True if the IOC was in the index.
+        """
+
+
+class ItemIndex(IOCIndex):
+    """
+    Inverted index over the IndicatorItems of a set of IOCs.
+
+    :param terms: ioc_compact.TermTable used to intern the search and condition values.  Defaults to
+     ioc_compact.TERMS.
+    """
+    def __init__(self, terms=None):
+        IOCIndex.__init__(self)
+        if terms is None:
+            terms = ioc_compact.TERMS
+        self.terms = terms
+        self._items = {}  # iocid -> tuple of CompactItem objects
+        self._by_search = {}  # search code -> {iocid: [CompactItem, ...]}
+        self._by_content = {}  # normalized content -> {iocid: [CompactItem, ...]}
+        self._by_item = {}  # (search code, condition code, normalized content) -> {iocid: [CompactItem, ...]}
+
+    def __len__(self):
+        """
+        :return: Number of IOCs in the index.
+        """
+        return len(self._items)
+
+    def __contains__(self, iocid):
+        return iocid in self._items
+
+    def _iter_keys(self, item):
+        """
+        :param item: ioc_compact.CompactItem object.
+        :return: A generator of (postings dictionary, key) tuples the item is posted under.
+        """
+        search_code = self.terms.code(item.search)
+        content = normalize_content(item.content)
+        yield self._by_search, search_code
+        yield self._by_content, content
+        yield self._by_item, (search_code, self.terms.code(item.condition), content)
+
+    def _add_ioc(self, ioc_obj):
+        """
+        Add the IndicatorItems of an IOC to the index.
+
+        :param ioc_obj: ioc_api.IOC object.
+        :return:
+        """
+        tree = None
+        if ioc_obj.top_level_indicator is not None:
+            tree = ioc_api.make_compact_node(ioc_obj.top_level_indicator, terms=self.terms)
+        self._add_tree(ioc_obj.iocid, tree)
+
+    def add(self, iocid, tree):
+        """
+        Add the IndicatorItems of a compact criteria tree to the index.
+
+        :param iocid: iocid of the IOC the tree belongs to.
+        :param tree: ioc_compact.CompactIndicator object, such as one returned by IOC.to_compact(), or None if the IOC
+         has no criteria.
+        :return:
+        """
+        self._pending.pop(iocid, None)
+        self._add_tree(iocid, tree)
+
+    def _add_tree(self, iocid, tree):
+        """
+        :param iocid: iocid of the IOC the tree belongs to.
+        :param tree: ioc_compact.CompactIndicator object, or None.
+        :return:
+        """
+        self._remove(iocid)
+        items = () if tree is None else tuple(tree.iter_items())
+        self._items[iocid] = items
+        for item in items:
+            for postings, key in self._iter_keys(item):
+                postings.setdefault(key, {}).setdefault(iocid, []).append(item)
+
+    def _remove(self, iocid):
+        """
+        Remove the IndicatorItems of an IOC from the index.
+
+        :param iocid: iocid of the IOC.
+        :return: True if the IOC was in the index.
+        """
+        items = self._items.pop(iocid, None)
+        if items is None:
+            return False
+        for item in items:
+            for postings, key in self._iter_keys(item):
+                entries = postings.get(key)
+                if entries is None:
+                    continue
+                entries.pop(iocid, None)
+                if not entries:
+                    del postings[key]
+        return True
+
+    def get_items(self, iocid):
+        """
+        :param iocid: iocid of an IOC.
+        :return: A tuple of the ioc_compact.CompactItem objects indexed for the IOC, in document order.
+        """
+        self._flush()
+        return self._items.get(iocid, ())
+
+    def find(self, search=None, condition=None, content=None):
+        """
+        Find the IndicatorItems matching a query.  At least one of search or content must be provided.
+
+        :param search: Context/@search value, such as 'FileItem/Md5sum'.
+        :param condition: IndicatorItem/@condition value, such as 'is'.
+        :param content: Content value.  This is compared after normalization, so the comparison is case insensitive.
+        :return: A list of (iocid, IndicatorItem id) tuples.
+        :raises: ValueError if neither search nor content is provided.
+        """
+        if search is None and content is None:
+            raise ValueError('A search or content value is required')
+        self._flush()
+        search_code = condition_code = None
+        if search is not None:
+            search_code = self.terms.get_code(search)
+            if search_code is None:
+                return []
+        if condition is not None:
+            condition_code = self.terms.get_code(condition)
+            if condition_code is None:
+                return []
+        if content is not None:
+            content = normalize_content(content)
+        if search is not None and condition is not None and content is not None:
+            postings = self._by_item.get((search_code, condition_code, content))
+        elif content is not None:
+            postings = self._by_content.get(content)
+        else:
+            postings = self._by_search.get(search_code)
+        if not postings:
+            return []
+        results = []
+        for iocid, items in postings.items():
+            for item in items:
+                if search is not None and item.search != search:
+                    continue
+                if condition is not None and item.condition != condition:
+                    continue
+                results.append((iocid, item.nid))
+        return results
+
+    def find_iocids(self, search=None, condition=None, content=None):
+        """
+        Find the IOCs with an IndicatorItem matching a query.  The parameters are the same as find().
+
+        :return: A set of iocids.
+        """
+        return set(iocid for iocid, nid in self.find(search, condition, content))
+
+
+def get_trigrams(text):
+    """
+    :param text: String.
+    :return: A set of the three character substrings of text.
+    """
+    return set(text[i:i + 3] for i in range(len(text) - 2))
+
+
+class TrigramIndex(IOCIndex):
+    """
+    Substring index over the IndicatorItem content and metadata text of a set of IOCs.
+
+    Each indexed text is identified by a reference: the IndicatorItem id for content, or the metadata element name
+    (short_description, description, keywords, authored_by or link) for metadata text.
+    """
+    def __init__(self):
+        IOCIndex.__init__(self)
+        self._docs = {}  # doc id -> (iocid, reference, text)
+        self._ioc_docs = {}  # iocid -> list of doc ids
+        self._postings = {}  # trigram -> set of doc ids
+        self._next_doc = 0
+
+    def __len__(self):
+        """
+        :return: Number of IOCs in the index.
+        """
+        return len(self._ioc_docs)
+
+    def __contains__(self, iocid):
+        return iocid in self._ioc_docs
+
+    @staticmethod
+    def _iter_texts(ioc_obj):
+        """
+        :param ioc_obj: ioc_api.IOC object.
+        :return: A generator of (reference, text) tuples for the text indexed for an IOC.
+        """
+        for tag in METADATA_TEXT_TAGS:
+            text = ioc_obj.metadata.findtext(tag)
+            if text:
+                yield tag, text
+        for link in ioc_obj.metadata.iter('link'):
+            if link.text:
+                yield 'link', link.text
+        if ioc_obj.top_level_indicator is None:
+            return
+        for node in ioc_obj.top_level_indicator.iter('IndicatorItem'):
+            text = node.findtext('Content')
+            if text:
+                yield node.get('id'), text
+
+    def _add_ioc(self, ioc_obj):
+        """
+        Add the IndicatorItem content and metadata text of an IOC to the index.
+
+        :param ioc_obj: ioc_api.IOC object.
+        :return:
+        """
+        iocid = ioc_obj.iocid
+        self._remove(iocid)
+        doc_ids = []
+        for ref, text in self._iter_texts(ioc_obj):
+            doc_id = self._next_doc
+            self._next_doc += 1
+            self._docs[doc_id] = (iocid, ref, text)
+            doc_ids.append(doc_id)
+            for trigram in get_trigrams(text.lower()):
+                self._postings.setdefault(trigram, set()).add(doc_id)
+        self._ioc_docs[iocid] = doc_ids
+
+    def _remove(self, iocid):
+        """
+        Remove the text of an IOC from the index.
+
+        :param iocid: iocid of the IOC.
+        :return: True if the IOC was in the index.
+        """
+        doc_ids = self._ioc_docs.pop(iocid, None)
+        if doc_ids is None:
+            return False
+        for doc_id in doc_ids:
+            iocid, ref, text = self._docs.pop(doc_id)
+            for trigram in get_trigrams(text.lower()):
+                postings = self._postings.get(trigram)
+                if postings is None:
+                    continue
+                postings.discard(doc_id)
+                if not postings:
+                    del self._postings[trigram]
+        return True
+
+    def _get_candidates(self, query):
+        """
+        :param query: Lowercased query string.
+        :return: An iterable of doc ids which may contain the query.
+        """
+        trigrams = get_trigrams(query)
+        if not trigrams:
+            # Queries shorter than a trigram are checked against every text
+            return self._docs
+        postings = []
+        for trigram in trigrams:
+            doc_ids = self._postings.get(trigram)
+            if not doc_ids:
+                return ()
+            postings.append(doc_ids)
+        postings.sort(key=len)
+        return postings[0].intersection(*postings[1:])
+
+    def find(self, text, case_sensitive=False):
+        """
+        Find the indexed text which contains a substring.
+
+        :param text: Substring to search for.
+        :param case_sensitive: If set, the substring must match the case of the indexed text.
+        :return: A list of (iocid, reference) tuples, in the order the text was indexed.
+        """
+        self._flush()
+        query = text.lower()
+        results = []
+        for doc_id in sorted(self._get_candidates(query)):
+            iocid, ref, doc_text = self._docs[doc_id]
+            if case_sensitive:
+                if text not in doc_text:
+                    continue
+            elif query not in doc_text.lower():
+                continue
+            results.append((iocid, ref))
+        return results
+
+    def find_iocids(self, text, case_sensitive=False):
+        """
+        Find the IOCs which contain a substring.  The parameters are the same as find().
+
+        :return: A set of iocids.
+        """
+        return set(iocid for iocid, ref in self.find(text, case_sensitive))
+
+
+def normalize_date(value):
+    """
+    Normalize a date for comparison with the dates held by MetadataIndex.
+
+    :param value: datetime.datetime object, or a string in the xsdDate form YYYY-MM-DDTHH:MM:SS.  A trailing 'Z' is
+     removed from strings.
+    :return: String in the xsdDate form, or None.
+    """
+    if value is None:
+        return None
+    if isinstance(value, datetime.datetime):
+        return value.strftime('%Y-%m-%dT%H:%M:%S')
+    return value.strip().rstrip('Z')
+
+
+class MetadataIndex(IOCIndex):
+    """
+    Secondary indexes over the metadata of a set of IOCs.
+
+    The last-modified dates are kept in a sorted list, so date ranges are found with a binary search.  Authors,
+    keywords and links are kept in hashed indexes.  Authors, keywords and link values are compared after
+    normalization with normalize_content(), so lookups are case insensitive.  Keywords are the whitespace separated
+    values of the keywords element, and a link is indexed under both its text and its href.
+    """
+    def __init__(self):
+        IOCIndex.__init__(self)
+        self._entries = {}  # iocid -> (last modified, author, keywords, links)
+        self._last_modified = []  # sorted list of (last modified, iocid) tuples
+        self._by_author = {}  # author -> set of iocids
+        self._by_keyword = {}  # keyword -> set of iocids
+        self._by_link = {}  # (rel, None) or (rel, link value) -> set of iocids
+
+    def __len__(self):
+        """
+        :return: Number of IOCs in the index.
+        """
+        return len(self._entries)
+
+    def __contains__(self, iocid):
+        return iocid in self._entries
+
+    @staticmethod
+    def _get_entry(ioc_obj):
+        """
+        :param ioc_obj: ioc_api.IOC object.
+        :return: A tuple of the (last modified, author, keywords, link keys) values indexed for an IOC.
+        """
+        metadata = ioc_obj.metadata
+        author = metadata.findtext('authored_by')
+        if author is not None:
+            author = normalize_content(author)
+        keywords = frozenset(normalize_content(metadata.findtext('keywords')).split())
+        links = set()
+        for link in metadata.iter('link'):
+            rel = link.get('rel')
+            links.add((rel, None))
+            for value in (link.text, link.get('href')):
+                if value:
+                    links.add((rel, normalize_content(value)))
+        return normalize_date(ioc_obj.root.get('last-modified')), author, keywords, frozenset(links)
+
+    def _add_ioc(self, ioc_obj):
+        """
+        Add the metadata of an IOC to the index.
+
+        :param ioc_obj: ioc_api.IOC object.
+        :return:
+        """
+        iocid = ioc_obj.iocid
+        self._remove(iocid)
+        entry = self._get_entry(ioc_obj)
+        last_modified, author, keywords, links = entry
+        self._entries[iocid] = entry
+        if last_modified:
+            bisect.insort(self._last_modified, (last_modified, iocid))
+        if author:
+            self._by_author.setdefault(author, set()).add(iocid)
+        for keyword in keywords:
+            self._by_keyword.setdefault(keyword, set()).add(iocid)
+        for key in links:
+            self._by_link.setdefault(key, set()).add(iocid)
+
+    def _remove(self, iocid):
+        """
+        Remove the metadata of an IOC from the index.
+
+        :param iocid: iocid of the IOC.
+        :return: True if the IOC was in the index.
+        """
+        entry = self._entries.pop(iocid, None)
+        if entry is None:
+            return False
+        last_modified, author, keywords, links = entry
+        if last_modified:
+            i = bisect.bisect_left(self._last_modified, (last_modified, iocid))
+            del self._last_modified[i]
+        if author:
+            self._discard(self._by_author, author, iocid)
+        for keyword in keywords:
+            self._discard(self._by_keyword, keyword, iocid)
+        for key in links:
+            self._discard(self._by_link, key, iocid)
+        return True
+
+    @staticmethod
+    def _discard(postings, key, iocid):
+        iocids = postings.get(key)
+        if iocids is None:
+            return
+        iocids.discard(iocid)
+        if not iocids:
+            del postings[key]
+
+    def get_last_modified(self, iocid):
+        """
+        :param iocid: iocid of an IOC.
+        :return: The normalized last-modified date of the IOC, or None.
+        """
+        self._flush()
+        entry = self._entries.get(iocid)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def modified_between(self, start=None, end=None):
+        """
+        Find the IOCs with a last-modified date in a range.  IOCs without a last-modified date are not returned.
+
+        :param start: Earliest date, inclusive.  A datetime.datetime object or a string in the xsdDate form.  If not
+         provided, the range is unbounded.
+        :param end: Latest date, exclusive.  If not provided, the range is unbounded.
+        :return: A list of iocids, in order of last-modified date.
+        """
+        self._flush()
+        lo = 0
+        hi = len(self._last_modified)
+        if start is not None:
+            lo = bisect.bisect_left(self._last_modified, (normalize_date(start),))
+        if end is not None:
+            hi = bisect.bisect_left(self._last_modified, (normalize_date(end),))
+        return [iocid for last_modified, iocid in self._last_modified[lo:hi]]
+
+    def modified_since(self, start):
+        """
+        Find the IOCs modified on or after a date.
+
+        :param start: A datetime.datetime object or a string in the xsdDate form.
+        :return: A list of iocids, in order of last-modified date.
+        """
+        return self.modified_between(start=start)
+
+    def find_by_author(self, author):
+        """
+        :param author: authored_by value.
+        :return: A set of iocids.
+        """
+        self._flush()
+        return set(self._by_author.get(normalize_content(author), ()))
+
+    def find_by_keyword(self, keyword):
+        """
+        :param keyword: A single keyword.
+        :return: A set of iocids.
+        """
+        self._flush()
+        return set(self._by_keyword.get(normalize_content(keyword), ()))
+
+    def find_by_link(self, rel, value=None):
+        """
+        :param rel: link/@rel value.
+        :param value: link text or link/@href value.  If not provided, all IOCs with a link of the given rel are
+         returned.
+        :return: A set of iocids.
+        """
+        self._flush()
+        if value is not None:
+            value = normalize_content(value)
+        return set(self._by_link.get((rel, value), ()))
+
+
+class FingerprintIndex(IOCIndex):
+    """
+    Groups a set of IOCs by the structural hash of their criteria, as computed by IOC.structural_hash().
+
+    Each group lists its iocids in the order they were added; the first is the canonical IOC of the group, and the
+    rest are its duplicates.  Adding an IOC again with an unchanged hash keeps its place in the group.  IOCs without
+    a top level Indicator are not grouped.
+    """
+    def __init__(self):
+        IOCIndex.__init__(self)
+        self._fingerprints = {}  # iocid -> structural hash, or None
+        self._groups = {}  # structural hash -> list of iocids, in the order they were added
+
+    def __len__(self):
+        """
+        :return: Number of IOCs in the index.
+        """
+        return len(self._fingerprints)
+
+    def __contains__(self, iocid):
+        return iocid in self._fingerprints
+
+    def _add_ioc(self, ioc_obj):
+        """
+        Add an IOC to the group for its structural hash.
+
+        :param ioc_obj: ioc_api.IOC object.
+        :return:
+        """
+        iocid = ioc_obj.iocid
+        fingerprint = ioc_obj.structural_hash()
+        if iocid in self._fingerprints and self._fingerprints[iocid] == fingerprint:
+            return
+        self._remove(iocid)
+        self._fingerprints[iocid] = fingerprint
+        if fingerprint is not None:
+            self._groups.setdefault(fingerprint, []).append(iocid)
+
+    def _remove(self, iocid):
+        """
+        Remove an IOC from its group.
+
+        :param iocid: iocid of the IOC.
+        :return: True if the IOC was in the index.
+        """
+        if iocid not in self._fingerprints:
+            return False
+        fingerprint = self._fingerprints.pop(iocid)
+        if fingerprint is not None:
+            group = self._groups[fingerprint]
+            group.remove(iocid)
+            if not group:
+                del self._groups[fingerprint]
+        return True
+
+    def get_fingerprint(self, iocid):
+        """
+        :param iocid: iocid of an IOC.
+        :return: The structural hash of the IOC, or None.
+        """
+        self._flush()
+        return self._fingerprints.get(iocid)
+
+    def get_group(self, iocid):
+        """
+        :param iocid: iocid of an IOC.
+        :return: A list of the iocids with the same structural hash as the IOC, including itself, with the canonical
+         IOC first.  The list is empty if the IOC is not in the index.
+        """
+        self._flush()
+        if iocid not in self._fingerprints:
+            return []
+        fingerprint = self._fingerprints[iocid]
+        if fingerprint is None:
+            return [iocid]
+        return list(self._groups[fingerprint])
+
+    def get_canonical(self, iocid):
+        """
+        :param iocid: iocid of an IOC.
+        :return: The iocid of the canonical IOC of its group, or None if the IOC is not in the index.
+        """
+        group = self.get_group(iocid)
+        if not group:
+            return None
+        return group[0]
+
+    def find(self, fingerprint):
+        """
+        :param fingerprint: Structural hash, as returned by IOC.structural_hash().
+        :return: A list of the iocids with that hash, with the canonical IOC first.
+        """
+        self._flush()
+        return list(self._groups.get(fingerprint, ()))
+
+    def iter_duplicate_groups(self):
+        """
+        :return: A generator of lists of iocids, one for each group with more than one IOC, with the canonical IOC
+         first.
+        """
+        self._flush()
+        for group in list(self._groups.values()):
+            if len(group) > 1:
+                yield list(group)
+
+    def get_duplicates(self):
+        """
+        :return: A dictionary mapping the iocid of each duplicate IOC to the iocid of the canonical IOC of its group.
+        """
+        duplicates = {}
+        for group in self.iter_duplicate_groups():
+            for iocid in group[1:]:
+                duplicates[iocid] = group[0]
+        return duplicates
@@ -0,0 +1,208 @@
+"""
+lazy.py from ioc_writer
+Created: 10/17/26
+
+Purpose: Provide a mapping of iocid -> IOC objects which only keeps a bounded number of parsed IOCs in memory.
+
+Each IOC is registered as a lightweight IOCHandle, recording where the IOC can be loaded from.  The full IOC is
+parsed the first time it is accessed, and the least recently used IOCs are dropped once the residency budget is
+exceeded.  Dropped IOCs are parsed again from their source the next time they are accessed, so any changes made to
+them are lost; IOC objects assigned directly to the mapping are never dropped.
+
+Usage example:
+::
+    iocm = IOCManager(lazy=True, max_resident=1000)
+    iocm.insert(iocs_dir)
+    for iocid in iocm.iocs:
+        print(iocm.ioc_name[iocid])
+
+"""
+# Stdlib
+from __future__ import print_function
+import collections
+import logging
+# Custom Code
+from ioc_writer.managers.scan import read_ioc_metadata
+
+try:
+    # noinspection PyUnresolvedReferences
+    from collections.abc import MutableMapping
+except ImportError:
+    # Python 2
+    from collections import MutableMapping
+
+log = logging.getLogger(__name__)
+
+__author__ = 'will.gibb'
+
+
+class IOCHandle(object):
+    """
+    Records where an IOC can be loaded from, without holding the parsed IOC.
+
+    :param iocid: iocid of the IOC.
+    :param name: Short description of the IOC.
+    :param path: File containing the IOC.
+    :param size: Size of the serialized IOC, in bytes.  Used to estimate the memory used by the parsed IOC.
+    """
+    __slots__ = ('iocid', 'name', 'path', 'size')
+
+    def __init__(self, iocid, name, path, size=0):
+        self.iocid = iocid
+        self.name = name
+        self.path = path
+        self.size = size
+
+    def __repr__(self):
+        return 'IOCHandle(iocid={!r}, name={!r}, path={!r})'.format(self.iocid, self.name, self.path)
+
+
+def read_ioc_header(fn):
+    """
+    Get the iocid and short description of an IOC without parsing its criteria.
+
+    :param fn: File containing an IOC.
+    :return: A tuple of (iocid, short_description).  The short description is None if it is not present.
+    :raises: IOCParseError if the file could not be parsed.
+    """
+    record = read_ioc_metadata(fn)
+    return record.iocid, record.short_description
+
+
+class LazyIOCStore(MutableMapping):
+    """
+    Mapping of iocid -> IOC object, which materializes IOCs from IOCHandles on access.
+
+    Membership tests, len() and iteration over the keys never parse an IOC.
+
+    :param loader: Callable which accepts an IOCHandle and returns an IOC object.
+    :param max_resident: Maximum number of IOCs loaded from handles which are kept in memory.
+    :param max_resident_bytes: Maximum total size, in bytes of serialized IOC, of the IOCs loaded from handles which
+     are kept in memory.
+    """
+    def __init__(self, loader, max_resident=None, max_resident_bytes=None):
+        self.loader = loader
+        self.max_resident = max_resident
+        self.max_resident_bytes = max_resident_bytes
+        self.handles = {}  # iocid -> IOCHandle
+        self.pinned = {}  # iocid -> IOC object, for IOCs without a handle
+        self.resident = collections.OrderedDict()  # iocid -> IOC object, in least recently used order
+        self.resident_bytes = 0
+
+    def __len__(self):
+        return len(self.handles) + len(self.pinned)
+
+    def __iter__(self):
+        for iocid in self.handles:
+            yield iocid
+        for iocid in self.pinned:
+            if iocid not in self.handles:
+                yield iocid
+
+    def __contains__(self, iocid):
+        return iocid in self.handles or iocid in self.pinned
+
+    def __getitem__(self, iocid):
+        if iocid in self.pinned:
+            return self.pinned[iocid]
+        ioc_obj = self.resident.pop(iocid, None)
+        if ioc_obj is not None:
+            self.resident[iocid] = ioc_obj
+            return ioc_obj
+        handle = self.handles[iocid]
+        ioc_obj = self.loader(handle)
+        self._add_resident(handle, ioc_obj)
+        return ioc_obj
+
+    def __setitem__(self, iocid, ioc_obj):
+        """
+        Store an IOC object.  It is kept in memory until it is removed, or attach() is called for it.
+        """
+        self._drop_resident(iocid)
+        self.handles.pop(iocid, None)
+        self.pinned[iocid] = ioc_obj
+
+    def __delitem__(self, iocid):
+        if iocid not in self:
+            raise KeyError(iocid)
+        self._drop_resident(iocid)
+        self.handles.pop(iocid, None)
+        self.pinned.pop(iocid, None)
+
+    def pop(self, iocid, *args):
+        """
+        Remove an IOC without loading it.
+
+        :param iocid: iocid to remove.
+        :return: The IOC object if it is held in memory, otherwise its IOCHandle.  If the iocid is not present, the
+         default value is returned if one is given, otherwise KeyError is raised.
+        """
+        if iocid not in self:
+            if args:
+                return args[0]
+            raise KeyError(iocid)
+        value = self.pinned.pop(iocid, None)
+        if value is None:
+            value = self.resident.get(iocid)
+            self._drop_resident(iocid)
+            handle = self.handles.pop(iocid)
+            if value is None:
+                value = handle
+        else:
+            self.handles.pop(iocid, None)
+        return value
+
+    def add_handle(self, handle):
+        """
+        Register an IOC without loading it.  This replaces any IOC with the same iocid.
+
+        :param handle: IOCHandle object.
+        :return:
+        """
+        iocid = handle.iocid
+        self._drop_resident(iocid)
+        self.pinned.pop(iocid, None)
+        self.handles[iocid] = handle
+
+    def attach(self, handle, ioc_obj):
+        """
+        Register an IOC which has already been loaded from its handle.  The IOC object is kept as a resident IOC,
+        and may be dropped from memory like IOCs loaded on access.
+
+        :param handle: IOCHandle object.
+        :param ioc_obj: IOC object loaded from the handle.
+        :return:
+        """
+        self.add_handle(handle)
+        self._add_resident(handle, ioc_obj)
+
+    def is_resident(self, iocid):
+        """
+        :param iocid: iocid to check.
+        :return: True if the IOC is currently held in memory.
+        """
+        return iocid in self.pinned or iocid in self.resident
+
+    def _add_resident(self, handle, ioc_obj):
+        self.resident[handle.iocid] = ioc_obj
+        self.resident_bytes += handle.size
+        self._evict()
+
+    def _drop_resident(self, iocid):
+        if self.resident.pop(iocid, None) is not None:
+            self.resident_bytes -= self.handles[iocid].size
+
+    def _evict(self):
+        """
+        Drop least recently used IOCs until the residency budget is met.  The most recently used IOC is always kept.
+        """
+        while len(self.resident) > 1 and self._over_budget():
+            iocid, ioc_obj = self.resident.popitem(last=False)
+            self.resident_bytes -= self.handles[iocid].size
+
+    def _over_budget(self):
+        if self.max_resident is not None and len(self.resident) > self.max_resident:
+            return True
+        if self.max_resident_bytes is not None and self.resident_bytes > self.max_resident_bytes:
+            return True
+        return False
@@ -0,0 +1,174 @@
+"""
+scan.py from ioc_writer
+Created: 10/17/26
+
+Purpose: Read the metadata of IOC files without parsing their criteria or parameters.
+
+Each file is parsed incrementally, and parsing stops once the metadata has been read.  This is much cheaper than
+loading the full IOC when only the id, description, authorship or links are required, such as when building a
+catalog of a large set of IOCs.
+
+Usage example:
+::
+    for fn, record in scan_iocs(iter_ioc_files(iocs_dir), workers=4):
+        if isinstance(record, IOCParseError):
+            continue
+        print(record.iocid, record.short_description)
+
+"""
+# Stdlib
+from __future__ import print_function
+import collections
+import logging
+import multiprocessing
+# Third Party code
+from lxml import etree as et
+# Custom Code
+import ioc_writer.ioc_api as ioc_api
+
+log = logging.getLogger(__name__)
+
+__author__ = 'will.gibb'
+
+IOCMetadata = collections.namedtuple('IOCMetadata', ['path',
+                                                     'iocid',
+                                                     'version',
+                                                     'last_modified',
+                                                     'published_date',
+                                                     'short_description',
+                                                     'description',
+                                                     'keywords',
+                                                     'authored_by',
+                                                     'authored_date',
+                                                     'links'])
+IOCMetadata.__doc__ = """
+Metadata of a single IOC file.
+
+Text fields are None if the element is not present in the IOC.  The links are a tuple of (rel, href, text) tuples.
+The version is '1.1' for an OpenIOC root element and '1.0' for an ioc root element.
+"""
+
+METADATA_TEXT_TAGS = {'short_description',
+                      'description',
+                      'keywords',
+                      'authored_by',
+                      'authored_date'}
+# Elements which follow the metadata in OpenIOC 1.0 & 1.1 documents
+METADATA_END_TAGS = {'criteria',
+                     'parameters',
+                     'definition'}
+# Size of the reads made while scanning a file.  The metadata is usually within the first block of an IOC.
+SCAN_CHUNK_SIZE = 4096
+
+
+def _iter_events(fn):
+    """
+    Incrementally parse a file, yielding (event, element) tuples for start and end events.
+
+    The file is read in small chunks, so if the caller stops iterating, the rest of the file is never read.
+
+    :param fn: File to parse.
+    :return: A generator of (event, element) tuples.
+    """
+    parser = et.XMLPullParser(events=('start', 'end'), resolve_entities=False, no_network=True)
+    with open(fn, 'rb') as f:
+        while True:
+            data = f.read(SCAN_CHUNK_SIZE)
+            if not data:
+                break
+            parser.feed(data)
+            for event in parser.read_events():
+                yield event
+    parser.close()
+    for event in parser.read_events():
+        yield event
+
+
+def read_ioc_metadata(fn):
+    """
+    Read the metadata of an IOC without parsing its criteria or parameters.
+
+    :param fn: File containing an IOC.
+    :return: An IOCMetadata record.
+    :raises: IOCParseError if the file could not be parsed.
+    """
+    fields = {'path': fn}
+    links = []
+    depth = 0
+    try:
+        for event, elem in _iter_events(fn):
+            tag = elem.tag
+            if not isinstance(tag, str):
+                continue
+            tag = tag.rpartition('}')[2]
+            if event == 'start':
+                depth += 1
+                if depth == 1:
+                    fields['iocid'] = elem.get('id', 'NoID')
+                    fields['version'] = '1.1' if tag == 'OpenIOC' else '1.0'
+                    fields['last_modified'] = elem.get('last-modified')
+                    fields['published_date'] = elem.get('published-date')
+                elif depth == 2 and tag in METADATA_END_TAGS:
+                    break
+                continue
+            depth -= 1
+            if tag in METADATA_TEXT_TAGS:
+                fields[tag] = elem.text
+            elif tag == 'link':
+                links.append((elem.get('rel'), elem.get('href'), elem.text))
+            elif tag == 'metadata':
+                break
+            if depth > 0:
+                elem.clear()
+    except (IOError, OSError, et.XMLSyntaxError):
+        log.exception('unable to read IOC metadata [{}]'.format(fn))
+        raise ioc_api.IOCParseError('Error occured parsing XML')
+    if 'iocid' not in fields:
+        raise ioc_api.IOCParseError('No root element found [{}]'.format(fn))
+    for field in IOCMetadata._fields:
+        fields.setdefault(field, None)
+    fields['links'] = tuple(links)
+    return IOCMetadata(**fields)
+
+
+def _scan_ioc_file(fn):
+    """
+    Worker function for scan_iocs().
+
+    :param fn: File containing an IOC.
+    :return: A tuple of (filename, IOCMetadata or IOCParseError).
+    """
+    try:
+        return fn, read_ioc_metadata(fn)
+    except ioc_api.IOCParseError as e:
+        return fn, e
+
+
+def scan_iocs(fns, workers=None):
+    """
+    Read the metadata of a set of IOC files.
+
+    :param fns: Iterable of files containing IOCs.
+    :param workers: If set, the files are read by this many worker processes.  Results are still yielded in the
+     order of fns.
+    :return: A generator yielding (filename, IOCMetadata) tuples.  If a file could not be parsed, the IOCParseError
+     is yielded in place of the IOCMetadata.
+    """
+    if not workers or workers < 2:
+        for fn in fns:
+            yield _scan_ioc_file(fn)
+        return
+    fns = list(fns)
+    if not fns:
+        return
+    chunksize = max(1, len(fns) // (workers * 4))
+    pool = multiprocessing.Pool(processes=workers)
+    try:
+        for result in pool.imap(_scan_ioc_file, fns, chunksize):
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
@@ -22,10 +22,12 @@ import glob
 import logging
 import os
 # Third Party code
+from lxml import etree as et
 # Custom Code
 import ioc_writer.ioc_api as ioc_api
 import ioc_writer.utils as utils
 import ioc_writer.utils.xmlutils as xmlutils
+from ioc_writer.utils import xpaths
 
 
 log = logging.getLogger(__name__)
@@ -41,10 +43,17 @@ class UpgradeError(ioc_api.IOCParseError):
 
 # We cannot use the IOCManager base class here since that assumes we are working with OpenIOC 1.1 documents.
 class UpgradeManager(object):
-    def __init__(self):
+    """
+    Convert OpenIOC 1.0 documents into the OpenIOC 1.1 format.
+
+    :param parser_config: xmlutils.ParserConfig object used when parsing .ioc files.
+     Defaults to xmlutils.DEFAULT_PARSER_CONFIG.
+    """
+    def __init__(self, parser_config=None):
         self.iocs = {}
         self.iocs_11 = {}
         self.ioc_xml = {}
+        self.parser_config = parser_config
 
     def __len__(self):
         return len(self.iocs)
@@ -76,6 +85,29 @@ class UpgradeManager(object):
         log.info('Parsed [%s] IOCs' % str(len(self)))
         return errors
 
+    def insert_bundle(self, filename):
+        """
+        Parses a file containing many OpenIOC 1.0 documents wrapped in a single root element, and inserts each
+        document into the class.  The file is parsed incrementally.
+
+        :param filename: File containing ioc elements.
+        :return: A list of the documents which could not be parsed, as the filename followed by '#' and the position
+         of the document in the file.  If the file itself could not be parsed, the filename is returned.
+        """
+        errors = []
+        log.info('loading IOCs from bundle: {}'.format(filename))
+        try:
+            for i, ioc_xml in enumerate(xmlutils.iter_elements_no_ns(filename, ['ioc'], self.parser_config)):
+                if not self.add_tree(ioc_xml):
+                    name = '{}#{}'.format(filename, i)
+                    log.warning('Failed to parse [{}]'.format(name))
+                    errors.append(name)
+        except (IOError, OSError, et.XMLSyntaxError):
+            log.exception('unable to parse bundle [{}]'.format(filename))
+            errors.append(filename)
+        log.info('Parsed [%s] IOCs' % str(len(self)))
+        return errors
+
     def parse(self, fn):
         """
         Parses a file into a lxml.etree structure with namespaces remove.  This tree is added to self.iocs.
@@ -83,7 +115,15 @@ class UpgradeManager(object):
         :param fn: File to parse.
         :return:
         """
-        ioc_xml = xmlutils.read_xml_no_ns(fn)
+        return self.add_tree(xmlutils.read_xml_file_no_ns(fn, self.parser_config))
+
+    def add_tree(self, ioc_xml):
+        """
+        Adds a parsed OpenIOC 1.0 document, with namespaces removed, to self.iocs.
+
+        :param ioc_xml: lxml._elementTree object, or None if parsing failed.
+        :return: True if the document was added.
+        """
         if not ioc_xml:
             return False
         root = ioc_xml.getroot()
@@ -120,13 +160,13 @@ class UpgradeManager(object):
                 last_modified_date_10 = last_modified_date_10.rstrip('Z')
             created_date_10 = created_date_10.rstrip('Z')
             links_10 = []
-            for link in root.xpath('//link'):
+            for link in xpaths.LINKS(root):
                 link_rel = link.get('rel', None)
                 link_text = link.text
                 links_10.append((link_rel, link_text, None))
             # get ioc_logic
             try:
-                ioc_logic = root.xpath('.//definition')[0]
+                ioc_logic = xpaths.DEFINITION(root)[0]
             except IndexError:
                 log.exception(
                     'Could not find definition nodes for IOC [%s].  Did you attempt to convert OpenIOC 1.1 iocs?' % str(
@@ -176,11 +216,11 @@ class UpgradeManager(object):
                 if condition.endswith('not'):
                     negation = True
                     condition = condition[:-3]
-                document = node.xpath('Context/@document')[0]
-                search = node.xpath('Context/@search')[0]
-                content_type = node.xpath('Content/@type')[0]
+                document = xpaths.CONTEXT_DOCUMENT(node)[0]
+                search = xpaths.CONTEXT_SEARCH(node)[0]
+                content_type = xpaths.CONTENT_TYPE(node)[0]
                 content = node.findtext('Content')
-                context_type = node.xpath('Context/@type')[0]
+                context_type = xpaths.CONTEXT_TYPE(node)[0]
                 new_ii_node = ioc_api.make_indicatoritem_node(condition=condition,
                                                               document=document,
                                                               search=search,
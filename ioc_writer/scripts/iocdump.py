@@ -27,13 +27,17 @@ import sys
 # Third Party code
 # Custom Code
 from ..managers import IOCManager
+from ..managers.cache import ParseCache
 
 log = logging.getLogger(__name__)
 
 def main(options):
     if not options.verbose:
         logging.disable(logging.DEBUG)
-    iocm = IOCManager()
+    cache = None
+    if options.cache_dir:
+        cache = ParseCache(options.cache_dir)
+    iocm = IOCManager(cache=cache)
     for i in options.input:
         iocm.insert(i)
     for ioc_obj in iocm.iocs.values():
@@ -47,6 +51,8 @@ def makeargpaser():
                         help='Input files or folders')
     parser.add_argument('-n', '--no-params', dest='hide_params', default=False, action='store_true',
                         help='Do not display parameters attached to an IOC.')
+    parser.add_argument('-c', '--cache-dir', dest='cache_dir', default=None, type=str,
+                        help='Directory used to cache parsed IOCs between runs.')
     parser.add_argument('-v', '--verbose', dest='verbose', default=False, action='store_true',
                         help='Enable verbose output')
     return parser
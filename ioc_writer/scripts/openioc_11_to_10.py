@@ -22,6 +22,7 @@ import argparse
 import logging
 import os
 import sys
+from ..managers.cache import ParseCache
 from ..managers.downgrade_11 import DowngradeManager
 
 log = logging.getLogger(__name__)
@@ -37,7 +38,10 @@ def main(options):
     else:
         output_dir = os.path.join(options.output, 'unpruned')
     # read in and convert iocs
-    iocm = DowngradeManager()
+    cache = None
+    if options.cache_dir:
+        cache = ParseCache(options.cache_dir)
+    iocm = DowngradeManager(cache=cache)
     iocm.insert(options.iocs)
     errors = iocm.convert_to_10()
     if errors:
@@ -72,6 +76,8 @@ def makeargpaser():
                         help='Directory to iocs or the ioc to process.')
     parser.add_argument('-o', '--output', dest='output', required=True, type=str,
                         help='Dictory to write IOCs too. There will be three folders created in this directory.')
+    parser.add_argument('-c', '--cache-dir', dest='cache_dir', default=None, type=str,
+                        help='Directory used to cache parsed IOCs between runs.')
     return parser
 
 def _main():
@@ -20,40 +20,192 @@
 #
 
 
+import copy
 import os.path
 import logging
+import re
+import threading
 from lxml import etree as et
 
 log = logging.getLogger(__name__)
 
+# Matches the prolog (BOM, xml declaration, processing instructions, comments and whitespace) and the start tag
+# of the root element.  Quoted attribute values are matched as a whole, since they may contain a '>'.
+ROOT_START_TAG_REGEX = re.compile(br'''^(?:\xef\xbb\xbf)?(?:\s|<\?.*?\?>|<!--.*?-->)*(<[^\s/>!?]+(?:[^>"']|"[^"]*"|'[^']*')*>)''',
+                                  re.DOTALL)
+DEFAULT_NAMESPACE_REGEX = re.compile(br'''\sxmlns\s*=\s*(?:"([^"]*)"|'([^']*)')''')
+NAMESPACE_DECLARATION_REGEX = re.compile(br'xmlns')
 
-def read_xml(filename):
+_parser_cache = threading.local()
+
+
+class ParserConfig(object):
     """
-    Use et to read in a xml file, or string, into a Element object.
+    Options used to build the lxml XMLParser that documents are read with.
 
-    :param filename: File to parse.
-    :return: lxml._elementTree object or None
+    The defaults do not resolve entities, never access the network and refuse very deep or very large documents.
+    Instances compare equal when their options are equal, and may be shared between threads; the parsers built
+    from them are cached per thread by get_parser().
+
+    :param remove_blank_text: Discard whitespace-only text nodes between elements.
+    :param remove_comments: Discard comments.
+    :param resolve_entities: Replace entity references with their values.
+    :param no_network: Prevent network access when looking up external documents.
+    :param huge_tree: Disable libxml2 security restrictions on very deep trees and very long text content.
     """
-    parser = et.XMLParser(remove_blank_text=True)
-    isfile=False
+    def __init__(self,
+                 remove_blank_text=True,
+                 remove_comments=False,
+                 resolve_entities=False,
+                 no_network=True,
+                 huge_tree=False):
+        self.remove_blank_text = remove_blank_text
+        self.remove_comments = remove_comments
+        self.resolve_entities = resolve_entities
+        self.no_network = no_network
+        self.huge_tree = huge_tree
+
+    def _key(self):
+        return (self.remove_blank_text,
+                self.remove_comments,
+                self.resolve_entities,
+                self.no_network,
+                self.huge_tree)
+
+    def __eq__(self, other):
+        if not isinstance(other, ParserConfig):
+            return NotImplemented
+        return self._key() == other._key()
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        return hash(self._key())
+
+    def __repr__(self):
+        return 'ParserConfig(remove_blank_text={}, remove_comments={}, resolve_entities={}, no_network={}, ' \
+               'huge_tree={})'.format(*self._key())
+
+    def get_options(self):
+        """
+        :return: A dictionary of keyword arguments for lxml.etree.XMLParser or lxml.etree.iterparse.
+        """
+        return {'remove_blank_text': self.remove_blank_text,
+                'remove_comments': self.remove_comments,
+                'resolve_entities': self.resolve_entities,
+                'no_network': self.no_network,
+                'huge_tree': self.huge_tree}
+
+    def make_parser(self):
+        """
+        Build a new XMLParser from this configuration.
+
+        :return: lxml.etree.XMLParser
+        """
+        return et.XMLParser(**self.get_options())
+
+
+DEFAULT_PARSER_CONFIG = ParserConfig()
+
+
+def get_parser(config=None):
+    """
+    Get a XMLParser for the current thread.
+
+    lxml parsers may not be used by multiple threads at the same time, so a parser is built once per thread and
+    configuration, and then reused for every document read by that thread.
+
+    :param config: ParserConfig object.  Defaults to DEFAULT_PARSER_CONFIG.
+    :return: lxml.etree.XMLParser
+    """
+    if config is None:
+        config = DEFAULT_PARSER_CONFIG
     try:
-        isfile = os.path.exists(filename)
+        parsers = _parser_cache.parsers
+    except AttributeError:
+        parsers = _parser_cache.parsers = {}
+    parser = parsers.get(config)
+    if parser is None:
+        parser = parsers[config] = config.make_parser()
+    return parser
+
+
+def _is_file(filename):
+    """
+    Determine if the input to read_xml() is a path to a file, or a xml document.
+
+    :param filename: File path or xml data.
+    :return: True if filename exists on disk.
+    """
+    try:
+        return os.path.exists(filename)
     except ValueError as e:
         if 'path too long for Windows' in str(e):
-            pass
-        else:
-            raise
+            return False
+        raise
+
+
+def read_xml(filename, config=None):
+    """
+    Use et to read in a xml file, or string, into a Element object.
+
+    This has to check if filename exists on disk to decide how to treat it.  When the type of input is known,
+    read_xml_file() or read_xml_bytes() should be used instead.
+
+    :param filename: File to parse.
+    :param config: ParserConfig object controlling how the document is parsed.  Defaults to DEFAULT_PARSER_CONFIG.
+    :return: lxml._elementTree object or None
+    """
+    if _is_file(filename):
+        return read_xml_file(filename, config)
+    return read_xml_bytes(filename, config)
+
+
+def read_xml_file(f, config=None):
+    """
+    Use et to read in a xml file into a Element object.
+
+    :param f: Path to the file, or a file object opened in binary mode.
+    :param config: ParserConfig object controlling how the document is parsed.  Defaults to DEFAULT_PARSER_CONFIG.
+    :return: lxml._elementTree object or None
+    """
     try:
-        if isfile:
-            return et.parse(filename, parser)
-        else:
-            r = et.fromstring(filename, parser)
-            return r.getroottree()
+        return et.parse(f, get_parser(config))
     except IOError:
-        log.exception('unable to open file [[}]'.format(filename))
+        log.exception('unable to open file [{}]'.format(f))
     except et.XMLSyntaxError:
-        log.exception('unable to parse XML [{}]'.format(filename))
-        return None
+        log.exception('unable to parse XML [{}]'.format(f))
+    return None
+
+
+def read_xml_bytes(data, config=None, base_url=None):
+    """
+    Use et to read in a xml document held in memory into a Element object.
+
+    Buffer objects, such as a bytearray or memoryview, are parsed without being copied where lxml supports it.
+
+    :param data: bytes or a buffer object containing the xml document.  Unicode strings may be used if they do not
+     contain an encoding declaration.
+    :param config: ParserConfig object controlling how the document is parsed.  Defaults to DEFAULT_PARSER_CONFIG.
+    :param base_url: The url or filename the document was read from, if any.
+    :return: lxml._elementTree object or None
+    """
+    parser = get_parser(config)
+    try:
+        try:
+            r = et.fromstring(data, parser, base_url=base_url)
+        except (TypeError, ValueError):
+            if not isinstance(data, (bytearray, memoryview)):
+                raise
+            # Older versions of lxml can only parse bytes
+            r = et.fromstring(bytes(data), parser, base_url=base_url)
+        return r.getroottree()
+    except et.XMLSyntaxError:
+        log.exception('unable to parse XML [{}]'.format(base_url or 'data'))
     return None
 
 
@@ -111,15 +263,212 @@ def delete_namespace(parsed_xml):
     return parsed_xml
 
 
-def read_xml_no_ns(filename):
+def strip_root_namespace(data):
+    """
+    Removes the default namespace declaration from the root element of a serialized xml document, so the document
+    can be parsed without namespaces in a single pass.
+
+    This is only done when it produces the same element tags as delete_namespace() would; that is, when no other
+    namespace declarations appear after the root start tag and the root does not bind a prefix to the same
+    namespace.  Documents in encodings which are not ASCII compatible are left alone.
+
+    :param data: bytes or a buffer object containing a xml document.
+    :return: A tuple of (data, namespace).  If the namespace could not be removed, the original data and None
+     are returned.
+    """
+    if not isinstance(data, (bytes, bytearray, memoryview)):
+        return data, None
+    match = ROOT_START_TAG_REGEX.match(data)
+    if not match:
+        return data, None
+    start, end = match.span(1)
+    start_tag = bytes(match.group(1))
+    ns_match = DEFAULT_NAMESPACE_REGEX.search(start_tag)
+    if not ns_match:
+        return data, None
+    namespace = ns_match.group(1)
+    if namespace is None:
+        namespace = ns_match.group(2)
+    if not namespace or start_tag.count(namespace) != 1 or NAMESPACE_DECLARATION_REGEX.search(data, end):
+        return data, None
+    try:
+        namespace = namespace.decode('ascii')
+    except UnicodeDecodeError:
+        return data, None
+    data = b''.join([data[:start + ns_match.start()], data[start + ns_match.end():]])
+    return data, namespace
+
+
+def read_file_data(f):
+    """
+    Read the contents of a xml file, for use with read_xml_bytes() or read_xml_bytes_no_ns().
+
+    :param f: Path to the file, or a file object opened in binary mode.
+    :return: A tuple of (data, base_url).  data is None if the file could not be read.
+    """
+    if hasattr(f, 'read'):
+        return f.read(), getattr(f, 'name', None)
+    try:
+        with open(f, 'rb') as fin:
+            return fin.read(), f
+    except IOError:
+        log.exception('unable to open file [{}]'.format(f))
+        return None, f
+
+
+def read_data(filename):
+    """
+    Get the xml document referenced by the input to read_xml_no_ns(), which is either a path to a file or the document
+    itself.
+
+    :param filename: filename representing a xml file or a string of xml data
+    :return: A tuple of (data, base_url).  data is None if the file could not be read.
+    """
+    if _is_file(filename):
+        return read_file_data(filename)
+    return filename, None
+
+
+def read_xml_no_ns(filename, config=None):
     """
     read in the file or data, populating a lxml._elementTree object
     stripping out namespaces
 
+    This has to check if filename exists on disk to decide how to treat it.  When the type of input is known,
+    read_xml_file_no_ns() or read_xml_bytes_no_ns() should be used instead.
+
     :param filename: filename representing a xml file or a string of xml data
+    :param config: ParserConfig object controlling how the document is parsed.  Defaults to DEFAULT_PARSER_CONFIG.
+    :return: lxml._elementTree object or None
+    """
+    data, base_url = read_data(filename)
+    if data is None:
+        return None
+    return read_xml_bytes_no_ns(data, config, base_url)
+
+
+def read_xml_file_no_ns(f, config=None):
+    """
+    read in a xml file, populating a lxml._elementTree object
+    stripping out namespaces
+
+    :param f: Path to the file, or a file object opened in binary mode.
+    :param config: ParserConfig object controlling how the document is parsed.  Defaults to DEFAULT_PARSER_CONFIG.
     :return: lxml._elementTree object or None
     """
-    parsed_xml = read_xml(filename)
+    data, base_url = read_file_data(f)
+    if data is None:
+        return None
+    return read_xml_bytes_no_ns(data, config, base_url)
+
+
+def read_xml_bytes_no_ns(data, config=None, base_url=None):
+    """
+    read in a xml document held in memory, populating a lxml._elementTree object
+    stripping out namespaces
+
+    If possible, the default namespace is removed from the serialized document before it is parsed, which avoids a
+    second pass over the tree.  Buffer objects are only copied if the namespace is removed this way.  Otherwise the
+    namespace is removed from the parsed tree.  Either way, the removed namespace is kept as the xmlns attribute of
+    the root element, as in ioc_et.make_ioc_root(), so the document serializes with the same namespace as the
+    original.
+
+    :param data: bytes or a buffer object containing the xml document.  Unicode strings may be used if they do not
+     contain an encoding declaration.
+    :param config: ParserConfig object controlling how the document is parsed.  Defaults to DEFAULT_PARSER_CONFIG.
+    :param base_url: The url or filename the document was read from, if any.
+    :return: lxml._elementTree object or None
+    """
+    data, namespace = strip_root_namespace(data)
+    parsed_xml = read_xml_bytes(data, config, base_url)
     if parsed_xml is None:
         return None
-    return delete_namespace(parsed_xml)
+    if namespace is None:
+        root = parsed_xml.getroot()
+        if not root.tag.startswith('{'):
+            return parsed_xml
+        namespace = root.tag[1:root.tag.find('}')]
+        remove_namespace(parsed_xml, namespace)
+    set_namespace_attribute(parsed_xml, namespace)
+    return parsed_xml
+
+
+def set_namespace_attribute(parsed_xml, namespace):
+    """
+    Replace the declaration of a namespace which has been removed from a document with the xmlns attribute of the
+    root element.  Declarations of prefixed namespaces on the root element are kept.
+
+    :param parsed_xml: lxml._elementTree object.
+    :param namespace: The namespace removed from the document.
+    :return:
+    """
+    root = parsed_xml.getroot()
+    if root.nsmap.get(None) == namespace:
+        et.cleanup_namespaces(parsed_xml, keep_ns_prefixes=[prefix for prefix in root.nsmap if prefix])
+    root.set('xmlns', namespace)
+
+
+def _get_local_name(tag):
+    """
+    :param tag: Element tag, which may be qualified with a namespace.
+    :return: The tag without its namespace.
+    """
+    return tag.rpartition('}')[2]
+
+
+def detach_element_no_ns(elem):
+    """
+    Copy an element into a new document, and remove the namespace of the element from the copy.
+
+    As with read_xml_bytes_no_ns(), the removed namespace is kept as the xmlns attribute of the new root element.
+
+    :param elem: lxml element.
+    :return: lxml._elementTree object.
+    """
+    root = copy.deepcopy(elem)
+    root.tail = None
+    parsed_xml = et.ElementTree(root)
+    if root.tag.startswith('{'):
+        namespace = root.tag[1:root.tag.find('}')]
+        remove_namespace(parsed_xml, namespace)
+        set_namespace_attribute(parsed_xml, namespace)
+    return parsed_xml
+
+
+def iter_elements_no_ns(f, tags, config=None):
+    """
+    Incrementally parse a xml file which contains many documents, such as a bundle of IOCs wrapped in a single root
+    element, yielding each document as a separate tree with namespaces stripped out.
+
+    An element is yielded when its local name is in tags, unless it is inside another element which is yielded.
+    Elements are removed from the partially parsed document once they have been yielded, so memory use does not
+    grow with the size of the file.  If the root element itself matches, the whole document is yielded.
+
+    :param f: Path to the file, or a file object opened in binary mode.
+    :param tags: Collection of element names, without namespaces, to yield.
+    :param config: ParserConfig object controlling how the document is parsed.  Defaults to DEFAULT_PARSER_CONFIG.
+    :return: A generator of lxml._elementTree objects.
+    :raises: lxml.etree.XMLSyntaxError if the file is not well formed, or IOError if the file cannot be read.
+    """
+    if config is None:
+        config = DEFAULT_PARSER_CONFIG
+    tags = frozenset(tags)
+    depth = 0
+    match_depth = None
+    for event, elem in et.iterparse(f, events=('start', 'end'), **config.get_options()):
+        if event == 'start':
+            depth += 1
+            if match_depth is None and _get_local_name(elem.tag) in tags:
+                match_depth = depth
+            continue
+        depth -= 1
+        if match_depth != depth + 1:
+            continue
+        match_depth = None
+        parsed_xml = detach_element_no_ns(elem)
+        elem.clear()
+        parent = elem.getparent()
+        if parent is not None:
+            while elem.getprevious() is not None:
+                del parent[0]
+        yield parsed_xml
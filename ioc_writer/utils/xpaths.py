@@ -0,0 +1,36 @@
+# xpaths.py
+#
+# Licensed under the Apache 2.0 license.
+#
+# Precompiled XPath expressions used to query IOC documents with their namespaces removed.
+#
+# Compiling an XPath expression is more expensive than evaluating it against a small node, so the expressions used
+# in loops are compiled once here.  Values are passed in as XPath variables rather than formatted into the
+# expression, so they may contain quotes:
+#
+#     links = xpaths.LINKS_BY_REL(ioc_obj.metadata, rel='report')
+#     items = xpaths.ITEMS_BY_CONDITION(criteria_node, condition='matches')
+#
+from lxml import etree as et
+
+# Metadata
+SHORT_DESCRIPTION_TEXT = et.XPath('.//short_description/text()')
+LINKS = et.XPath('.//link')
+LINKS_BY_REL = et.XPath('.//link[@rel = $rel]')
+LINKS_BY_REL_AND_TEXT = et.XPath('.//link[@rel = $rel and text() = $text]')
+
+# Criteria
+CRITERIA = et.XPath('.//criteria')
+DEFINITION = et.XPath('.//definition')
+TOP_LEVEL_INDICATORS = et.XPath('criteria/Indicator')
+DESCENDANT_IDS = et.XPath('.//@id')
+ITEMS_BY_CONDITION = et.XPath('.//IndicatorItem[@condition = $condition]')
+ITEMS_BY_PRESERVE_CASE = et.XPath('.//IndicatorItem[@preserve-case = $preserve_case]')
+ITEMS_BY_SEARCH = et.XPath('.//IndicatorItem[Context/@search = $search]')
+CRITERIA_NODES_BY_ID = et.XPath('.//*[(self::Indicator or self::IndicatorItem) and @id = $nid]')
+
+# IndicatorItem attributes
+CONTEXT_DOCUMENT = et.XPath('Context/@document')
+CONTEXT_SEARCH = et.XPath('Context/@search')
+CONTEXT_TYPE = et.XPath('Context/@type')
+CONTENT_TYPE = et.XPath('Content/@type')
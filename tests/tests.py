@@ -11,16 +11,39 @@ Usage:
 """
 # Stdlib
 from __future__ import print_function
+import datetime
+import gzip
 import logging
 import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
 import unittest
+import uuid
+import zipfile
+try:
+    import asyncio
+    import concurrent.futures
+except ImportError:
+    # Python 2
+    asyncio = None
 # Third Party code
 from lxml import etree as et
 # Custom Code
 import ioc_writer.ioc_api as ioc_api
+import ioc_writer.ioc_compact as ioc_compact
 import ioc_writer.ioc_et as ioc_et
 import ioc_writer.managers as managers
+import ioc_writer.managers.archive as archive
+import ioc_writer.managers.cache as cache
 import ioc_writer.managers.downgrade_11 as downgrade_11
+import ioc_writer.managers.index as index
+import ioc_writer.managers.lazy as lazy
+import ioc_writer.managers.scan as scan
+import ioc_writer.managers.upgrade_10 as upgrade_10
+import ioc_writer.utils.xmlutils as xmlutils
 
 
 logging.basicConfig(level=logging.DEBUG,
@@ -256,6 +279,17 @@ class TestIOCApi(unittest.TestCase):
         self.assertEqual(ioc_obj.metadata.findtext('keywords'), self.keywords)
         self.assertEqual(len(ioc_obj.metadata.find('links').getchildren()), 2)
 
+    def test_update_links_with_quotes(self):
+        rel = 'it\'s a "rel"'
+        ioc_obj = ioc_api.IOC(links=[(rel, None, 'testValue'), ('testRel', None, 'testValue')])
+        self.assertTrue(ioc_obj.update_link_rel_based(rel, new_text='it\'s "text"'))
+        self.assertTrue(ioc_obj.update_link_rewrite(rel, 'it\'s "text"', 'newValue'))
+        links = ioc_obj.metadata.find('links').getchildren()
+        self.assertEqual([link.text for link in links], ['newValue', 'testValue'])
+        self.assertTrue(ioc_obj.remove_link(rel))
+        links = ioc_obj.metadata.find('links').getchildren()
+        self.assertEqual([link.get('rel') for link in links], ['testRel'])
+
     def test_ioc_class_creation_file(self):
         iocid = '378f0cce-b8df-41d5-8189-3d7ec102e52f'
         fn = '{}.ioc'.format(iocid)
@@ -264,6 +298,211 @@ class TestIOCApi(unittest.TestCase):
         self.assertEqual(ioc_obj.iocid, iocid)
         self.assertEqual(len(ioc_obj.top_level_indicator.getchildren()), 7)
 
+    def test_ioc_class_creation_from_bytes(self):
+        fn = '55075e99-273a-4b81-b92b-672be6666474.ioc'
+        with open(os.path.join(OPENIOC_11_ASSETS, fn), 'rb') as f:
+            data = f.read()
+        expected = str(ioc_api.IOC(data))
+        for buf in (data, bytearray(data), memoryview(data)):
+            ioc_obj = ioc_api.IOC.from_bytes(buf)
+            self.assertEqual(ioc_obj.iocid, '55075e99-273a-4b81-b92b-672be6666474')
+            self.assertEqual(str(ioc_obj), expected)
+        with self.assertRaises(ioc_api.IOCParseError):
+            ioc_api.IOC.from_bytes(b'<OpenIOC><criteria>')
+
+    def test_ioc_class_creation_from_file(self):
+        fp = os.path.join(OPENIOC_11_ASSETS, '55075e99-273a-4b81-b92b-672be6666474.ioc')
+        ioc_obj = ioc_api.IOC.from_file(fp)
+        self.assertEqual(ioc_obj.iocid, '55075e99-273a-4b81-b92b-672be6666474')
+        with open(fp, 'rb') as f:
+            self.assertEqual(str(ioc_api.IOC.from_file(f)), str(ioc_obj))
+        with self.assertRaises(ioc_api.IOCParseError):
+            ioc_api.IOC.from_file(os.path.join(OPENIOC_11_ASSETS, 'does_not_exist.ioc'))
+
+    def make_indicator_tree(self):
+        ioc_obj = ioc_api.IOC(name=self.name)
+        i_node = ioc_api.make_indicator_node(ioc_api.AND, nid='i-1')
+        i_node.append(ioc_api.make_indicatoritem_node(ioc_api.IS, self.context_document, self.context_search,
+                                                      'md5', self.content_text, nid='ii-1'))
+        i_node.append(ioc_api.make_indicatoritem_node(ioc_api.IS, self.context_document, self.context_search,
+                                                      'md5', self.content_text, nid='ii-2'))
+        ioc_obj.top_level_indicator.append(i_node)
+        for nid in ['i-1', 'ii-1', 'ii-2']:
+            ioc_obj.add_parameter(nid, 'comment for {}'.format(nid))
+        return ioc_obj
+
+    def test_get_node_by_id(self):
+        ioc_obj = self.make_indicator_tree()
+        self.assertEqual(ioc_obj.get_node_by_id('ii-2').get('id'), 'ii-2')
+        self.assertIs(ioc_obj.get_node_by_id(ioc_obj.top_level_indicator.get('id')), ioc_obj.top_level_indicator)
+        self.assertIsNone(ioc_obj.get_node_by_id('missing'))
+        # Nodes added or removed directly are found without rebuilding the index
+        node_index = ioc_obj._node_index
+        ioc_obj.top_level_indicator.append(ioc_api.make_indicator_node(ioc_api.OR, nid='i-2'))
+        self.assertEqual(ioc_obj.get_node_by_id('i-2').get('operator'), ioc_api.OR)
+        node = ioc_obj.get_node_by_id('ii-1')
+        node.getparent().remove(node)
+        self.assertIsNone(ioc_obj.get_node_by_id('ii-1'))
+        self.assertIsNone(ioc_obj.get_node_by_id('missing'))
+        self.assertIs(ioc_obj._node_index, node_index)
+        with self.assertRaises(ioc_api.IOCParseError):
+            ioc_obj.add_parameter('ii-1', 'foo')
+
+    def test_remove_indicator(self):
+        ioc_obj = self.make_indicator_tree()
+        self.assertTrue(ioc_obj.remove_indicator('ii-1'))
+        self.assertIsNone(ioc_obj.get_node_by_id('ii-1'))
+        self.assertFalse(ioc_obj.remove_indicator('ii-1'))
+        self.assertEqual(ioc_obj.parameters.xpath('param/@ref-id'), ['i-1', 'ii-2'])
+        self.assertTrue(ioc_obj.remove_indicator('i-1'))
+        self.assertEqual(ioc_obj.get_node_by_id('ii-2').getparent(), ioc_obj.top_level_indicator)
+        self.assertEqual(ioc_obj.parameters.xpath('param/@ref-id'), ['ii-2'])
+        with self.assertRaises(ioc_api.IOCParseError):
+            ioc_obj.remove_indicator(ioc_obj.top_level_indicator.get('id'))
+
+    def test_remove_indicator_uuid(self):
+        ioc_obj = self.make_indicator_tree()
+        parent_id = ioc_obj.top_level_indicator.get('id')
+        item_id, indicator_id = uuid.uuid4(), uuid.uuid4()
+        ioc_obj.add_item(parent_id, 'is', 'FileItem', 'FileItem/FileName', 'string', 'a.exe', nid=str(item_id))
+        ioc_obj.add_indicator(parent_id, 'OR', nid=str(indicator_id))
+        for nid in (item_id, indicator_id):
+            ioc_obj.add_parameter(str(nid), 'comment')
+            # The id is matched as a string, for the node and its params
+            self.assertTrue(ioc_obj.remove_indicator(nid))
+            self.assertIsNone(ioc_obj.get_node_by_id(str(nid)))
+            self.assertEqual(ioc_obj.get_params_by_ref_id(str(nid)), [])
+
+    def test_remove_indicator_prune(self):
+        ioc_obj = self.make_indicator_tree()
+        self.assertTrue(ioc_obj.remove_indicator('i-1', prune=True))
+        for nid in ['i-1', 'ii-1', 'ii-2']:
+            self.assertIsNone(ioc_obj.get_node_by_id(nid))
+        self.assertEqual(len(ioc_obj.parameters), 0)
+
+    def test_update_remove_parameter(self):
+        ioc_obj = self.make_indicator_tree()
+        param_id = ioc_obj.parameters[1].get('id')
+        self.assertEqual(ioc_obj.get_params_by_id(param_id), [ioc_obj.parameters[1]])
+        self.assertTrue(ioc_obj.update_parameter(param_id, content='updated', param_type='bool'))
+        self.assertEqual(ioc_obj.parameters[1].findtext('value'), 'updated')
+        self.assertEqual(ioc_obj.parameters[1].find('value').get('type'), 'bool')
+        self.assertEqual(ioc_obj.remove_parameter(param_id=param_id), 1)
+        self.assertEqual(ioc_obj.get_params_by_id(param_id), [])
+        with self.assertRaises(ioc_api.IOCParseError):
+            ioc_obj.update_parameter(param_id, content='updated')
+        # Parameters added directly are found once the index is rebuilt
+        param_node = ioc_et.make_param_node('ii-1', 'direct')
+        ioc_obj.parameters.append(param_node)
+        self.assertEqual(ioc_obj.get_params_by_id(param_node.get('id')), [param_node])
+
+    def test_get_params(self):
+        ioc_obj = self.make_indicator_tree()
+        ioc_obj.add_parameter('ii-1', 'true', name='some_value', ptype='bool')
+        self.assertEqual([param.findtext('value') for param in ioc_obj.get_params_by_ref_id('ii-1')],
+                         ['comment for ii-1', 'true'])
+        self.assertEqual(len(ioc_obj.get_params_by_name('comment')), 3)
+        self.assertEqual(ioc_obj.get_param_text('ii-1'),
+                         ['Parameter: comment, type:string, value: comment for ii-1',
+                          'Parameter: some_value, type:bool, value: true'])
+        self.assertEqual(ioc_obj.remove_parameter(name='comment'), 3)
+        self.assertEqual(ioc_obj.get_params_by_name('comment'), [])
+        self.assertEqual(len(ioc_obj.get_params_by_ref_id('ii-1')), 1)
+        param_id = ioc_obj.get_params_by_name('some_value')[0].get('id')
+        ioc_obj.update_parameter(param_id, name='renamed')
+        self.assertEqual(ioc_obj.get_params_by_name('some_value'), [])
+        self.assertEqual(len(ioc_obj.get_params_by_name('renamed')), 1)
+        # Renaming a param moves it within the index, in document order, instead of dropping the index
+        param_index = ioc_obj._param_index
+        ioc_obj.add_parameter('ii-1', 'later', name='other')
+        first = ioc_obj.get_params_by_name('other')[0]
+        ioc_obj.update_parameter(first.get('id'), name='renamed')
+        self.assertIs(ioc_obj._param_index, param_index)
+        self.assertEqual([param.findtext('value') for param in param_index['name']['renamed']], ['true', 'later'])
+        ioc_obj.update_parameter(param_id, name='other')
+        self.assertEqual([param.findtext('value') for param in ioc_obj.get_params_by_name('renamed')], ['later'])
+        ioc_obj.update_parameter(param_id, name='renamed')
+        self.assertEqual([param.findtext('value') for param in ioc_obj.get_params_by_name('renamed')],
+                         ['true', 'later'])
+        # Parameters changed directly are found once the index is rebuilt
+        ioc_obj.parameters.append(ioc_et.make_param_node('ii-1', 'direct', name='renamed'))
+        self.assertEqual(len(ioc_obj.get_params_by_name('renamed')), 3)
+        ioc_obj.parameters.remove(ioc_obj.parameters[0])
+        self.assertEqual([param.findtext('value') for param in ioc_obj.get_params_by_ref_id('ii-1')],
+                         ['later', 'direct'])
+
+    def test_batch(self):
+        ioc_obj = self.make_indicator_tree()
+        ioc_obj.root.set('last-modified', '2000-01-01T00:00:00')
+        with ioc_obj.batch() as batch:
+            i_node = batch.add(ioc_api.make_indicator_node(ioc_api.OR, nid='i-2'))
+            for i in range(3):
+                batch.add(ioc_api.make_indicatoritem_node(ioc_api.IS, self.context_document, self.context_search,
+                                                          'md5', str(i), nid='tl-{}'.format(i)))
+                batch.add(ioc_api.make_indicatoritem_node(ioc_api.IS, self.context_document, self.context_search,
+                                                          'md5', str(i), nid='i-2-{}'.format(i)), parent_id='i-2')
+            self.assertIs(ioc_obj.batch(), batch)
+            batch.remove('i-1')
+            self.assertEqual(ioc_obj.root.get('last-modified'), '2000-01-01T00:00:00')
+            with self.assertRaises(ioc_api.IOCParseError):
+                batch.add(ioc_api.make_indicator_node(ioc_api.OR), parent_id='tl-0')
+        self.assertIsNone(ioc_obj._batch)
+        self.assertNotEqual(ioc_obj.root.get('last-modified'), '2000-01-01T00:00:00')
+        self.assertEqual([node.get('id') for node in ioc_obj.top_level_indicator],
+                         ['tl-0', 'tl-1', 'tl-2', 'ii-1', 'ii-2', 'i-2'])
+        self.assertEqual(len(i_node), 3)
+        schema = et.XMLSchema(et.parse(OPENIOC_11_SCHEMA))
+        schema.assertValid(et.fromstring(ioc_obj.write_ioc_to_string()))
+
+    def test_batch_exception(self):
+        ioc_obj = self.make_indicator_tree()
+        ioc_obj.root.set('last-modified', '2000-01-01T00:00:00')
+        with self.assertRaises(ValueError):
+            with ioc_obj.batch() as batch:
+                batch.add(ioc_api.make_indicatoritem_node(ioc_api.IS, self.context_document, self.context_search,
+                                                          'md5', self.content_text, nid='ii-3'))
+                raise ValueError('abort')
+        self.assertEqual(ioc_obj.root.get('last-modified'), '2000-01-01T00:00:00')
+        self.assertEqual([node.tag for node in ioc_obj.top_level_indicator], ['IndicatorItem', 'Indicator'])
+
+    def test_add_item_indicator(self):
+        ioc_obj = self.make_indicator_tree()
+        tl_id = ioc_obj.top_level_indicator.get('id')
+        i_node = ioc_obj.add_indicator(None, ioc_api.OR, nid='i-2')
+        ii_node = ioc_obj.add_item(None, ioc_api.IS, self.context_document, self.context_search, 'md5',
+                                   self.content_text, nid='ii-3')
+        ioc_obj.add_item('i-2', ioc_api.IS, self.context_document, self.context_search, 'md5', self.content_text,
+                         nid='ii-4')
+        ioc_obj.add_indicator('i-2', ioc_api.AND, nid='i-3')
+        ioc_obj.add_item('i-2', ioc_api.IS, self.context_document, self.context_search, 'md5', self.content_text,
+                         nid='ii-5')
+        self.assertEqual([node.get('id') for node in ioc_obj.top_level_indicator], ['ii-3', 'i-1', 'i-2'])
+        self.assertEqual([node.get('id') for node in i_node], ['ii-4', 'ii-5', 'i-3'])
+        self.assertIs(ioc_obj.get_node_by_id('ii-3'), ii_node)
+        self.assertTrue(ioc_api.is_schema_ordered(ioc_obj.top_level_indicator))
+        self.assertEqual(ioc_obj.add_parameter('ii-5', 'foo'), True)
+        with self.assertRaises(ioc_api.IOCParseError):
+            ioc_obj.add_item('ii-3', ioc_api.IS, self.context_document, self.context_search, 'md5', 'foo')
+        with self.assertRaises(ioc_api.IOCParseError):
+            ioc_obj.add_indicator('missing', ioc_api.OR)
+        self.assertEqual(ioc_obj.top_level_indicator.get('id'), tl_id)
+
+    def test_remove_indicator_keeps_order(self):
+        ioc_obj = self.make_indicator_tree()
+        ioc_obj.add_indicator(None, ioc_api.OR, nid='i-2')
+        self.assertTrue(ioc_obj.remove_indicator('i-1'))
+        self.assertEqual([node.get('id') for node in ioc_obj.top_level_indicator], ['ii-1', 'ii-2', 'i-2'])
+
+    def test_is_schema_ordered(self):
+        ioc_obj = self.make_indicator_tree()
+        self.assertTrue(ioc_api.is_schema_ordered(ioc_obj.top_level_indicator))
+        i_node = ioc_obj.get_node_by_id('i-1')
+        i_node.insert(0, ioc_api.make_indicator_node(ioc_api.OR, nid='i-2'))
+        self.assertFalse(ioc_api.is_schema_ordered(ioc_obj.top_level_indicator))
+        ioc_api.fix_schema_node_ordering(ioc_obj.top_level_indicator)
+        self.assertTrue(ioc_api.is_schema_ordered(ioc_obj.top_level_indicator))
+        self.assertEqual([node.get('id') for node in i_node], ['ii-1', 'ii-2', 'i-2'])
+
     def test_schema_validation_from_file(self):
         iocid = '378f0cce-b8df-41d5-8189-3d7ec102e52f'
         schema = et.XMLSchema(et.parse(OPENIOC_11_SCHEMA))
@@ -630,6 +869,157 @@ XXXXFileItem/FilePath starts-with "windows"
             self.assertEqual(_e, _s)
 
 
+class TestCompact(unittest.TestCase):
+    def setUp(self):
+        fp = os.path.join(OPENIOC_11_ASSETS, '378f0cce-b8df-41d5-8189-3d7ec102e52f.ioc')
+        self.ioc_obj = ioc_api.IOC.from_file(fp)
+
+    def test_to_compact(self):
+        tree = self.ioc_obj.to_compact()
+        self.assertIsInstance(tree, ioc_compact.CompactIndicator)
+        self.assertEqual(tree.nid, self.ioc_obj.top_level_indicator.get('id'))
+        self.assertEqual(tree.operator, 'OR')
+        items = list(tree.iter_items())
+        nodes = list(self.ioc_obj.top_level_indicator.iter('IndicatorItem'))
+        self.assertEqual([item.nid for item in items], [node.get('id') for node in nodes])
+        for item, node in zip(items, nodes):
+            self.assertEqual(item.condition, node.get('condition'))
+            self.assertEqual(item.search, node.find('Context').get('search'))
+            self.assertEqual(item.content, node.findtext('Content'))
+            self.assertEqual(item.negate, node.get('negate') == 'true')
+        indicators = list(tree.iter_indicators())
+        self.assertEqual([i.nid for i in indicators],
+                         [node.get('id') for node in self.ioc_obj.top_level_indicator.iter('Indicator')])
+        params = [param for cnode in indicators + items for param in cnode.params]
+        self.assertEqual(len(params), len(self.ioc_obj.parameters))
+        self.assertEqual(params[0].name, 'comment')
+        with self.assertRaises(AttributeError):
+            items[0].content = 'foo'
+        with self.assertRaises(AttributeError):
+            items[0].__dict__
+
+    def test_from_compact(self):
+        # A param may not have a value
+        param_node = ioc_et.make_param_node(self.ioc_obj.top_level_indicator[0].get('id'), None, name='empty')
+        param_node.remove(param_node.find('value'))
+        self.ioc_obj.parameters.append(param_node)
+        tree = self.ioc_obj.to_compact()
+        self.assertIn(ioc_compact.CompactParam(param_node.get('id'), 'empty', None, None),
+                      tree.children[0].params)
+        ioc_obj = ioc_api.IOC.from_compact(tree, name='Compact', iocid=self.ioc_obj.iocid)
+        self.assertEqual(ioc_obj.to_compact(), tree)
+        self.assertEqual(ioc_obj.metadata.findtext('short_description'), 'Compact')
+        self.assertEqual(ioc_obj.criteria_text(params=True), self.ioc_obj.criteria_text(params=True))
+        self.assertEqual(ioc_obj.get_node_by_id(tree.children[0].nid).get('id'), tree.children[0].nid)
+
+    def test_term_table(self):
+        terms = ioc_compact.TermTable()
+        a = ''.join(['File', 'Item'])
+        b = ''.join(['FileI', 'tem'])
+        self.assertIsNot(a, b)
+        self.assertIs(terms.intern(a), a)
+        self.assertIs(terms.intern(b), a)
+        self.assertIsNone(terms.intern(None))
+        self.assertEqual(terms.code('FileItem'), 0)
+        self.assertEqual(terms.code('FileItem/Md5sum'), 1)
+        self.assertEqual(terms.get_code('FileItem/Md5sum'), 1)
+        self.assertIsNone(terms.get_code('ProcessItem'))
+        self.assertNotIn('ProcessItem', terms)
+        self.assertEqual(terms.term(1), 'FileItem/Md5sum')
+        self.assertEqual(len(terms), 2)
+
+    def test_to_compact_interns_terms(self):
+        terms = ioc_compact.TermTable()
+        first = list(self.ioc_obj.to_compact(terms).iter_items())
+        second = list(self.ioc_obj.to_compact(terms).iter_items())
+        for a, b in zip(first, second):
+            self.assertIs(a.document, b.document)
+            self.assertIs(a.search, b.search)
+            self.assertIs(a.content_type, b.content_type)
+            self.assertIn(a.search, terms)
+            self.assertNotIn(a.content, terms)
+
+
+class TestXmlUtils(unittest.TestCase):
+    def setUp(self):
+        self.namespace = 'http://openioc.org/schemas/OpenIOC_1.1'
+        self.fps = [os.path.join(OPENIOC_11_ASSETS, fn) for fn in sorted(os.listdir(OPENIOC_11_ASSETS))]
+
+    def test_read_xml_no_ns_single_pass(self):
+        for fp in self.fps:
+            two_pass = xmlutils.delete_namespace(xmlutils.read_xml(fp))
+            single_pass = xmlutils.read_xml_no_ns(fp)
+            self.assertEqual([elem.tag for elem in single_pass.iter()], [elem.tag for elem in two_pass.iter()])
+            self.assertEqual(single_pass.getroot().get('xmlns'), self.namespace)
+            # The namespace is restored when the document is serialized
+            root = et.fromstring(et.tostring(single_pass))
+            self.assertEqual(root.tag, '{{{}}}OpenIOC'.format(self.namespace))
+            # Documents which are not ASCII compatible, or are not bytes, get the same tree
+            with open(fp, 'rb') as f:
+                data = f.read()
+            for other in (et.tostring(single_pass, encoding='utf-16'), data.decode('utf-8')):
+                other_pass = xmlutils.read_xml_bytes_no_ns(other)
+                self.assertEqual(other_pass.getroot().nsmap, single_pass.getroot().nsmap)
+                self.assertEqual(et.tostring(other_pass), et.tostring(single_pass))
+
+    def test_strip_root_namespace(self):
+        with open(self.fps[0], 'rb') as f:
+            data = f.read()
+        stripped, namespace = xmlutils.strip_root_namespace(data)
+        self.assertEqual(namespace, self.namespace)
+        self.assertNotIn(b'xmlns=', stripped)
+        self.assertEqual(len(stripped), len(data) - len(' xmlns=""') - len(self.namespace))
+
+    def test_strip_root_namespace_fallback(self):
+        data = b'<!-- <a xmlns="urn:comment"> --><a xmlns="urn:a"><b xmlns="urn:a"><c/></b></a>'
+        self.assertEqual(xmlutils.strip_root_namespace(data), (data, None))
+        parsed_xml = xmlutils.read_xml_no_ns(data)
+        self.assertEqual([elem.tag for elem in parsed_xml.getroot().iter()], ['a', 'b', 'c'])
+        # The namespace is kept the same way as when it is removed before parsing
+        self.assertEqual(parsed_xml.getroot().get('xmlns'), 'urn:a')
+        self.assertNotIn(None, parsed_xml.getroot().nsmap)
+        self.assertEqual(et.tostring(parsed_xml.getroot()), b'<a xmlns="urn:a"><b><c/></b></a>')
+        data = b'<a xmlns="urn:a" note="x > y"><b/></a>'
+        stripped, namespace = xmlutils.strip_root_namespace(data)
+        self.assertEqual((stripped, namespace), (b'<a note="x > y"><b/></a>', 'urn:a'))
+
+
+class TestParserConfig(unittest.TestCase):
+    def test_get_parser_cached(self):
+        parser = xmlutils.get_parser()
+        self.assertIs(xmlutils.get_parser(), parser)
+        self.assertIs(xmlutils.get_parser(xmlutils.ParserConfig()), parser)
+        self.assertIsNot(xmlutils.get_parser(xmlutils.ParserConfig(huge_tree=True)), parser)
+        thread_parsers = []
+        t = threading.Thread(target=lambda: thread_parsers.append(xmlutils.get_parser()))
+        t.start()
+        t.join()
+        self.assertIsNot(thread_parsers[0], parser)
+
+    def test_remove_comments(self):
+        data = b'<!-- comment --><OpenIOC xmlns="urn:test"><!-- comment --><criteria/></OpenIOC>'
+        root = xmlutils.read_xml_no_ns(data).getroot()
+        self.assertEqual(len(root), 2)
+        self.assertIsNotNone(root.getprevious())
+        root = xmlutils.read_xml_no_ns(data, xmlutils.ParserConfig(remove_comments=True)).getroot()
+        self.assertEqual(len(root), 1)
+        self.assertIsNone(root.getprevious())
+
+    def test_entities_not_resolved(self):
+        data = b'<!DOCTYPE OpenIOC [<!ENTITY e "expanded">]><OpenIOC><metadata>&e;</metadata></OpenIOC>'
+        root = xmlutils.read_xml_no_ns(data).getroot()
+        self.assertNotEqual(root.findtext('metadata'), 'expanded')
+        root = xmlutils.read_xml_no_ns(data, xmlutils.ParserConfig(resolve_entities=True)).getroot()
+        self.assertEqual(root.findtext('metadata'), 'expanded')
+
+    def test_iocm_parser_config(self):
+        config = xmlutils.ParserConfig(remove_comments=True)
+        iocm = managers.IOCManager(parser_config=config)
+        iocm.insert(OPENIOC_11_ASSETS)
+        self.assertEqual(len(iocm), 4)
+        self.assertIs(iocm.parser_config, config)
+
+
 class IOCTestManager(managers.IOCManager):
     """
     Test class for testing the parser callback functionality.
@@ -666,11 +1056,885 @@ class TestIOCManager(unittest.TestCase):
         self.test_iocm.insert(OPENIOC_11_ASSETS)
         self.assertDictEqual(self.test_iocm.child_count, expected_dict)
 
+    def test_iocm_workers(self):
+        self.iocm.insert(OPENIOC_11_ASSETS)
+        parallel_iocm = managers.IOCManager()
+        errors = parallel_iocm.insert(OPENIOC_11_ASSETS, workers=2)
+        self.assertEqual(errors, [])
+        self.assertEqual(set(parallel_iocm.iocs.keys()), set(self.iocm.iocs.keys()))
+        self.assertDictEqual(parallel_iocm.ioc_name, self.iocm.ioc_name)
+        for iocid, ioc_obj in parallel_iocm.iocs.items():
+            self.assertEqual(str(ioc_obj), str(self.iocm.iocs[iocid]))
+            self.assertEqual(ioc_obj.root.get('xmlns'), 'http://openioc.org/schemas/OpenIOC_1.1')
+
+    def test_custom_iocm_workers(self):
+        expected_dict = {'378f0cce-b8df-41d5-8189-3d7ec102e52f': 7,
+                         '55075e99-273a-4b81-b92b-672be6666474': 1,
+                         'c158ef8c-e664-43c5-b71d-3488a3325fcb': 2,
+                         'd7ec102e-b8df-41d5-8189-352f378f0cce': 1}
+        self.test_iocm.insert(OPENIOC_11_ASSETS, workers=2)
+        self.assertDictEqual(self.test_iocm.child_count, expected_dict)
+
+    def test_iter_insert(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            nested_dir = os.path.join(tmp_dir, 'nested', 'deeper')
+            os.makedirs(nested_dir)
+            fns = sorted(os.listdir(OPENIOC_11_ASSETS))
+            shutil.copy(os.path.join(OPENIOC_11_ASSETS, fns[0]), tmp_dir)
+            for fn in fns[1:]:
+                shutil.copy(os.path.join(OPENIOC_11_ASSETS, fn), nested_dir)
+            bad_fn = os.path.join(tmp_dir, 'nested', 'bad.ioc')
+            with open(bad_fn, 'w') as f:
+                f.write('<OpenIOC><criteria>')
+            results = dict(self.iocm.iter_insert(tmp_dir, store=False))
+            self.assertEqual(len(results), 5)
+            self.assertIsInstance(results.pop(bad_fn), ioc_api.IOCParseError)
+            self.assertEqual({ioc_obj.iocid + '.ioc' for ioc_obj in results.values()}, set(fns))
+            self.assertEqual(len(self.iocm), 0)
+            self.assertEqual(len(list(self.iocm.iter_insert(tmp_dir, recursive=False))), 1)
+            self.assertEqual(len(self.iocm), 1)
+            self.assertEqual(self.iocm.insert(os.path.join(tmp_dir, 'nested')), [bad_fn])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_refresh(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            ioc_dir = os.path.join(tmp_dir, 'iocs')
+            shutil.copytree(OPENIOC_11_ASSETS, ioc_dir)
+            self.iocm.insert(ioc_dir)
+            self.assertEqual(self.iocm.refresh(), {'added': [], 'modified': [], 'removed': [], 'errors': []})
+            # modify an IOC
+            modified_fp = os.path.join(ioc_dir, 'c158ef8c-e664-43c5-b71d-3488a3325fcb.ioc')
+            ioc_obj = ioc_api.IOC.from_file(modified_fp)
+            ioc_obj.update_name('Modified name')
+            ioc_obj.write_ioc_to_file(ioc_dir)
+            # add an IOC
+            new_ioc = ioc_api.IOC(name='New IOC')
+            new_ioc.write_ioc_to_file(ioc_dir)
+            # remove an IOC
+            os.remove(os.path.join(ioc_dir, '55075e99-273a-4b81-b92b-672be6666474.ioc'))
+            records = []
+            handler = logging.Handler()
+            handler.emit = records.append
+            logging.getLogger('ioc_writer.managers').addHandler(handler)
+            try:
+                report = self.iocm.refresh()
+                # Reloading a modified file is not reported as a duplicate IOC, but loading another file is
+                self.assertEqual([record for record in records if 'duplicate' in record.getMessage()], [])
+                duplicate_fp = os.path.join(tmp_dir, 'duplicate.ioc')
+                shutil.copy(modified_fp, duplicate_fp)
+                iocm = managers.IOCManager()
+                iocm.insert(modified_fp)
+                iocm.insert(duplicate_fp)
+                self.assertEqual(len([record for record in records if 'duplicate' in record.getMessage()]), 1)
+            finally:
+                logging.getLogger('ioc_writer.managers').removeHandler(handler)
+            self.assertEqual(report, {'added': [new_ioc.iocid],
+                                      'modified': ['c158ef8c-e664-43c5-b71d-3488a3325fcb'],
+                                      'removed': ['55075e99-273a-4b81-b92b-672be6666474'],
+                                      'errors': []})
+            self.assertEqual(len(self.iocm), 4)
+            self.assertEqual(self.iocm.ioc_name[new_ioc.iocid], 'New IOC')
+            self.assertEqual(self.iocm.ioc_name['c158ef8c-e664-43c5-b71d-3488a3325fcb'], 'Modified name')
+            self.assertNotIn('55075e99-273a-4b81-b92b-672be6666474', self.iocm.ioc_name)
+            self.assertEqual(set(self.iocm.ioc_name), set(self.iocm.iocs))
+        finally:
+            shutil.rmtree(tmp_dir)
+
     def test_custom_iocm_fail(self):
         with self.assertRaises(TypeError):
             self.test_iocm.register_parser_callback('1234')
 
 
+class TestParseCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.ioc_dir = os.path.join(self.tmp_dir, 'iocs')
+        shutil.copytree(OPENIOC_11_ASSETS, self.ioc_dir)
+        self.cache = cache.ParseCache(os.path.join(self.tmp_dir, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_cache_roundtrip(self):
+        iocm = managers.IOCManager(cache=self.cache)
+        self.assertEqual(iocm.insert(self.ioc_dir), [])
+        self.assertEqual(len(os.listdir(self.cache.directory)), 4)
+        for fn in os.listdir(self.ioc_dir):
+            fp = os.path.join(self.ioc_dir, fn)
+            header, data = self.cache.get(fp)
+            self.assertEqual(header['summary']['iocid'] + '.ioc', fn)
+            self.assertNotIn(b'xmlns="', data)
+            cached_ioc = self.cache.load(fp)
+            ioc_obj = ioc_api.IOC.from_file(fp)
+            self.assertEqual(str(cached_ioc), str(ioc_obj))
+            self.assertEqual(cached_ioc.write_ioc_to_string(), ioc_obj.write_ioc_to_string())
+            self.assertIsNone(cached_ioc.source)
+        warm_iocm = managers.IOCManager(cache=self.cache)
+        self.assertEqual(warm_iocm.insert(self.ioc_dir), [])
+        self.assertDictEqual(warm_iocm.ioc_name, iocm.ioc_name)
+
+    def test_cache_warm_start(self):
+        iocm = managers.IOCManager(cache=self.cache)
+        iocm.insert(self.ioc_dir)
+        warm_iocm = managers.IOCManager(cache=self.cache)
+        self.assertEqual(warm_iocm.insert(self.ioc_dir), [])
+        self.assertDictEqual(warm_iocm.ioc_name, iocm.ioc_name)
+        self.assertFalse(any(warm_iocm.iocs.is_resident(iocid) for iocid in warm_iocm.iocs))
+        for iocid in iocm.iocs:
+            self.assertEqual(str(warm_iocm.iocs[iocid]), str(iocm.iocs[iocid]))
+            self.assertTrue(warm_iocm.iocs.is_resident(iocid))
+
+    def test_cache_parser_config(self):
+        fp = os.path.join(self.ioc_dir, '55075e99-273a-4b81-b92b-672be6666474.ioc')
+        parser_config = xmlutils.ParserConfig(remove_comments=True)
+        self.assertNotEqual(self.cache.get_entry_path(fp), self.cache.get_entry_path(fp, parser_config))
+        self.assertEqual(self.cache.get_entry_path(fp), self.cache.get_entry_path(fp, xmlutils.ParserConfig()))
+        managers.IOCManager(cache=self.cache).insert(fp)
+        self.assertIsNotNone(self.cache.get(fp))
+        self.assertIsNone(self.cache.get(fp, parser_config=parser_config))
+        managers.IOCManager(cache=self.cache, parser_config=parser_config).insert(fp)
+        self.assertIsNotNone(self.cache.get(fp, parser_config=parser_config))
+        self.assertEqual(len(os.listdir(self.cache.directory)), 2)
+
+    def test_cache_invalidation(self):
+        fp = os.path.join(self.ioc_dir, '55075e99-273a-4b81-b92b-672be6666474.ioc')
+        iocm = managers.IOCManager(cache=self.cache)
+        iocm.insert(fp)
+        self.assertIsNotNone(self.cache.get(fp))
+        ioc_obj = ioc_api.IOC.from_file(fp)
+        ioc_obj.update_name('Changed')
+        with open(fp, 'wb') as f:
+            f.write(ioc_obj.write_ioc_to_string())
+        self.assertIsNone(self.cache.get(fp))
+        iocm = managers.IOCManager(cache=self.cache)
+        iocm.insert(fp)
+        self.assertEqual(iocm.ioc_name[ioc_obj.iocid], 'Changed')
+        self.assertEqual(self.cache.get(fp)[0]['summary']['short_description'], 'Changed')
+
+    def test_cache_workers(self):
+        iocm = managers.IOCManager(cache=self.cache)
+        self.assertEqual(iocm.insert(self.ioc_dir, workers=2), [])
+        self.assertEqual(len(os.listdir(self.cache.directory)), 4)
+        # The workers write the cache entries, and the IOCs are built from them when they are accessed
+        self.assertFalse(any(iocm.iocs.is_resident(iocid) for iocid in iocm.iocs))
+        serial_iocm = managers.IOCManager()
+        serial_iocm.insert(self.ioc_dir)
+        for iocid, ioc_obj in serial_iocm.iocs.items():
+            self.assertEqual(str(iocm.iocs[iocid]), str(ioc_obj))
+        warm_iocm = managers.IOCManager(cache=self.cache)
+        self.assertEqual(warm_iocm.insert(self.ioc_dir, workers=2), [])
+        self.assertDictEqual(warm_iocm.ioc_name, iocm.ioc_name)
+        bad_fn = os.path.join(self.ioc_dir, 'bad.ioc')
+        with open(bad_fn, 'w') as f:
+            f.write('<OpenIOC><criteria>')
+        self.assertEqual(managers.IOCManager(cache=self.cache).insert(self.ioc_dir, workers=2), [bad_fn])
+
+
+class TestLazyIOCManager(unittest.TestCase):
+    def test_lazy_insert(self):
+        iocm = managers.IOCManager()
+        iocm.insert(OPENIOC_11_ASSETS)
+        lazy_iocm = managers.IOCManager(lazy=True, max_resident=2)
+        self.assertEqual(lazy_iocm.insert(OPENIOC_11_ASSETS), [])
+        self.assertEqual(len(lazy_iocm), 4)
+        self.assertEqual(set(lazy_iocm.iocs), set(iocm.iocs))
+        self.assertDictEqual(lazy_iocm.ioc_name, iocm.ioc_name)
+        self.assertFalse(any(lazy_iocm.iocs.is_resident(iocid) for iocid in lazy_iocm.iocs))
+        iocids = sorted(lazy_iocm.iocs)
+        for iocid in iocids:
+            self.assertEqual(str(lazy_iocm.iocs[iocid]), str(iocm.iocs[iocid]))
+        self.assertEqual([lazy_iocm.iocs.is_resident(iocid) for iocid in iocids], [False, False, True, True])
+        # Accessing an IOC makes it the most recently used
+        lazy_iocm.iocs[iocids[2]]
+        lazy_iocm.iocs[iocids[0]]
+        self.assertEqual([lazy_iocm.iocs.is_resident(iocid) for iocid in iocids], [True, False, True, False])
+        self.assertIsInstance(lazy_iocm.remove(iocids[1]), lazy.IOCHandle)
+        self.assertIsInstance(lazy_iocm.remove(iocids[0]), ioc_api.IOC)
+        self.assertEqual(len(lazy_iocm), 2)
+
+    def test_lazy_workers(self):
+        # Only the file headers are read, so workers are not started
+        lazy_iocm = managers.IOCManager(lazy=True)
+        self.assertEqual(lazy_iocm.insert(OPENIOC_11_ASSETS, workers=2), [])
+        self.assertEqual(len(lazy_iocm), 4)
+        self.assertFalse(any(lazy_iocm.iocs.is_resident(iocid) for iocid in lazy_iocm.iocs))
+
+    def test_lazy_max_bytes(self):
+        lazy_iocm = managers.IOCManager(lazy=True, max_resident_bytes=1)
+        lazy_iocm.insert(OPENIOC_11_ASSETS)
+        for ioc_obj in lazy_iocm.iocs.values():
+            self.assertIsInstance(ioc_obj, ioc_api.IOC)
+        self.assertEqual(len(lazy_iocm.iocs.resident), 1)
+
+    def test_lazy_pinned(self):
+        lazy_iocm = managers.IOCManager(lazy=True, max_resident=1)
+        lazy_iocm.insert(OPENIOC_11_ASSETS)
+        ioc_obj = ioc_api.IOC(name='Pinned')
+        lazy_iocm.parse(ioc_obj)
+        for iocid in list(lazy_iocm.iocs):
+            lazy_iocm.iocs[iocid]
+        self.assertIs(lazy_iocm.iocs[ioc_obj.iocid], ioc_obj)
+        self.assertEqual(len(lazy_iocm), 5)
+
+    def test_lazy_callback(self):
+        test_iocm = IOCTestManager()
+        test_iocm.insert(OPENIOC_11_ASSETS)
+        lazy_iocm = IOCTestManager()
+        lazy_iocm.iocs = lazy.LazyIOCStore(lazy_iocm._load_handle, max_resident=1)
+        lazy_iocm.lazy = True
+        lazy_iocm.insert(OPENIOC_11_ASSETS)
+        self.assertDictEqual(lazy_iocm.child_count, test_iocm.child_count)
+        self.assertEqual(len(lazy_iocm.iocs.resident), 1)
+        self.assertEqual(len(lazy_iocm), 4)
+
+    def test_read_ioc_header(self):
+        fp = os.path.join(OPENIOC_11_ASSETS, '378f0cce-b8df-41d5-8189-3d7ec102e52f.ioc')
+        self.assertEqual(lazy.read_ioc_header(fp), ('378f0cce-b8df-41d5-8189-3d7ec102e52f', 'Prune'))
+
+
+class TestScan(unittest.TestCase):
+    def test_read_ioc_metadata(self):
+        fp = os.path.join(OPENIOC_11_ASSETS, '378f0cce-b8df-41d5-8189-3d7ec102e52f.ioc')
+        record = scan.read_ioc_metadata(fp)
+        ioc_obj = ioc_api.IOC(fp)
+        self.assertEqual(record.path, fp)
+        self.assertEqual(record.iocid, ioc_obj.iocid)
+        self.assertEqual(record.version, '1.1')
+        self.assertEqual(record.last_modified, '2015-12-18T23:05:08Z')
+        self.assertEqual(record.short_description, 'Prune')
+        self.assertEqual(record.authored_by, 'william.gibb@fireeye.com')
+        self.assertIsNone(record.keywords)
+        self.assertEqual(record.links, ())
+
+    def test_read_ioc_metadata_links(self):
+        ioc_obj = ioc_api.IOC(name='Links', keywords='foo bar')
+        ioc_obj.add_link('grade', 'Alpha')
+        ioc_obj.add_link('report', 'Report text', href='http://example.com/report')
+        fd, fp = tempfile.mkstemp(suffix='.ioc')
+        os.close(fd)
+        try:
+            with open(fp, 'wb') as f:
+                f.write(ioc_obj.write_ioc_to_string())
+            record = scan.read_ioc_metadata(fp)
+        finally:
+            os.remove(fp)
+        self.assertEqual(record.iocid, ioc_obj.iocid)
+        self.assertEqual(record.short_description, 'Links')
+        self.assertEqual(record.keywords, 'foo bar')
+        self.assertEqual(record.links, (('grade', None, 'Alpha'),
+                                        ('report', 'http://example.com/report', 'Report text')))
+
+    def test_scan_iocs(self):
+        fns = sorted(managers.iter_ioc_files(OPENIOC_11_ASSETS))
+        fns.append(os.path.join(OPENIOC_11_ASSETS, 'missing.ioc'))
+        results = list(scan.scan_iocs(fns))
+        self.assertEqual([fn for fn, _ in results], fns)
+        self.assertIsInstance(results[-1][1], ioc_api.IOCParseError)
+        parallel = list(scan.scan_iocs(fns, workers=2))
+        self.assertEqual(parallel[:-1], results[:-1])
+        self.assertIsInstance(parallel[-1][1], ioc_api.IOCParseError)
+
+
+class TestIOCIndex(unittest.TestCase):
+    def test_abstract(self):
+        self.assertRaises(TypeError, index.IOCIndex)
+
+        class PartialIndex(index.IOCIndex):
+            def _add_ioc(self, ioc_obj):
+                pass
+
+        self.assertRaises(TypeError, PartialIndex)
+        self.assertIsInstance(index.ItemIndex(), index.IOCIndex)
+
+
+class TestItemIndex(unittest.TestCase):
+    def setUp(self):
+        self.iocm = managers.IOCManager(item_index=index.ItemIndex())
+        self.iocm.insert(OPENIOC_11_ASSETS)
+
+    def walk(self, search=None, condition=None, content=None):
+        results = []
+        for iocid, ioc_obj in self.iocm.iocs.items():
+            for node in ioc_obj.top_level_indicator.iter('IndicatorItem'):
+                if search is not None and node.find('Context').get('search') != search:
+                    continue
+                if condition is not None and node.get('condition') != condition:
+                    continue
+                if content is not None and index.normalize_content(node.findtext('Content')) != content.lower():
+                    continue
+                results.append((iocid, node.get('id')))
+        return sorted(results)
+
+    def test_find(self):
+        item_index = self.iocm.item_index
+        self.assertEqual(len(item_index), 4)
+        for search, condition, content in (('FileItem/Md5sum', None, None),
+                                           ('FileItem/FileName', 'contains', None),
+                                           ('FileItem/FileName', None, 'QUACK'),
+                                           (None, None, 'quack'),
+                                           (None, 'is', 'quack'),
+                                           ('FileItem/Md5sum', 'is', '23456789ABCDEF0123456789abcdef01')):
+            expected = self.walk(search, condition, content)
+            self.assertEqual(sorted(item_index.find(search, condition, content)), expected)
+            self.assertEqual(item_index.find_iocids(search, condition, content),
+                             set(iocid for iocid, nid in expected))
+        self.assertTrue(self.walk('FileItem/Md5sum'))
+        self.assertEqual(item_index.find('NoSuchItem/Search'), [])
+        self.assertEqual(item_index.find(content='no such content'), [])
+        with self.assertRaises(ValueError):
+            item_index.find(condition='is')
+
+    def test_remove(self):
+        iocid = '378f0cce-b8df-41d5-8189-3d7ec102e52f'
+        self.assertIn(iocid, self.iocm.item_index.find_iocids('FileItem/Md5sum'))
+        self.iocm.remove(iocid)
+        self.assertNotIn(iocid, self.iocm.item_index)
+        self.assertEqual(sorted(self.iocm.item_index.find('FileItem/FileName')), self.walk('FileItem/FileName'))
+        self.assertEqual(self.iocm.item_index.find('FileItem/SizeInBytes'), [])
+
+    def test_refresh(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            ioc_obj = ioc_api.IOC(name='Indexed')
+            ioc_obj.add_item(None, 'is', 'FileItem', 'FileItem/Md5sum', 'md5', 'aaaa')
+            ioc_obj.write_ioc_to_file(tmp_dir)
+            fp = os.path.join(tmp_dir, '{}.ioc'.format(ioc_obj.iocid))
+            iocm = managers.IOCManager(lazy=True, item_index=index.ItemIndex())
+            iocm.insert(tmp_dir)
+            self.assertEqual(iocm.item_index.find_iocids(content='AAAA'), {ioc_obj.iocid})
+            ioc_obj.remove_indicator(ioc_obj.top_level_indicator[0].get('id'))
+            ioc_obj.add_item(None, 'is', 'FileItem', 'FileItem/Md5sum', 'md5', 'bbbb')
+            ioc_obj.write_ioc_to_file(tmp_dir, force=True)
+            st = os.stat(fp)
+            os.utime(fp, (st.st_atime, st.st_mtime + 10))
+            self.assertEqual(iocm.refresh()['modified'], [ioc_obj.iocid])
+            self.assertEqual(iocm.item_index.find(content='aaaa'), [])
+            self.assertEqual(iocm.item_index.find_iocids(content='bbbb'), {ioc_obj.iocid})
+            os.remove(fp)
+            self.assertEqual(iocm.refresh()['removed'], [ioc_obj.iocid])
+            self.assertEqual(len(iocm.item_index), 0)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+class TestTrigramIndex(unittest.TestCase):
+    def setUp(self):
+        self.iocm = managers.IOCManager(text_index=index.TrigramIndex())
+        self.iocm.insert(OPENIOC_11_ASSETS)
+
+    def walk(self, text, case_sensitive=False):
+        results = set()
+        for iocid, ioc_obj in self.iocm.iocs.items():
+            for node in ioc_obj.top_level_indicator.iter('IndicatorItem'):
+                content = node.findtext('Content') or ''
+                if (case_sensitive and text in content) or (not case_sensitive and text.lower() in content.lower()):
+                    results.add((iocid, node.get('id')))
+        return results
+
+    def test_find_content(self):
+        text_index = self.iocm.text_index
+        self.assertEqual(len(text_index), 4)
+        for text in ('quack', 'QUACK', 'Temp', 'abcdef01', 'ex', 'e'):
+            expected = self.walk(text)
+            self.assertTrue(expected)
+            results = set(r for r in text_index.find(text) if r[1] not in index.METADATA_TEXT_TAGS + ('link',))
+            self.assertEqual(results, expected)
+        self.assertEqual(text_index.find('no such text'), [])
+        self.assertEqual(text_index.find('QUACK', case_sensitive=True), [])
+        self.assertEqual(set(text_index.find('quack', case_sensitive=True)), self.walk('quack', case_sensitive=True))
+
+    def test_find_metadata(self):
+        ioc_obj = ioc_api.IOC(name='Svchost masquerading', description='Runs from %TEMP%', author='analyst',
+                              links=[('report', None, 'Report 1234')])
+        self.iocm.parse(ioc_obj)
+        self.assertEqual(self.iocm.text_index.find('MASQUERAD'), [(ioc_obj.iocid, 'short_description')])
+        self.assertEqual(self.iocm.text_index.find('%temp%'), [(ioc_obj.iocid, 'description')])
+        self.assertEqual(self.iocm.text_index.find('ort 12'), [(ioc_obj.iocid, 'link')])
+        ioc_obj.update_name('Renamed')
+        self.iocm.parse(ioc_obj)
+        self.assertEqual(self.iocm.text_index.find('masquerad'), [])
+        self.iocm.remove(ioc_obj.iocid)
+        self.assertEqual(self.iocm.text_index.find('%temp%'), [])
+        self.assertNotIn(ioc_obj.iocid, self.iocm.text_index)
+
+
+class TestMetadataIndex(unittest.TestCase):
+    def setUp(self):
+        self.iocm = managers.IOCManager(item_index=index.ItemIndex(), metadata_index=index.MetadataIndex())
+        self.iocs = []
+        for i in range(10):
+            ioc_obj = ioc_api.IOC(name='IOC {}'.format(i),
+                                  author='Author{}'.format(i % 3),
+                                  keywords='shared kw{}'.format(i),
+                                  links=[('grade', None, 'Alpha' if i % 2 else 'Beta')])
+            ioc_obj.set_lastmodified_date('2015-01-{:02d}T00:00:00'.format(10 - i))
+            self.iocm.parse(ioc_obj)
+            self.iocs.append(ioc_obj)
+
+    def test_modified_between(self):
+        metadata_index = self.iocm.metadata_index
+        self.assertEqual(len(metadata_index), 10)
+        iocids = [ioc_obj.iocid for ioc_obj in self.iocs]
+        self.assertEqual(metadata_index.modified_between(), iocids[::-1])
+        self.assertEqual(metadata_index.modified_since('2015-01-08T00:00:00'), iocids[2::-1])
+        self.assertEqual(metadata_index.modified_between('2015-01-02T00:00:00Z', '2015-01-04T00:00:00'),
+                         iocids[8:6:-1])
+        self.assertEqual(metadata_index.modified_since(datetime.datetime(2015, 1, 10)), [iocids[0]])
+        self.assertEqual(metadata_index.modified_since('2016-01-01T00:00:00'), [])
+
+    def test_hashed_indexes(self):
+        metadata_index = self.iocm.metadata_index
+        self.assertEqual(metadata_index.find_by_author('author1'),
+                         set(self.iocs[i].iocid for i in (1, 4, 7)))
+        self.assertEqual(len(metadata_index.find_by_keyword('SHARED')), 10)
+        self.assertEqual(metadata_index.find_by_keyword('kw3'), {self.iocs[3].iocid})
+        self.assertEqual(len(metadata_index.find_by_link('grade')), 10)
+        self.assertEqual(metadata_index.find_by_link('grade', 'alpha'),
+                         set(self.iocs[i].iocid for i in (1, 3, 5, 7, 9)))
+        self.assertEqual(metadata_index.find_by_link('report'), set())
+
+    def test_mutation(self):
+        metadata_index = self.iocm.metadata_index
+        ioc_obj = self.iocs[0]
+        ioc_obj.set_lastmodified_date('2014-01-01T00:00:00')
+        ioc_obj.add_link('report', 'http://example.com')
+        ioc_obj.update_name('Renamed')
+        ioc_obj.add_item(None, 'is', 'FileItem', 'FileItem/Md5sum', 'md5', 'abcd')
+        self.assertEqual(metadata_index.modified_between(end='2015-01-01T00:00:00'), [ioc_obj.iocid])
+        self.assertEqual(metadata_index.find_by_link('report'), {ioc_obj.iocid})
+        self.assertEqual(self.iocm.item_index.find_iocids(content='ABCD'), {ioc_obj.iocid})
+        self.assertEqual(self.iocm.ioc_name[ioc_obj.iocid], 'Renamed')
+        # Elements changed directly are picked up by reindex()
+        ioc_obj.metadata.find('authored_by').text = 'Direct'
+        self.assertEqual(metadata_index.find_by_author('direct'), set())
+        self.iocm.reindex(ioc_obj.iocid)
+        self.assertEqual(metadata_index.find_by_author('direct'), {ioc_obj.iocid})
+        # Changes to IOCs which were removed or replaced are ignored
+        self.iocm.remove(ioc_obj.iocid)
+        ioc_obj.add_link('report', 'http://example.com/2')
+        self.assertEqual(metadata_index.find_by_link('report'), set())
+        self.assertNotIn(ioc_obj.iocid, metadata_index)
+        replaced = self.iocs[1]
+        self.iocm.parse(ioc_api.IOC.from_bytes(replaced.write_ioc_to_string()))
+        replaced.add_link('report', 'http://example.com/3')
+        self.assertEqual(metadata_index.find_by_link('report'), set())
+        self.assertEqual(replaced._change_callbacks, [])
+
+
+class TestStructuralHash(unittest.TestCase):
+    @staticmethod
+    def make_ioc(name, md5s, path, reverse=False):
+        ioc_obj = ioc_api.IOC(name=name)
+        and_node = ioc_obj.add_indicator(None, 'AND')
+        items = [('FileItem/Md5sum', 'md5', md5) for md5 in md5s]
+        items.append(('FileItem/FullPath', 'string', path))
+        if reverse:
+            items.reverse()
+        for search, content_type, content in items:
+            ioc_obj.add_item(and_node.get('id'), 'is', 'FileItem', search, content_type, content)
+        return ioc_obj
+
+    def test_structural_hash(self):
+        ioc_obj = self.make_ioc('First', ['aa', 'bb'], 'C:\\Evil.exe')
+        fingerprint = ioc_obj.structural_hash()
+        self.assertEqual(len(fingerprint), 40)
+        # Ids, metadata, child order, duplicate children and case insensitive content are ignored
+        same = self.make_ioc('Second', ['BB ', 'aa', 'bb'], 'c:\\evil.exe', reverse=True)
+        self.assertEqual(same.structural_hash(), fingerprint)
+        self.assertEqual(ioc_api.IOC.from_bytes(ioc_obj.write_ioc_to_string()).structural_hash(), fingerprint)
+        self.assertNotEqual(self.make_ioc('Third', ['aa'], 'C:\\Evil.exe').structural_hash(), fingerprint)
+        # The cached hash is cleared when the IOC is modified
+        ioc_obj.add_item(None, 'is', 'FileItem', 'FileItem/Md5sum', 'md5', 'cc')
+        self.assertNotEqual(ioc_obj.structural_hash(), fingerprint)
+        ioc_obj.add_parameter(ioc_obj.top_level_indicator.get('id'), content='param')
+        self.assertNotEqual(ioc_obj.structural_hash(), same.structural_hash())
+        ioc_obj.top_level_indicator = None
+        ioc_obj.mark_changed()
+        self.assertIsNone(ioc_obj.structural_hash())
+
+    def test_collapse_duplicates(self):
+        iocm = IOCTestManager()
+        iocm.collapse_duplicates = True
+        iocm.fingerprint_index = index.FingerprintIndex()
+        iocs = [self.make_ioc('IOC 0', ['aa'], 'x'),
+                self.make_ioc('IOC 1', ['aa'], 'X', reverse=True),
+                self.make_ioc('IOC 2', ['bb'], 'x'),
+                self.make_ioc('IOC 3', ['AA'], 'x')]
+        for ioc_obj in iocs:
+            iocm.parse(ioc_obj)
+        iocids = [ioc_obj.iocid for ioc_obj in iocs]
+        self.assertEqual(len(iocm), 4)
+        self.assertEqual(set(iocm.child_count), {iocids[0], iocids[2]})
+        fingerprint_index = iocm.fingerprint_index
+        self.assertEqual(fingerprint_index.get_group(iocids[3]), [iocids[0], iocids[1], iocids[3]])
+        self.assertEqual(fingerprint_index.get_duplicates(), {iocids[1]: iocids[0], iocids[3]: iocids[0]})
+        self.assertEqual(list(fingerprint_index.iter_duplicate_groups()), [[iocids[0], iocids[1], iocids[3]]])
+        # Parsing the canonical IOC again keeps its place in the group
+        iocm.parse(ioc_api.IOC.from_bytes(iocs[0].write_ioc_to_string()))
+        self.assertEqual(fingerprint_index.get_canonical(iocids[3]), iocids[0])
+        # Removing the canonical IOC passes the next IOC of the group to the parser callback
+        iocm.remove(iocids[0])
+        self.assertIn(iocids[1], iocm.child_count)
+        self.assertEqual(fingerprint_index.get_duplicates(), {iocids[3]: iocids[1]})
+        self.assertEqual(fingerprint_index.find(iocs[1].structural_hash()), [iocids[1], iocids[3]])
+
+
+class TestContentHash(unittest.TestCase):
+    def setUp(self):
+        self.fn = sorted(managers.iter_ioc_files(OPENIOC_11_ASSETS))[0]
+        self.ioc_obj = ioc_api.IOC(self.fn)
+
+    def test_canonical_form(self):
+        canonical = self.ioc_obj.write_ioc_to_canonical()
+        self.assertNotIn(b'\n  <', canonical)
+        # Formatting, encoding and comments do not change the canonical form
+        config = xmlutils.ParserConfig(remove_blank_text=False, remove_comments=False)
+        with open(self.fn, 'rb') as f:
+            data = f.read()
+        formatted = ioc_api.IOC.from_tree(xmlutils.read_xml_bytes_no_ns(data, config))
+        formatted.metadata.append(et.Comment('comment'))
+        self.assertEqual(formatted.write_ioc_to_canonical(), canonical)
+        # The formatting of the IOC itself is left alone
+        self.assertEqual(formatted.root.text.strip(), '')
+        utf16 = et.tostring(self.ioc_obj.root.getroottree(), encoding='utf-16', xml_declaration=True)
+        self.assertEqual(ioc_api.IOC.from_bytes(utf16).write_ioc_to_canonical(), canonical)
+        self.assertRaises(ValueError, ioc_api.write_ioc_canonical, self.ioc_obj.metadata)
+
+    def test_canonical_namespace(self):
+        canonical = self.ioc_obj.write_ioc_to_canonical()
+        # The namespace is a declaration, which comes before the attributes of the root element
+        self.assertTrue(canonical.startswith(b'<OpenIOC xmlns="http://openioc.org/schemas/OpenIOC_1.1" xmlns:'))
+        parser = et.XMLParser(remove_blank_text=True, remove_comments=True)
+        expected = et.tostring(et.parse(self.fn, parser).getroot(), method='c14n', with_comments=False)
+        self.assertEqual(canonical, expected)
+
+    def test_content_hash(self):
+        content_hash = self.ioc_obj.content_hash()
+        self.assertEqual(len(content_hash), 64)
+        copied = ioc_api.IOC.from_bytes(self.ioc_obj.write_ioc_to_string())
+        self.assertEqual(copied.content_hash(), content_hash)
+        # The cached hash is cleared when the IOC is modified
+        copied.update_description('Changed')
+        self.assertNotEqual(copied.content_hash(), content_hash)
+        copied.remove_description()
+        self.assertNotEqual(copied.content_hash(), content_hash)
+
+
+class TestSourcePassthrough(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.fn = sorted(managers.iter_ioc_files(OPENIOC_11_ASSETS))[0]
+        with open(self.fn, 'rb') as f:
+            self.data = f.read()
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_source(self):
+        for ioc_obj in (ioc_api.IOC(self.fn, keep_source=True),
+                        ioc_api.IOC.from_file(self.fn, keep_source=True),
+                        ioc_api.IOC.from_bytes(bytearray(self.data), keep_source=True)):
+            self.assertEqual(ioc_obj.source, self.data)
+            self.assertFalse(ioc_obj.dirty)
+            self.assertEqual(ioc_obj.write_ioc_to_string(passthrough=True), self.data)
+            # The IOC is serialized unless passthrough is requested
+            self.assertNotEqual(ioc_obj.write_ioc_to_string(), self.data)
+        # The source is only kept if requested
+        for ioc_obj in (ioc_api.IOC(name='New'),
+                        ioc_api.IOC(self.fn),
+                        ioc_api.IOC.from_file(self.fn),
+                        ioc_api.IOC.from_bytes(memoryview(self.data))):
+            self.assertIsNone(ioc_obj.source)
+            self.assertTrue(ioc_obj.write_ioc_to_string(passthrough=True).startswith(b'<?xml'))
+
+    def test_manager_keep_source(self):
+        iocm = managers.IOCManager()
+        iocm.insert(OPENIOC_11_ASSETS)
+        self.assertTrue(all(ioc_obj.source is None for ioc_obj in iocm.iocs.values()))
+        iocm = managers.IOCManager(keep_source=True)
+        iocm.insert(self.fn)
+        ioc_obj = list(iocm.iocs.values())[0]
+        self.assertEqual(ioc_obj.write_ioc_to_string(passthrough=True), self.data)
+
+    def test_write_clean(self):
+        ioc_obj = ioc_api.IOC.from_file(self.fn, keep_source=True)
+        self.assertTrue(ioc_obj.write_ioc_to_file(self.tempdir, passthrough=True))
+        fn = os.path.join(self.tempdir, ioc_obj.iocid + '.ioc')
+        with open(fn, 'rb') as f:
+            self.assertEqual(f.read(), self.data)
+        # An identical file is not rewritten
+        os.utime(fn, (0, 0))
+        self.assertTrue(ioc_obj.write_ioc_to_file(self.tempdir, passthrough=True))
+        self.assertEqual(os.stat(fn).st_mtime, 0)
+
+    def test_write_dirty(self):
+        ioc_obj = ioc_api.IOC.from_file(self.fn, keep_source=True)
+        ioc_obj.update_name('Changed')
+        self.assertTrue(ioc_obj.dirty)
+        self.assertIn(b'Changed', ioc_obj.write_ioc_to_string(passthrough=True))
+        ioc_obj.write_ioc_to_file(self.tempdir, passthrough=True)
+        written = ioc_api.IOC.from_file(os.path.join(self.tempdir, ioc_obj.iocid + '.ioc'))
+        self.assertEqual(written.metadata.findtext('short_description'), 'Changed')
+        # Direct changes are always written by default, and by a passthrough write once reported
+        ioc_obj = ioc_api.IOC.from_file(self.fn, keep_source=True)
+        ioc_obj.top_level_indicator.append(ioc_api.make_indicatoritem_node('is', 'FileItem', 'FileItem/Md5sum', 'md5',
+                                                                           'feedface'))
+        self.assertFalse(ioc_obj.dirty)
+        self.assertIn(b'feedface', ioc_obj.write_ioc_to_string())
+        ioc_obj.write_ioc_to_file(self.tempdir)
+        with open(os.path.join(self.tempdir, ioc_obj.iocid + '.ioc'), 'rb') as f:
+            self.assertIn(b'feedface', f.read())
+        self.assertEqual(ioc_obj.write_ioc_to_string(passthrough=True), self.data)
+        ioc_obj.mark_changed()
+        self.assertIn(b'feedface', ioc_obj.write_ioc_to_string(passthrough=True))
+
+
+class TestArchives(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.fns = sorted(managers.iter_ioc_files(OPENIOC_11_ASSETS))
+        self.iocm = managers.IOCManager()
+        self.iocm.insert(OPENIOC_11_ASSETS)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def make_zip(self, fns):
+        fp = os.path.join(self.tempdir, 'iocs.zip')
+        with zipfile.ZipFile(fp, 'w', zipfile.ZIP_DEFLATED) as zf:
+            for fn in fns:
+                zf.write(fn, 'drop/' + os.path.basename(fn))
+            zf.writestr('drop/README.txt', 'not an ioc')
+        return fp
+
+    def assertSameIOCs(self, iocm, iocids):
+        self.assertEqual(set(iocm.iocs), set(iocids))
+        for iocid in iocids:
+            self.assertEqual(str(iocm.iocs[iocid]), str(self.iocm.iocs[iocid]))
+
+    def test_insert_zip(self):
+        fp = self.make_zip(self.fns)
+        iocm = managers.IOCManager()
+        self.assertEqual(iocm.insert(fp), [])
+        self.assertSameIOCs(iocm, self.iocm.iocs)
+        expected_paths = [os.path.join(os.path.abspath(fp), 'drop', os.path.basename(fn)) for fn in self.fns]
+        self.assertEqual(sorted(iocm.ioc_members), expected_paths)
+
+    def test_insert_tar(self):
+        fp = os.path.join(self.tempdir, 'iocs.tar.gz')
+        with tarfile.open(fp, 'w:gz') as tf:
+            for fn in self.fns:
+                tf.add(fn, os.path.basename(fn))
+        iocm = managers.IOCManager()
+        self.assertEqual(iocm.insert(fp), [])
+        self.assertSameIOCs(iocm, self.iocm.iocs)
+
+    def test_iter_insert_gzip(self):
+        fp = os.path.join(self.tempdir, os.path.basename(self.fns[0]) + '.gz')
+        with open(self.fns[0], 'rb') as fin:
+            with gzip.open(fp, 'wb') as fout:
+                fout.write(fin.read())
+        iocm = managers.IOCManager()
+        results = list(iocm.iter_insert(fp))
+        self.assertEqual(len(results), 1)
+        member_path, ioc_obj = results[0]
+        self.assertEqual(member_path, os.path.join(os.path.abspath(fp), os.path.basename(self.fns[0])))
+        self.assertSameIOCs(iocm, [ioc_obj.iocid])
+
+    def test_bad_archive(self):
+        fp = os.path.join(self.tempdir, 'iocs.zip')
+        with open(fp, 'wb') as f:
+            f.write(b'not a zip file')
+        iocm = managers.IOCManager()
+        self.assertEqual(iocm.insert(fp), [fp])
+        self.assertEqual(len(iocm), 0)
+
+    def test_refresh_archive(self):
+        fp = self.make_zip(self.fns)
+        iocm = managers.IOCManager()
+        iocm.insert(fp)
+        report = iocm.refresh()
+        self.assertEqual(report, {'added': [], 'modified': [], 'removed': [], 'errors': []})
+        removed = ioc_api.IOC(self.fns[0]).iocid
+        os.remove(fp)
+        fp = self.make_zip(self.fns[1:])
+        st = os.stat(fp)
+        os.utime(fp, (st.st_atime, st.st_mtime + 10))
+        report = iocm.refresh()
+        self.assertEqual(report['removed'], [removed])
+        self.assertEqual(report['added'], [])
+        self.assertEqual(len(report['modified']), 3)
+        self.assertNotIn(removed, iocm.iocs)
+        self.assertEqual(len(iocm.ioc_members), 3)
+
+
+class TestBundles(unittest.TestCase):
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.iocm = managers.IOCManager()
+        self.iocm.insert(OPENIOC_11_ASSETS)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def make_bundle(self, roots):
+        fp = os.path.join(self.tempdir, 'bundle.xml')
+        with open(fp, 'wb') as f:
+            f.write(b'<?xml version="1.0" encoding="utf-8"?>\n<feed><title>IOC feed</title>')
+            for root in roots:
+                f.write(et.tostring(root))
+            f.write(b'</feed>')
+        return fp
+
+    def test_iter_bundle(self):
+        roots = [et.parse(fn).getroot() for fn in sorted(managers.iter_ioc_files(OPENIOC_11_ASSETS))]
+        fp = self.make_bundle(roots)
+        iocs = list(ioc_api.IOC.iter_bundle(fp))
+        self.assertEqual([ioc_obj.iocid for ioc_obj in iocs], [root.get('id') for root in roots])
+        for ioc_obj in iocs:
+            self.assertIsNone(ioc_obj.root.getparent())
+            self.assertEqual(ioc_obj.root.tag, 'OpenIOC')
+            self.assertEqual(str(ioc_obj), str(self.iocm.iocs[ioc_obj.iocid]))
+
+    def test_insert_bundle(self):
+        roots = [et.parse(fn).getroot() for fn in sorted(managers.iter_ioc_files(OPENIOC_11_ASSETS))]
+        bad_root = et.fromstring(b'<OpenIOC xmlns="http://openioc.org/schemas/OpenIOC_1.1" id="bad"><metadata/>'
+                                 b'</OpenIOC>')
+        fp = self.make_bundle(roots[:2] + [bad_root] + roots[2:])
+        iocm = managers.IOCManager()
+
+        def callback(ioc_obj):
+            if ioc_obj.iocid == 'bad':
+                raise ioc_api.IOCParseError('bad IOC')
+
+        iocm.register_parser_callback(callback)
+        self.assertEqual(iocm.insert_bundle(fp), ['{}#2'.format(fp)])
+        self.assertEqual(set(iocm.iocs), set(self.iocm.iocs).union(['bad']))
+        for iocid, ioc_obj in self.iocm.iocs.items():
+            self.assertEqual(str(iocm.iocs[iocid]), str(ioc_obj))
+
+    def test_truncated_bundle(self):
+        roots = [et.parse(fn).getroot() for fn in sorted(managers.iter_ioc_files(OPENIOC_11_ASSETS))]
+        fp = self.make_bundle(roots)
+        with open(fp, 'rb') as f:
+            data = f.read()
+        with open(fp, 'wb') as f:
+            f.write(data[:-5])
+        iocm = managers.IOCManager()
+        self.assertEqual(iocm.insert_bundle(fp), [fp])
+        self.assertEqual(len(iocm), 4)
+        with self.assertRaises(ioc_api.IOCParseError):
+            list(ioc_api.IOC.iter_bundle(fp))
+
+    def test_upgrade_bundle(self):
+        downgrade_iocm = downgrade_11.DowngradeManager()
+        downgrade_iocm.insert(OPENIOC_11_ASSETS)
+        downgrade_iocm.convert_to_10()
+        fp = self.make_bundle([ioc_obj.root for ioc_obj in downgrade_iocm.iocs_10.values()])
+        upgrade_iocm = upgrade_10.UpgradeManager()
+        self.assertEqual(upgrade_iocm.insert_bundle(fp), [])
+        self.assertEqual(set(upgrade_iocm.iocs), set(downgrade_iocm.iocs_10))
+        for ioc_xml in upgrade_iocm.iocs.values():
+            self.assertEqual(ioc_xml.getroot().tag, 'ioc')
+        self.assertEqual(upgrade_iocm.convert_to_11(), [])
+        self.assertEqual(set(upgrade_iocm.iocs_11), set(downgrade_iocm.iocs_10))
+
+
+@unittest.skipIf(sys.version_info < (3, 7), 'asyncio API requires Python 3.7')
+class TestAsyncIO(unittest.TestCase):
+    def setUp(self):
+        from ioc_writer.managers import aio
+        self.aio = aio
+        self.loop = asyncio.new_event_loop()
+        self.iocm = managers.IOCManager()
+        self.iocm.insert(OPENIOC_11_ASSETS)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def collect(self, agen):
+        results = []
+        while True:
+            try:
+                results.append(self.loop.run_until_complete(agen.__anext__()))
+            except StopAsyncIteration:
+                return results
+
+    def test_aiter_iocs(self):
+        fns = list(managers.iter_ioc_files(OPENIOC_11_ASSETS))
+        results = self.collect(self.aio.aiter_iocs([OPENIOC_11_ASSETS, fns[0]], concurrency=2))
+        self.assertEqual([fn for fn, _ in results], fns + fns[:1])
+        for fn, ioc_obj in results:
+            self.assertEqual(str(ioc_obj), str(self.iocm.iocs[ioc_obj.iocid]))
+
+    def test_ainsert(self):
+        iocm = managers.IOCManager()
+        errors = self.loop.run_until_complete(iocm.ainsert(OPENIOC_11_ASSETS, concurrency=2))
+        self.assertEqual(errors, [])
+        self.assertDictEqual(iocm.ioc_name, self.iocm.ioc_name)
+        for iocid, ioc_obj in iocm.iocs.items():
+            self.assertEqual(str(ioc_obj), str(self.iocm.iocs[iocid]))
+        self.assertEqual(iocm.refresh(), {'added': [], 'modified': [], 'removed': [], 'errors': []})
+
+    def test_ainsert_lazy_callback(self):
+        test_iocm = IOCTestManager()
+        self.loop.run_until_complete(test_iocm.ainsert(OPENIOC_11_ASSETS))
+        self.assertEqual(len(test_iocm.child_count), 4)
+        lazy_iocm = managers.IOCManager(lazy=True)
+        self.loop.run_until_complete(lazy_iocm.ainsert(OPENIOC_11_ASSETS))
+        self.assertDictEqual(lazy_iocm.ioc_name, self.iocm.ioc_name)
+        self.assertFalse(any(lazy_iocm.iocs.is_resident(iocid) for iocid in lazy_iocm.iocs))
+
+    def test_ainsert_archive(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            fp = os.path.join(tempdir, 'iocs.tar.gz')
+            with tarfile.open(fp, 'w:gz') as tf:
+                for fn in managers.iter_ioc_files(OPENIOC_11_ASSETS):
+                    tf.add(fn, arcname=os.path.basename(fn))
+                bad = os.path.join(tempdir, 'bad.ioc')
+                with open(bad, 'wb') as f:
+                    f.write(b'<OpenIOC')
+                tf.add(bad, arcname='bad.ioc')
+            test_iocm = IOCTestManager()
+            threads = set()
+            callback = test_iocm.parser_callback
+            test_iocm.register_parser_callback(lambda ioc_obj: (threads.add(threading.current_thread()),
+                                                                callback(ioc_obj)))
+            errors = self.loop.run_until_complete(test_iocm.ainsert(fp, concurrency=2))
+            self.assertEqual(errors, [archive.get_member_path(os.path.abspath(fp), 'bad.ioc')])
+            self.assertDictEqual(test_iocm.ioc_name, self.iocm.ioc_name)
+            self.assertEqual(len(test_iocm.child_count), 4)
+            # Parsed IOCs are handed to the manager on the event loop thread
+            self.assertEqual(threads, {threading.current_thread()})
+            self.assertEqual(test_iocm.refresh()['modified'], [])
+        finally:
+            shutil.rmtree(tempdir)
+
+    def test_cancel(self):
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow(fn):
+            started.set()
+            release.wait(5)
+            return fn
+
+        agen = self.aio._amap(slow, range(10), 2, executor)
+        task = self.loop.create_task(agen.__anext__())
+        self.loop.run_until_complete(self.loop.run_in_executor(None, started.wait, 5))
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            self.loop.run_until_complete(task)
+        self.loop.run_until_complete(agen.aclose())
+        release.set()
+        executor.shutdown(wait=True)
+
+
 class TestDowngrade(unittest.TestCase):
     def setUp(self):
         self.iocm = managers.downgrade_11.DowngradeManager()